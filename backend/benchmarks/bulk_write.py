@@ -0,0 +1,128 @@
+"""
+爬蟲結果寫入速度測試: 逐筆建立 ORM 物件 vs BulkWriter (COPY)
+
+資料表建立在獨立的 schema 中，結束後會刪除。
+
+    python benchmarks/bulk_write.py --rows 10000 100000
+"""
+import sys
+import time
+import random
+import argparse
+import datetime
+from pathlib import Path
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import db_model  # noqa: E402
+import writer  # noqa: E402
+from settings import settings  # noqa: E402
+
+SCHEMA = "bench_write"
+
+
+def make_shop_products(rows: int) -> pd.DataFrame:
+    # 欄位與 AioShopProductsCrawler 回傳的 DataFrame 相同
+    now = int(datetime.datetime.now().timestamp())
+    items = []
+    for i in range(rows):
+        price = random.randint(100, 50000) * 100000
+        items.append(
+            {
+                "itemid": 10_000_000 + i,
+                "shopid": random.randint(1, 50),
+                "name": "測試商品 Test Product {}".format(i),
+                "currency": "TWD",
+                "stock": random.randint(0, 500),
+                "status": 1,
+                "ctime": now - random.randint(0, 86400 * 365),
+                "sold": random.randint(0, 100),
+                "price": price,
+                "price_min": price,
+                "price_max": price,
+                "price_min_before_discount": -1,
+                "price_max_before_discount": -1,
+                "price_before_discount": 0,
+                "discount": None,
+            }
+        )
+    return pd.DataFrame(items)
+
+
+def write_orm(Session, shop_products_df):
+    # 改用 BulkWriter 之前 ShopeeRunner.crawl_product_to_db 的寫法
+    shop_products = shop_products_df.to_dict(orient="records")
+    with Session() as db:
+        product_objs = []
+        for shop_product in shop_products:
+            product_obj = db_model.shopee.ShopeeProduct()
+            for k in shop_product:
+                if k.startswith("price") and shop_product[k] != -1:
+                    setattr(product_obj, k, shop_product[k] / 100000)
+                else:
+                    setattr(product_obj, k, shop_product[k])
+            product_obj.item_created_time = datetime.datetime.fromtimestamp(
+                shop_product["ctime"]
+            )
+            product_objs.append(product_obj)
+
+        db.add_all(product_objs)
+        db.commit()
+
+
+def write_bulk(bulk_writer, shop_products_df):
+    # 與 ShopeeRunner.crawl_product_to_db 相同
+    df = shop_products_df.copy()
+    for k in df.columns:
+        if k.startswith("price"):
+            df[k] = df[k].where(df[k] == -1, df[k] / 100000)
+    df["item_created_time"] = df["ctime"].map(datetime.datetime.fromtimestamp)
+    df["crawled_at"] = datetime.datetime.now()
+
+    bulk_writer.write(db_model.shopee.ShopeeProduct, df)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    admin_engine = sa.create_engine(settings.DB_URI)
+    with admin_engine.begin() as conn:
+        conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(sa.text(f"CREATE SCHEMA {SCHEMA}"))
+
+    engine = sa.create_engine(
+        settings.DB_URI,
+        connect_args={"options": f"-csearch_path={SCHEMA},public"}
+    )
+    db_model.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    bulk_writer = writer.BulkWriter(engine, batch_size=args.batch_size)
+
+    try:
+        for rows in args.rows:
+            df = make_shop_products(rows)
+            for label, write in (
+                ("orm", lambda: write_orm(Session, df)),
+                ("copy", lambda: write_bulk(bulk_writer, df)),
+            ):
+                start = time.perf_counter()
+                write()
+                elapsed = time.perf_counter() - start
+                print(
+                    f"{label:>5} rows={rows:>8,} "
+                    f"{elapsed:8.2f}s {rows / elapsed:12,.0f} rows/sec"
+                )
+    finally:
+        with admin_engine.begin() as conn:
+            conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
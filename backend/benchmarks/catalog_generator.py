@@ -0,0 +1,274 @@
+"""
+合成的商品目錄，供搜尋相關的效能測試使用
+
+在指定的 schema 中建立與正式環境相同的資料表與索引，以 generate_series
+產生 Shopee 與 Momo 商品 (中英混合的名稱)。歷史表與爬蟲寫入的方式相同，
+只在價格變動的那一天新增一筆 (每天以 --change-rate 的機率變動)，
+*_current 為每個商品最後一筆。
+
+    python benchmarks/catalog_generator.py --schema bench_catalog \\
+        --products 200000 --days 90
+"""
+import sys
+import time
+import random
+import argparse
+import typing
+from pathlib import Path
+
+import sqlalchemy as sa
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import db_model  # noqa: E402
+from settings import settings  # noqa: E402
+
+BRANDS = [
+    "Google", "Pixel", "Nest", "Microsoft", "Surface", "Xbox", "3M",
+    "Scotch", "Post-it", "Filtrete", "Logitech", "ASUS", "Acer", "Sony",
+    "Philips", "Panasonic", "Dyson", "Apple", "Samsung", "小米"
+]
+NOUNS = [
+    "無線耳機", "藍牙喇叭", "智慧音箱", "滑鼠", "鍵盤", "充電器", "行動電源",
+    "保護殼", "螢幕保護貼", "空氣清淨機", "濾網", "膠帶", "便利貼", "平板",
+    "筆電", "手機", "遊戲手把", "電動牙刷", "吸塵器", "吹風機", "口罩", "除濕機"
+]
+MODIFIERS = [
+    "旗艦", "限定", "公司貨", "新品", "Pro", "Max", "Mini", "Plus", "2入組",
+    "特價", "黑色", "白色", "USB-C", "快充", "降噪", "靜音", "大容量", "一年保固"
+]
+EVENTS = ["限時下殺", "momo 獨家", "買就送", "", "", ""]
+
+# 產生商品名稱的 SQL 運算式，g 為商品編號
+NAME_SQL = """
+    (CAST(:brands AS text[]))[1 + abs(hashtext(g::text || 'b')) % :n_brands]
+    || ' ' ||
+    (CAST(:nouns AS text[]))[1 + abs(hashtext(g::text || 'n')) % :n_nouns]
+    || ' ' ||
+    (CAST(:modifiers AS text[]))[
+        1 + abs(hashtext(g::text || 'm')) % :n_modifiers
+    ]
+    || ' ' || upper(substr(md5(g::text), 1, 4))
+"""
+
+# 某一天的價格: 基準價格乘上 80% ~ 119%
+PRICE_SQL = """
+    round(
+        (100 + abs(hashtext(g::text)) % 30000)
+        * (80 + abs(hashtext(g::text || ':' || d::text)) % 40) / 100.0
+    )
+"""
+
+# 第一天一定有一筆，之後每天以 change_rate 的機率變動
+DAYS_SQL = """
+    FROM generate_series(1, :products) AS g
+    CROSS JOIN generate_series(0, :days - 1) AS d
+    WHERE d = 0 OR abs(hashtext(g::text || '@' || d::text)) % 10000
+        < :change_rate * 10000
+"""
+
+CRAWLED_AT_SQL = "date_trunc('day', now()) - (:days - 1 - d) * interval '1 day'"
+
+
+def schema_db_uri(schema: str) -> str:
+    url = sa.engine.make_url(settings.DB_URI).update_query_dict(
+        {"options": f"-csearch_path={schema},public"}
+    )
+    return url.render_as_string(hide_password=False)
+
+
+def vocabulary() -> dict:
+    return {
+        "brands": BRANDS,
+        "n_brands": len(BRANDS),
+        "nouns": NOUNS,
+        "n_nouns": len(NOUNS),
+        "modifiers": MODIFIERS,
+        "n_modifiers": len(MODIFIERS),
+    }
+
+
+def generate_shopee(conn, products: int, days: int, change_rate: float):
+    conn.execute(
+        sa.text(
+            f"""
+            INSERT INTO shopee_product (
+                itemid, shopid, name, currency, stock, item_created_time,
+                price, price_min, price_max, price_min_before_discount,
+                price_max_before_discount, discount, crawled_at
+            )
+            SELECT
+                10000000 + g,
+                1 + g % 200,
+                {NAME_SQL},
+                'TWD',
+                abs(hashtext(g::text || ':' || d::text || 's')) % 500,
+                now() - :days * interval '1 day',
+                {PRICE_SQL},
+                {PRICE_SQL},
+                {PRICE_SQL},
+                -1,
+                -1,
+                NULL,
+                {CRAWLED_AT_SQL}
+            {DAYS_SQL}
+            """
+        ), {
+            "products": products,
+            "days": days,
+            "change_rate": change_rate,
+            **vocabulary()
+        }
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO shopee_product_current (
+                itemid, shopid, name, currency, stock, item_created_time,
+                price, price_min, price_max, price_min_before_discount,
+                price_max_before_discount, discount, crawled_at
+            )
+            SELECT DISTINCT ON (shopid, itemid)
+                itemid, shopid, name, currency, stock, item_created_time,
+                price, price_min, price_max, price_min_before_discount,
+                price_max_before_discount, discount, crawled_at
+            FROM shopee_product
+            ORDER BY shopid, itemid, crawled_at DESC
+            """
+        )
+    )
+
+
+def generate_momo(conn, products: int, days: int, change_rate: float):
+    conn.execute(
+        sa.text(
+            f"""
+            INSERT INTO momo_product (
+                child_category_code, child_category_name, product_url_path,
+                product_event, product_name, product_price,
+                product_price_parsed, product_price_text, crawled_at
+            )
+            SELECT
+                (4000000000 + g % 500)::text,
+                (CAST(:brands AS text[]))[
+                    1 + abs(hashtext(g::text || 'b')) % :n_brands
+                ],
+                '/goods.momo?i_code=' || (20000000 + g),
+                (CAST(:events AS text[]))[
+                    1 + abs(hashtext(g::text || ':' || d::text || 'e'))
+                    % :n_events
+                ],
+                {NAME_SQL},
+                to_char({PRICE_SQL}, 'FM999,999,999'),
+                {PRICE_SQL},
+                CASE WHEN d % 2 = 0 THEN '促銷價' ELSE '' END,
+                {CRAWLED_AT_SQL}
+            {DAYS_SQL}
+            """
+        ), {
+            "products": products,
+            "days": days,
+            "change_rate": change_rate,
+            "events": EVENTS,
+            "n_events": len(EVENTS),
+            **vocabulary()
+        }
+    )
+    conn.execute(
+        sa.text(
+            """
+            INSERT INTO momo_product_current (
+                child_category_code, child_category_name, product_url_path,
+                product_event, product_name, product_price,
+                product_price_parsed, product_price_text, crawled_at
+            )
+            SELECT DISTINCT ON (product_url_path)
+                child_category_code, child_category_name, product_url_path,
+                product_event, product_name, product_price,
+                product_price_parsed, product_price_text, crawled_at
+            FROM momo_product
+            ORDER BY product_url_path, crawled_at DESC
+            """
+        )
+    )
+
+
+def generate(
+    schema: str, products: int, days: int, change_rate: float = 0.1
+) -> dict:
+    # 重新建立 schema，回傳各資料表的筆數
+    admin_engine = sa.create_engine(settings.DB_URI)
+    with admin_engine.begin() as conn:
+        conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        conn.execute(sa.text(f"CREATE SCHEMA {schema}"))
+
+    engine = sa.create_engine(schema_db_uri(schema))
+    db_model.create_all(engine)
+    with engine.begin() as conn:
+        generate_shopee(conn, products, days, change_rate)
+        generate_momo(conn, products, days, change_rate)
+
+    tables = [
+        "shopee_product", "shopee_product_current", "momo_product",
+        "momo_product_current"
+    ]
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(sa.text(f"ANALYZE {table}"))
+        return {
+            table:
+                conn.execute(sa.text(f"SELECT count(*) FROM {table}")).scalar()
+            for table in tables
+        }
+
+
+def drop(schema: str):
+    engine = sa.create_engine(settings.DB_URI)
+    with engine.begin() as conn:
+        conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+
+
+def keywords(seed: int = 0, skew: float = 1.1) -> typing.List[tuple]:
+    # 搜尋關鍵字與權重 (Zipf 分布): 品牌、品名、品牌 + 品名、品名 + 規格，
+    # 以及少量打錯字或不存在的商品 (會走相似度查詢)
+    rng = random.Random(seed)
+    candidates = BRANDS + NOUNS
+    candidates += [
+        f"{brand} {noun}" for brand in BRANDS for noun in NOUNS
+        if rng.random() < 0.2
+    ]
+    candidates += [
+        f"{noun} {modifier}" for noun in NOUNS for modifier in MODIFIERS
+        if rng.random() < 0.1
+    ]
+    rng.shuffle(candidates)
+    # 排在最後，權重最低
+    candidates += ["不存在的商品", "Pixle", "藍芽耳機", "Surfce 鍵盤", "空氣清靜機"]
+    return [
+        (keyword, 1 / rank**skew)
+        for rank, keyword in enumerate(candidates, start=1)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--schema", default="bench_catalog")
+    parser.add_argument("--products", type=int, default=100_000, help="每個平台")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--change-rate", type=float, default=0.1)
+    parser.add_argument("--drop", action="store_true", help="刪除 schema")
+    args = parser.parse_args()
+
+    if args.drop:
+        drop(args.schema)
+        return
+
+    start = time.perf_counter()
+    counts = generate(args.schema, args.products, args.days, args.change_rate)
+    for table, count in counts.items():
+        print(f"{args.schema}.{table:<24} {count:>12,} rows")
+    print(f"generated in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
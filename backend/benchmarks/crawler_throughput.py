@@ -0,0 +1,168 @@
+"""
+爬蟲端到端效能測試: 以 fake_server.py 取代 Shopee / Momo，
+執行 ShopeeRunner / MomoRunner 並寫入資料庫
+
+每個平台在獨立的 process 中執行，輸出 wall time、每秒請求數
+(fake server 實際收到的，含重試)、每秒寫入筆數與 peak RSS。
+資料表建立在獨立的 schema 中，結束後會刪除。
+爬蟲設定 (並行數、限速、MOMO_CRAWLER 等) 以環境變數覆寫。
+
+    python benchmarks/crawler_throughput.py --shops 20 --items 300 \\
+        --latency-ms 50 --throttle-rate 0.01
+    MOMO_CRAWLER=async MOMO_RATE_LIMIT=200 MOMO_HOST_RATE_LIMIT=200 \\
+        python benchmarks/crawler_throughput.py --platform momo --page-count
+"""
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import resource
+import multiprocessing
+import concurrent.futures
+from pathlib import Path
+
+import requests
+import sqlalchemy as sa
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import fake_server  # noqa: E402
+from settings import settings  # noqa: E402
+
+SCHEMA = "bench_crawl"
+
+TABLES = {
+    "shopee": ["shopee_product", "shopee_product_model"],
+    "momo": ["momo_product"],
+}
+
+
+def bench_db_uri() -> str:
+    url = sa.engine.make_url(settings.DB_URI).update_query_dict(
+        {"options": f"-csearch_path={SCHEMA},public"}
+    )
+    return url.render_as_string(hide_password=False)
+
+
+def wait_for_server(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def server_requests(base_url: str) -> int:
+    stats = requests.get(f"{base_url}/__stats").json()
+    return sum(stats["requests"].values())
+
+
+def count_rows(engine, tables) -> int:
+    with engine.connect() as conn:
+        return sum(
+            conn.execute(sa.text(f"SELECT count(*) FROM {table}")).scalar()
+            for table in tables
+        )
+
+
+def run_platform(platform: str, base_url: str, usernames: list) -> dict:
+    # 在子 process 中執行: 先改設定再 import runner，runner 的 engine 會連到
+    # 測試用的 schema
+    settings.DB_URI = bench_db_uri()
+    settings.SHOPEE_BASE_URL = base_url
+    settings.MOMO_BASE_URL = base_url
+    settings.CRAWL_SHOPEE_SHOPS = usernames
+    import runner
+
+    if platform == "shopee":
+        platform_runner = runner.ShopeeRunner()
+
+        def crawl():
+            asyncio.run(
+                platform_runner.crawl_shops(
+                    usernames, concurrency=settings.CRAWL_SHOP_CONCURRENCY
+                )
+            )
+    else:
+        platform_runner = runner.MomoRunner()
+
+        def crawl():
+            platform_runner.crawl_brand_to_db(force=True)
+            # 空字串代表目錄中的所有品牌
+            asyncio.run(platform_runner.crawl_products([""]))
+
+    rows_before = count_rows(runner.engine, TABLES[platform])
+    requests_before = server_requests(base_url)
+    start = time.perf_counter()
+    crawl()
+    elapsed = time.perf_counter() - start
+
+    platform_runner.report()
+    return {
+        "wall": elapsed,
+        "requests": server_requests(base_url) - requests_before,
+        "rows": count_rows(runner.engine, TABLES[platform]) - rows_before,
+        # Linux 上單位是 KB
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss /
+        1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--platform", choices=["shopee", "momo", "both"], default="both"
+    )
+    parser.add_argument("--port", type=int, default=18080)
+    fake_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    catalog = fake_server.catalog_from_args(args)
+    usernames = [catalog.username(i) for i in range(catalog.shops)]
+    base_url = f"http://127.0.0.1:{args.port}"
+    platforms = ["shopee", "momo"] if args.platform == "both" else [
+        args.platform
+    ]
+
+    spawn = multiprocessing.get_context("spawn")
+    server = spawn.Process(
+        target=fake_server.serve, args=(args, "127.0.0.1", args.port)
+    )
+    server.start()
+
+    admin_engine = sa.create_engine(settings.DB_URI)
+    with admin_engine.begin() as conn:
+        conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(sa.text(f"CREATE SCHEMA {SCHEMA}"))
+
+    try:
+        wait_for_server(args.port)
+        for platform in platforms:
+            # 每個平台一個新的 process，peak RSS 不互相影響
+            with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=spawn
+            ) as executor:
+                result = executor.submit(
+                    run_platform, platform, base_url, usernames
+                ).result()
+            print(
+                f"{platform:>7} {result['wall']:8.2f}s "
+                f"{result['requests'] / result['wall']:10,.1f} requests/sec "
+                f"{result['rows'] / result['wall']:10,.1f} rows/sec "
+                f"peak RSS {result['peak_rss_mb']:8.1f} MB "
+                f"({result['requests']:,} requests, {result['rows']:,} rows)"
+            )
+    finally:
+        server.terminate()
+        server.join()
+        with admin_engine.begin() as conn:
+            conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+爬蟲用到的 Shopee / Momo API 的本機替身，供效能測試使用
+
+商品目錄由參數決定，同樣的參數每次產生相同的內容 (不會佔用記憶體，
+每個請求即時產生)。可以設定回應延遲、500 錯誤比例與 429 比例，
+GET /__stats 回傳各路徑收到的請求數與回應的 status code。
+
+    python benchmarks/fake_server.py --port 8080 --shops 20 --items 300 \\
+        --latency-ms 50 --error-rate 0.01 --throttle-rate 0.01
+
+    SHOPEE_BASE_URL=http://127.0.0.1:8080 MOMO_BASE_URL=http://127.0.0.1:8080 \\
+        python runner.py
+"""
+import html
+import json
+import math
+import random
+import asyncio
+import argparse
+import datetime
+import collections
+
+from aiohttp import web
+
+WORDS = [
+    "Google", "Pixel", "Nest", "Chromecast", "Microsoft", "Surface",
+    "Xbox", "Office", "3M", "Scotch", "Post-it", "Filtrete", "無線", "藍牙",
+    "耳機", "滑鼠", "鍵盤", "充電器", "保護殼", "空氣清淨機", "濾網", "膠帶",
+    "便利貼", "智慧音箱", "平板", "筆電", "手機", "旗艦", "限定", "公司貨"
+]
+
+
+# 假的商品目錄: 商店、商品與規格、Momo 分類與品牌，全部由編號推算
+class FakeCatalog:
+    def __init__(
+        self,
+        shops: int = 10,
+        items: int = 200,
+        models: int = 4,
+        shop_categories: int = 5,
+        parent_categories: int = 3,
+        brands: int = 10,
+        products: int = 200,
+        page_size: int = 40,
+        page_count: bool = False,
+        seed: int = 0,
+    ) -> None:
+        self.shops = shops
+        self.items = items
+        self.models = models
+        self.shop_categories = shop_categories
+        self.parent_categories = parent_categories
+        self.brands = brands
+        self.products = products
+        self.page_size = page_size
+        # 商品頁中是否帶 totalPage，讓爬蟲可以同時下載其餘頁面
+        self.page_count = page_count
+        self.seed = seed
+        self.ctime = int(datetime.datetime(2022, 1, 1).timestamp())
+
+    def _rng(self, *key) -> random.Random:
+        # 以字串為 seed，不受 PYTHONHASHSEED 影響
+        return random.Random(":".join(map(str, (self.seed, ) + key)))
+
+    def _name(self, rng, n) -> str:
+        return " ".join(rng.choice(WORDS) for _ in range(4)) + f" #{n}"
+
+    # Shopee
+    def shopid(self, i) -> int:
+        return 10000 + i
+
+    def shop_index(self, shopid) -> int:
+        i = int(shopid) - 10000
+        return i if 0 <= i < self.shops else None
+
+    def username(self, i) -> str:
+        return f"fakeshop{i:04d}"
+
+    def username_index(self, username) -> int:
+        number = username[len("fakeshop"):]
+        if not username.startswith("fakeshop") or not number.isdigit():
+            return None
+        i = int(number)
+        return i if 0 <= i < self.shops else None
+
+    def shop(self, i) -> dict:
+        return {
+            "username": self.username(i),
+            "shopid": self.shopid(i),
+            "brand_name": f"測試商店 {i}",
+            "ctime": self.ctime + i,
+        }
+
+    def itemid(self, shopid, j) -> int:
+        return int(shopid) * 100000 + j
+
+    def item_index(self, shopid, itemid) -> int:
+        j = int(itemid) - int(shopid) * 100000
+        return j if 0 <= j < self.items else None
+
+    def model_count(self, itemid) -> int:
+        return self._rng("models", itemid).randint(1, self.models)
+
+    def item(self, shopid, j) -> dict:
+        itemid = self.itemid(shopid, j)
+        rng = self._rng("item", itemid)
+        price = rng.randint(100, 50000) * 100000
+        models = self.model_count(itemid)
+        return {
+            "itemid": itemid,
+            "shopid": int(shopid),
+            "name": self._name(rng, j),
+            "currency": "TWD",
+            "stock": rng.randint(0, 500),
+            "status": 1,
+            "ctime": self.ctime + j,
+            "sold": rng.randint(0, 100),
+            "historical_sold": rng.randint(0, 1000),
+            "liked": False,
+            "liked_count": rng.randint(0, 100),
+            "view_count": None,
+            "catid": 100 + j % 10,
+            "brand": None,
+            "item_status": "normal",
+            "price": price,
+            "price_min": price,
+            "price_max": price + (models - 1) * 1000 * 100000,
+            "price_min_before_discount": -1,
+            "price_max_before_discount": -1,
+            "hidden_price_display": None,
+            "price_before_discount": 0,
+            "has_lowest_price_guarantee": False,
+            "show_discount": 0,
+            "raw_discount": 0,
+            "discount": None,
+            "tier_variations": [
+                {
+                    "name": "款式",
+                    "options": [f"款式{m}" for m in range(models)],
+                }
+            ],
+        }
+
+    def item_models(self, shopid, j) -> list:
+        item = self.item(shopid, j)
+        return [
+            {
+                "itemid": item["itemid"],
+                "modelid": item["itemid"] * 100 + m,
+                "name": f"款式{m}",
+                "price": item["price"] + m * 1000 * 100000,
+            } for m in range(self.model_count(item["itemid"]))
+        ]
+
+    # Momo
+    def parent_category(self, p) -> dict:
+        return {
+            "parentCategoryCode": f"{2100000000 + p}",
+            "parentCategoryName": f"測試分類{p}",
+            "parentCategoryId": str(p),
+        }
+
+    def brand_code(self, p, b) -> str:
+        return f"{4000000000 + p * 10000 + b}"
+
+    def brand_codes(self, parent_code) -> list:
+        p = int(parent_code) - 2100000000
+        if not 0 <= p < self.parent_categories:
+            return []
+        return [self.brand_code(p, b) for b in range(self.brands)]
+
+    def brand_name(self, code) -> str:
+        return f"測試品牌{code[-6:]}"
+
+    def momo_products(self, code, page) -> list:
+        start = (page - 1) * self.page_size
+        products = []
+        for k in range(start, min(start + self.page_size, self.products)):
+            rng = self._rng("momo", code, k)
+            products.append(
+                {
+                    "i_code": f"{code}{k:05d}",
+                    "event": rng.choice(["限時下殺", "momo 獨家", ""]),
+                    "name": self._name(rng, k),
+                    "price": rng.randint(100, 50000),
+                    "price_text": rng.choice(["促銷價", ""]),
+                }
+            )
+        return products
+
+
+def category_page(catalog: FakeCatalog, code, page) -> str:
+    # 與 fixtures/momo_category_page.html 相同的結構
+    products = catalog.momo_products(code, page)
+    if not products:
+        return (
+            '<html><body><section class="prdListWrap">'
+            '<p class="noData">查無商品</p></section></body></html>'
+        )
+
+    lis = []
+    for product in products:
+        lis.append(
+            '<li class="goodsItemLi">'
+            '<a class="productInfo goodsUrl" '
+            f'href="/goods.momo?i_code={product["i_code"]}&amp;ctype=B">'
+            '<div class="prdInfoWrap">'
+            f'<p class="prdEvent">{html.escape(product["event"])}</p>'
+            f'<h3 class="prdName">{html.escape(product["name"])}</h3>'
+            '<p class="priceArea"><b class="priceSymbol">$</b>'
+            f'<b class="price">{product["price"]:,}</b>'
+            f'<b class="priceText">{product["price_text"]}</b></p>'
+            '</div></a></li>'
+        )
+    script = ""
+    if catalog.page_count:
+        pages = math.ceil(catalog.products / catalog.page_size)
+        script = f"<script>var totalPage = {pages};</script>"
+    return (
+        '<html><head><meta charset="utf-8"></head><body>'
+        '<section class="prdListWrap">'
+        '<article class="prdListArea fourCardStyle"><ul class="prdList">' +
+        "".join(lis) + '</ul></article></section>' + script +
+        '</body></html>'
+    )
+
+
+def make_app(
+    catalog: FakeCatalog,
+    latency: float = 0,
+    error_rate: float = 0,
+    throttle_rate: float = 0,
+    retry_after: int = 1,
+    seed: int = 0,
+) -> web.Application:
+    rng = random.Random(seed)
+    stats = {
+        "requests": collections.Counter(),
+        "status": collections.Counter(),
+    }
+
+    @web.middleware
+    async def inject_faults(request, handler):
+        if request.path == "/__stats":
+            return await handler(request)
+
+        stats["requests"][request.path] += 1
+        if latency > 0:
+            await asyncio.sleep(latency * rng.uniform(0.5, 1.5))
+        r = rng.random()
+        if r < throttle_rate:
+            response = web.Response(
+                status=429, headers={"Retry-After": str(retry_after)}
+            )
+        elif r < throttle_rate + error_rate:
+            response = web.Response(status=500)
+        else:
+            response = await handler(request)
+        stats["status"][str(response.status)] += 1
+        return response
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    async def get_categories(request):
+        return web.json_response(
+            {
+                "data": {
+                    "categories": [
+                        {
+                            "category_id": c,
+                            "display_name": f"測試類別{c}",
+                        } for c in range(catalog.shop_categories)
+                    ]
+                }
+            }
+        )
+
+    async def get_shops_by_category(request):
+        c = int(request.query["category_id"])
+        shops = [
+            catalog.shop(i)
+            for i in range(c, catalog.shops, catalog.shop_categories)
+        ]
+        brands = [{"index": "#", "brand_ids": shops}]
+        return web.json_response({"data": {"brands": brands}})
+
+    async def get_shop_detail(request):
+        i = catalog.username_index(request.query["username"])
+        if i is None:
+            return web.json_response({"error": 4, "data": None})
+        shop = catalog.shop(i)
+        return web.json_response(
+            {
+                "data": {
+                    "shopid": shop["shopid"],
+                    "name": shop["brand_name"],
+                    "ctime": shop["ctime"],
+                }
+            }
+        )
+
+    async def recommend(request):
+        shopid = request.query["shopid"]
+        offset = int(request.query["offset"])
+        limit = int(request.query["limit"])
+        total = catalog.items if catalog.shop_index(shopid) is not None else 0
+        items = [
+            catalog.item(shopid, j)
+            for j in range(offset, min(offset + limit, total))
+        ]
+        return web.json_response(
+            {
+                "data": {
+                    "sections": [
+                        {
+                            "total": total,
+                            "data": {
+                                "item": items or None
+                            },
+                        }
+                    ]
+                }
+            }
+        )
+
+    async def item_get(request):
+        shopid = request.query["shopid"]
+        itemid = request.query["itemid"]
+        j = None
+        if catalog.shop_index(shopid) is not None:
+            j = catalog.item_index(shopid, itemid)
+        if j is None:
+            return web.json_response({"error": 4, "data": None})
+        return web.json_response(
+            {
+                "data": {
+                    "itemid": int(itemid),
+                    "shopid": int(shopid),
+                    "models": catalog.item_models(shopid, j),
+                }
+            }
+        )
+
+    async def ajax_tool(request):
+        form = await request.post()
+        cn = json.loads(form["data"])["data"]["cn"]
+        if cn == "brandAll":
+            parents = [
+                {
+                    "parentCategoryCode": "brandAll",
+                    "parentCategoryName": "全部品牌",
+                    "parentCategoryId": "brandAll",
+                }
+            ] + [
+                catalog.parent_category(p)
+                for p in range(catalog.parent_categories)
+            ]
+            cate_goods = {"parentCategories": parents}
+        else:
+            cate_goods = {
+                "childCategories": [
+                    {
+                        "categoryTitle": "熱門品牌",
+                        "childCategoriesInfo": [
+                            {
+                                "childCategoryCode": code,
+                                "childCategoryName": catalog.brand_name(code),
+                            } for code in catalog.brand_codes(cn)
+                        ],
+                    }
+                ]
+            }
+        return web.json_response({"rtnData": {"cateGoodsHM": cate_goods}})
+
+    async def category(request):
+        return web.Response(
+            text=category_page(
+                catalog, request.query["cn"], int(request.query["page"])
+            ),
+            content_type="text/html",
+        )
+
+    app = web.Application(middlewares=[inject_faults])
+    app.router.add_get("/__stats", get_stats)
+    app.router.add_get(
+        "/api/v4/official_shop/get_categories", get_categories
+    )
+    app.router.add_get(
+        "/api/v4/official_shop/get_shops_by_category", get_shops_by_category
+    )
+    app.router.add_get("/api/v4/shop/get_shop_detail", get_shop_detail)
+    app.router.add_get("/api/v4/recommend/recommend", recommend)
+    app.router.add_get("/api/v4/item/get", item_get)
+    app.router.add_post("/ajax/ajaxTool.jsp", ajax_tool)
+    app.router.add_get("/category.momo", category)
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--shops", type=int, default=10)
+    parser.add_argument("--items", type=int, default=200, help="每個商店")
+    parser.add_argument("--models", type=int, default=4, help="每個商品最多")
+    parser.add_argument("--shop-categories", type=int, default=5)
+    parser.add_argument("--parent-categories", type=int, default=3)
+    parser.add_argument("--brands", type=int, default=10, help="每個分類")
+    parser.add_argument("--products", type=int, default=200, help="每個品牌")
+    parser.add_argument("--page-size", type=int, default=40)
+    parser.add_argument("--page-count", action="store_true")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--throttle-rate", type=float, default=0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def catalog_from_args(args) -> FakeCatalog:
+    return FakeCatalog(
+        shops=args.shops,
+        items=args.items,
+        models=args.models,
+        shop_categories=args.shop_categories,
+        parent_categories=args.parent_categories,
+        brands=args.brands,
+        products=args.products,
+        page_size=args.page_size,
+        page_count=args.page_count,
+        seed=args.seed,
+    )
+
+
+def serve(args, host: str = "127.0.0.1", port: int = 8080):
+    app = make_app(
+        catalog_from_args(args),
+        latency=args.latency_ms / 1000,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+        seed=args.seed,
+    )
+    web.run_app(app, host=host, port=port, print=None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    print(f"serving on http://{args.host}:{args.port}")
+    serve(args, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Momo 商品頁解析速度測試: bs4 (html.parser) vs lxml，以及 ProcessPoolExecutor
+
+先確認兩種 backend 對 fixtures/ 中每個 HTML 檔的解析結果完全相同，
+再輸出每秒可解析的頁數。可以把實際存下來的商品頁放進 fixtures/ 一起比較。
+
+    python benchmarks/momo_parser.py --pages 500 --workers 4
+"""
+import sys
+import time
+import argparse
+import concurrent.futures
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from crawlers.momo import parse_products  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+
+def load_fixtures():
+    return {
+        path.name: path.read_text(encoding="utf-8")
+        for path in sorted(FIXTURES.glob("momo_*.html"))
+    }
+
+
+def check_equivalence(fixtures):
+    for name, text in fixtures.items():
+        expected = parse_products(text, "bs4")
+        actual = parse_products(text, "lxml")
+        if expected != actual:
+            for i, (a, b) in enumerate(zip(expected, actual)):
+                if a != b:
+                    print("first difference at product", i, a, b)
+                    break
+            raise SystemExit(f"{name}: lxml result differs from bs4")
+        print(f"{name}: {len(expected)} products, identical")
+
+
+def measure(label, pages, run):
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>14} {len(pages) / elapsed:10.1f} pages/sec")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures()
+    check_equivalence(fixtures)
+
+    texts = list(fixtures.values())
+    pages = [texts[i % len(texts)] for i in range(args.pages)]
+
+    for backend in ("bs4", "lxml"):
+        measure(
+            backend, pages,
+            lambda: [parse_products(text, backend) for text in pages]
+        )
+
+        with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+            measure(
+                f"{backend} x{args.workers}", pages, lambda: list(
+                    executor.map(
+                        parse_products,
+                        pages, [backend] * len(pages),
+                        chunksize=16
+                    )
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
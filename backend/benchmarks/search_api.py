@@ -0,0 +1,235 @@
+"""
+/product/ 搜尋 API 負載測試
+
+以 catalog_generator.py 在獨立的 schema 中產生商品目錄，再以 --concurrency 個
+並行的 client 依 Zipf 分布 (或 --keywords 檔案中的權重) 送出搜尋。
+直接呼叫 main.app (ASGI)，不經過網路，輸出每秒請求數、
+延遲與每個請求花在資料庫的時間的 p50 / p95 / p99。
+
+    python benchmarks/search_api.py --products 200000 --days 90 \\
+        --requests 5000 --concurrency 16 --keep
+    SEARCH_BACKEND=memory python benchmarks/search_api.py --reuse
+    python benchmarks/search_api.py --reuse --pages 5 --limit 50
+
+--pages 大於 1 時，每個搜尋以 X-Next-Cursor 繼續往後翻頁，每一頁各算一個請求，
+並分開輸出每一頁的延遲。
+--keywords 檔案每行一個關鍵字，可以用 tab 接權重。
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+import contextvars
+from pathlib import Path
+from urllib.parse import urlencode
+
+from databases import Database
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import catalog_generator  # noqa: E402
+from settings import settings  # noqa: E402
+
+SCHEMA = "bench_search_api"
+
+# 目前這個請求的資料庫查詢時間 (秒)
+db_times = contextvars.ContextVar("db_times")
+
+
+class TimedDatabase(Database):
+    # 記錄每次查詢的時間到目前請求的 db_times
+    async def _timed(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            times = db_times.get(None)
+            if times is not None:
+                times.append(time.perf_counter() - start)
+
+    async def fetch_all(self, *args, **kwargs):
+        return await self._timed(super().fetch_all, *args, **kwargs)
+
+    async def fetch_one(self, *args, **kwargs):
+        return await self._timed(super().fetch_one, *args, **kwargs)
+
+    async def execute(self, *args, **kwargs):
+        return await self._timed(super().execute, *args, **kwargs)
+
+
+def load_keywords(path) -> list:
+    keywords = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        if not line.strip():
+            continue
+        keyword, _, weight = line.partition("\t")
+        keywords.append((keyword, float(weight or 1)))
+    return keywords
+
+
+async def get(app, path: str, query: dict) -> tuple:
+    scope = {
+        "type": "http",
+        "asgi": {
+            "version": "3.0"
+        },
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": urlencode(query).encode(),
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    headers = {
+        key.decode(): value.decode()
+        for key, value in messages[0]["headers"]
+    }
+    body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], headers, body
+
+
+async def drive(
+    app, keywords, n, concurrency, seed, pages=1, limit=20
+) -> list:
+    # 回傳每個請求的 (頁數, 延遲, DB 時間)
+    rng = random.Random(seed)
+    words = [keyword for keyword, _ in keywords]
+    weights = [weight for _, weight in keywords]
+    queue = asyncio.Queue()
+    for keyword in rng.choices(words, weights, k=n):
+        queue.put_nowait(keyword)
+
+    results = []
+
+    async def client():
+        while not queue.empty():
+            keyword = queue.get_nowait()
+            query = {"product_name": keyword, "limit": limit}
+            for page in range(1, pages + 1):
+                times = []
+                db_times.set(times)
+                start = time.perf_counter()
+                status, headers, _ = await get(app, "/product/", query)
+                elapsed = time.perf_counter() - start
+                if status != 200:
+                    raise RuntimeError(f"HTTP {status}: {keyword}")
+                results.append((page, elapsed, sum(times)))
+                if "x-next-cursor" not in headers:
+                    break
+                query = {**query, "cursor": headers["x-next-cursor"]}
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return results
+
+
+def percentiles(values) -> str:
+    p = statistics.quantiles([v * 1000 for v in values], n=100)
+    return f"p50={p[49]:8.2f}ms p95={p[94]:8.2f}ms p99={p[98]:8.2f}ms"
+
+
+async def run(args, keywords):
+    import main
+
+    # databases 不會把 URL 中的 options 傳給 asyncpg，改以 server_settings
+    # 指定 search_path
+    main.database = TimedDatabase(
+        settings.DB_URI,
+        server_settings={"search_path": f"{SCHEMA},public"},
+    )
+    await main.app.router.startup()
+    try:
+        if args.warmup > 0:
+            await drive(
+                main.app, keywords, args.warmup, args.concurrency, 1,
+                args.pages, args.limit
+            )
+        start = time.perf_counter()
+        results = await drive(
+            main.app, keywords, args.requests, args.concurrency, args.seed,
+            args.pages, args.limit
+        )
+        elapsed = time.perf_counter() - start
+    finally:
+        await main.app.router.shutdown()
+
+    latencies = [latency for _, latency, _ in results]
+    db = [db_time for _, _, db_time in results]
+    print(
+        f"backend={settings.SEARCH_BACKEND} concurrency={args.concurrency} "
+        f"requests={len(results):,} {len(results) / elapsed:10,.1f} req/sec"
+    )
+    print(f"  latency {percentiles(latencies)}")
+    print(
+        f"  db time {percentiles(db)} "
+        f"({sum(db) / sum(latencies):.0%} of request time)"
+    )
+    if args.pages > 1:
+        for page in range(1, args.pages + 1):
+            page_latencies = [
+                latency for n, latency, _ in results if n == page
+            ]
+            # quantiles 至少需要兩筆
+            if len(page_latencies) >= 2:
+                print(
+                    f"  page {page:>3} {percentiles(page_latencies)} "
+                    f"({len(page_latencies):,} requests)"
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=100_000, help="每個平台")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--change-rate", type=float, default=0.1)
+    parser.add_argument("--reuse", action="store_true", help="沿用上次產生的目錄")
+    parser.add_argument("--keep", action="store_true", help="結束後保留 schema")
+    parser.add_argument("--keywords", help="關鍵字檔案，預設為 Zipf 分布")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=1, help="每個搜尋翻幾頁")
+    parser.add_argument("--limit", type=int, default=20, help="每頁筆數")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not args.reuse:
+        start = time.perf_counter()
+        counts = catalog_generator.generate(
+            SCHEMA, args.products, args.days, args.change_rate
+        )
+        elapsed = time.perf_counter() - start
+        print("catalog", counts, f"generated in {elapsed:.1f}s")
+
+    if args.keywords:
+        keywords = load_keywords(args.keywords)
+    else:
+        keywords = catalog_generator.keywords(args.seed)
+
+    # 在 import main 之前切換到測試用的 schema
+    db_uri = settings.DB_URI
+    settings.DB_URI = catalog_generator.schema_db_uri(SCHEMA)
+    try:
+        asyncio.run(run(args, keywords))
+    finally:
+        settings.DB_URI = db_uri
+        if not args.keep:
+            catalog_generator.drop(SCHEMA)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+/product/ 搜尋延遲測試: 比較 B-tree 與 trigram (gin_trgm_ops) 索引
+
+以 catalog_generator.py 在獨立的 schema 中產生商品目錄 (與正式環境相同的
+資料表與索引)，執行 main.py 的查詢: 每個平台一個 keyset + LIMIT 的分頁查詢，
+第一頁之後依 cursor 往後翻頁。分別在拿掉 *_current 的 trigram 索引 (只剩
+B-tree) 與加回之後量測，輸出每個平台、每一頁的 p50 / p99 延遲與查詢計畫。
+
+    python benchmarks/search_latency.py --products 100000 1000000 --pages 3
+"""
+import sys
+import time
+import heapq
+import argparse
+import itertools
+import statistics
+import collections
+from pathlib import Path
+
+import sqlalchemy as sa
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import catalog_generator  # noqa: E402
+import db_model  # noqa: E402
+import search_index  # noqa: E402
+
+SCHEMA = "bench_search"
+
+# 名稱符合的關鍵字 (LIKE) 與打錯字、不存在的商品 (走相似度查詢)
+KEYWORDS = [
+    "Pixel", "Surface 鍵盤", "3M 濾網", "藍牙喇叭", "無線耳機 降噪", "Dyson 吸塵器",
+    "不存在的商品", "Pixle", "Surfce 鍵盤"
+]
+
+TRIGRAM_INDEXES = [
+    index for table in (
+        db_model.shopee.ShopeeProductCurrent.__table__,
+        db_model.momo.MomoProductCurrent.__table__,
+    ) for index in table.indexes if index.name.endswith("_trgm_idx")
+]
+
+
+def search_page(conn, main, keyword, after, limit, timings, page):
+    # 與 main.search_product_in_db 相同，只是在同一個連線上依序查詢兩個平台
+    values = main.page_values(keyword, after, limit + 1)
+    pages = []
+    for platform in search_index.PLATFORMS:
+        stmt = sa.text(main.page_stmt(platform, after))
+        start = time.perf_counter()
+        rows = conn.execute(stmt, values).mappings().all()
+        timings[(platform, page)].append(
+            (time.perf_counter() - start) * 1000
+        )
+        pages.append(
+            [
+                {
+                    "platform": platform,
+                    "id": row["id"],
+                    "price": float(row["price"])
+                } for row in rows
+            ]
+        )
+    items = list(
+        itertools.islice(heapq.merge(*pages, key=main.sort_key), limit + 1)
+    )
+    if len(items) <= limit:
+        return None
+    last = items[limit - 1]
+    return (last["price"], -last["id"], last["platform"])
+
+
+def measure(conn, main, repeat, pages, limit):
+    timings = collections.defaultdict(list)
+    for _ in range(repeat):
+        for keyword in KEYWORDS:
+            after = None
+            for page in range(1, pages + 1):
+                after = search_page(
+                    conn, main, keyword, after, limit, timings, page
+                )
+                if after is None:
+                    break
+
+    plan = conn.execute(
+        sa.text("EXPLAIN " + main.page_stmt("shopee", None)),
+        main.page_values("Surface 鍵盤", None, limit + 1)
+    ).fetchall()
+    return timings, [row[0] for row in plan]
+
+
+def report(label, products, timings, plan):
+    print(f"{label} products={products:,} (每個平台)")
+    for (platform, page), latencies in sorted(timings.items()):
+        # quantiles 至少需要兩筆
+        if len(latencies) < 2:
+            continue
+        p = statistics.quantiles(latencies, n=100)
+        print(
+            f"  {platform:>6} page {page:>2} "
+            f"p50={p[49]:8.2f}ms p99={p[98]:8.2f}ms n={len(latencies)}"
+        )
+    for line in plan:
+        print("   ", line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--products",
+        type=int,
+        nargs="+",
+        default=[100_000, 1_000_000],
+        help="每個平台"
+    )
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    # main 在 import 時會連線到 DB_URI 建立資料表，只使用它的查詢
+    import main as api
+
+    engine = sa.create_engine(catalog_generator.schema_db_uri(SCHEMA))
+    try:
+        for products in args.products:
+            catalog_generator.generate(SCHEMA, products, args.days)
+
+            with engine.begin() as conn:
+                for index in TRIGRAM_INDEXES:
+                    conn.execute(sa.text(f"DROP INDEX {SCHEMA}.{index.name}"))
+            with engine.connect() as conn:
+                report(
+                    "btree", products,
+                    *measure(conn, api, args.repeat, args.pages, args.limit)
+                )
+
+            for index in TRIGRAM_INDEXES:
+                index.create(engine)
+            with engine.begin() as conn:
+                conn.execute(sa.text("ANALYZE shopee_product_current"))
+                conn.execute(sa.text("ANALYZE momo_product_current"))
+            with engine.connect() as conn:
+                report(
+                    "trigram", products,
+                    *measure(conn, api, args.repeat, args.pages, args.limit)
+                )
+    finally:
+        catalog_generator.drop(SCHEMA)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import time
+import datetime
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import db_model
+import search_cache
+
+
+# 記錄一次執行中已完成的工作，讓中斷的執行可以從上次的進度接續
+#
+# mark 先放在記憶體中，累積 flush_every 筆或超過 flush_seconds 秒才寫入 DB，
+# 中斷時最多重做這段時間內完成的工作。
+class Checkpoint:
+    def __init__(
+        self,
+        engine,
+        run_id: int,
+        flush_every: int = 100,
+        flush_seconds: float = 5.0
+    ) -> None:
+        self.engine = engine
+        self.run_id = run_id
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self._done = {}
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, engine, resume: bool = False, **kwargs) -> "Checkpoint":
+        table = db_model.crawl.CrawlRun.__table__
+        with engine.begin() as conn:
+            run_id = None
+            if resume:
+                run_id = conn.execute(
+                    sa.select(table.c.id).where(
+                        table.c.finished_at.is_(None)
+                    ).order_by(table.c.id.desc()).limit(1)
+                ).scalar()
+            if run_id is None:
+                run_id = conn.execute(
+                    table.insert().values(started_at=datetime.datetime.now())
+                ).inserted_primary_key[0]
+            else:
+                print("resume crawl_run", run_id)
+        return cls(engine, run_id, **kwargs)
+
+    def done(self, kind: str) -> set:
+        with self._lock:
+            if kind not in self._done:
+                table = db_model.crawl.CrawlCheckpoint.__table__
+                with self.engine.connect() as conn:
+                    self._done[kind] = set(
+                        conn.execute(
+                            sa.select(table.c.key).where(
+                                table.c.run_id == self.run_id,
+                                table.c.kind == kind
+                            )
+                        ).scalars()
+                    )
+            return self._done[kind]
+
+    def is_done(self, kind: str, key) -> bool:
+        return str(key) in self.done(kind)
+
+    def mark(self, kind: str, key):
+        done = self.done(kind)
+        with self._lock:
+            done.add(str(key))
+            self._pending.append((kind, str(key)))
+            if (
+                len(self._pending) < self.flush_every and
+                time.monotonic() - self._last_flush < self.flush_seconds
+            ):
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._last_flush = time.monotonic()
+        if not pending:
+            return
+
+        table = db_model.crawl.CrawlCheckpoint.__table__
+        now = datetime.datetime.now()
+        with self.engine.begin() as conn:
+            conn.execute(
+                postgresql.insert(table).on_conflict_do_nothing(),
+                [
+                    {
+                        "run_id": self.run_id,
+                        "kind": kind,
+                        "key": key,
+                        "created_at": now
+                    } for kind, key in pending
+                ],
+            )
+
+    def finish(self, stats: dict = None, completed: bool = True):
+        # completed=False 時只記錄 stats，finished_at 保持 NULL 讓
+        # start(resume=True) 可以接續，也不通知 API 清空快取
+        self.flush()
+        table = db_model.crawl.CrawlRun.__table__
+        values = {"stats": stats}
+        if completed:
+            values["finished_at"] = datetime.datetime.now()
+        with self.engine.begin() as conn:
+            conn.execute(
+                table.update().where(table.c.id == self.run_id).values(
+                    **values
+                )
+            )
+            if completed:
+                search_cache.bump_data_version(conn)
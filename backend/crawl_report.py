@@ -0,0 +1,77 @@
+import typing
+
+import pandas as pd
+import sqlalchemy as sa
+
+import db_model
+
+# 以這些欄位判斷效能退步: 每次呼叫的平均時間不受這次爬取量的影響
+TIMING_SUFFIXES = (".ms_per_call", ".wall_seconds")
+
+
+def load_runs(engine, limit: int = 10) -> pd.DataFrame:
+    # 最近 limit 次完成的執行，由舊到新，每個數值一欄
+    # (例如 shopee.stages.fetch.seconds)
+    table = db_model.crawl.CrawlRun.__table__
+    with engine.connect() as conn:
+        rows = conn.execute(
+            sa.select(table.c.id, table.c.stats).where(
+                table.c.finished_at.isnot(None),
+                table.c.stats.isnot(None),
+            ).order_by(table.c.id.desc()).limit(limit)
+        ).all()
+    if not rows:
+        return pd.DataFrame()
+
+    df = pd.json_normalize([row.stats for row in reversed(rows)])
+    df.index = [row.id for row in reversed(rows)]
+    for column in [c for c in df.columns if c.endswith(".seconds")]:
+        prefix = column[:-len("seconds")]
+        calls = df[prefix + "calls"]
+        df[prefix + "ms_per_call"] = df[column] / calls.where(calls > 0) * 1000
+    return df.select_dtypes("number")
+
+
+def compare(df: pd.DataFrame, threshold: float = 0.2) -> pd.DataFrame:
+    # 最後一次執行與之前各次的中位數比較；時間類的欄位超過 threshold 視為退步
+    current = df.iloc[-1]
+    baseline = df.iloc[:-1].median()
+    result = pd.DataFrame(
+        {
+            "current": current,
+            "baseline": baseline,
+            "change": current / baseline.where(baseline > 0) - 1,
+        }
+    )
+    result["regression"] = [
+        column.endswith(TIMING_SUFFIXES) and change > threshold
+        for column, change in result["change"].fillna(0).items()
+    ]
+    return result
+
+
+def report(engine, runs: int = 10, threshold: float = 0.2) -> typing.List[str]:
+    # 印出比較結果，回傳退步的欄位
+    df = load_runs(engine, runs + 1)
+    if len(df) < 2:
+        print("need at least two finished runs with stats, found", len(df))
+        return []
+
+    result = compare(df, threshold)
+    print(
+        f"crawl_run {df.index[-1]} vs median of "
+        f"{len(df) - 1} previous runs ({df.index[0]}..{df.index[-2]})"
+    )
+    with pd.option_context(
+        "display.max_rows", None, "display.width", 120,
+        "display.float_format", "{:,.3f}".format
+    ):
+        print(result.to_string())
+
+    regressions = list(result.index[result["regression"]])
+    for column in regressions:
+        print(
+            f"regression: {column} {result.at[column, 'change']:+.0%} "
+            f"(threshold {threshold:.0%})"
+        )
+    return regressions
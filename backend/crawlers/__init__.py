@@ -1,2 +1,7 @@
+from . import ratelimit
+from . import stats
+from . import cache
+from . import fetch
+from . import stream
 from . import shopee
 from . import momo
\ No newline at end of file
@@ -0,0 +1,172 @@
+import os
+import gzip
+import json
+import time
+import hashlib
+import threading
+import typing
+
+
+class CacheEntry:
+    def __init__(
+        self, body: bytes, encoding: str, digest: str, stored_at: float
+    ) -> None:
+        self.body = body
+        self.encoding = encoding
+        self.digest = digest
+        self.stored_at = stored_at
+
+
+# 存在本機磁碟上的 HTTP 回應快取，每個請求一個 gzip 檔
+#
+# 檔案第一行是 JSON metadata (內容的 sha256、編碼、儲存時間)，之後是回應內容。
+# 用途:
+# - ttl 秒內的相同請求直接使用快取，不發出請求 (開發時重複執行)
+# - 比對內容的 sha256，與上次相同的頁面可以跳過解析與寫入
+# - replay=True 時只讀快取，離線重播整個爬取流程
+# 檔案總大小超過 max_bytes 時，刪除最久沒有使用的檔案 (讀取時會更新 mtime)。
+class ResponseCache:
+    def __init__(
+        self,
+        directory: str,
+        ttl: float = 0,
+        max_bytes: int = 1024 * 1024 * 1024,
+        replay: bool = False,
+        ignore_params: typing.Iterable[str] = ("t", ),
+    ) -> None:
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        # 每次都不同的參數 (例如時間戳) 不列入 key
+        self.ignore_params = set(ignore_params)
+        self.hits = 0
+        self.misses = 0
+        self.unchanged = 0
+        self._sizes = None
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def key(self, method: str, url: str, **kwargs) -> str:
+        def normalize(value):
+            if isinstance(value, dict):
+                return sorted(
+                    (str(k), str(v))
+                    for k, v in value.items() if k not in self.ignore_params
+                )
+            return value
+
+        request = [
+            method.upper(),
+            url,
+            normalize(kwargs.get("params")),
+            normalize(kwargs.get("data")),
+            kwargs.get("json"),
+        ]
+        return hashlib.sha256(
+            json.dumps(request, ensure_ascii=False,
+                       sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".gz")
+
+    def get(self, key: str) -> typing.Optional[CacheEntry]:
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rb") as f:
+                meta = json.loads(f.readline())
+                body = f.read()
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        return CacheEntry(
+            body, meta["encoding"], meta["sha256"], meta["stored_at"]
+        )
+
+    @staticmethod
+    def digest(body: bytes) -> str:
+        return hashlib.sha256(body).hexdigest()
+
+    def same(self, entry: typing.Optional[CacheEntry], body: bytes) -> bool:
+        return entry is not None and entry.digest == self.digest(body)
+
+    def fresh(self, entry: typing.Optional[CacheEntry]) -> bool:
+        if entry is None:
+            return False
+        return self.replay or time.time() - entry.stored_at < self.ttl
+
+    def put(
+        self,
+        key: str,
+        body: bytes,
+        encoding: str,
+        previous: typing.Optional[CacheEntry] = None,
+    ) -> bool:
+        # 回傳內容是否與 previous (呼叫端先前 get 到的) 相同
+        digest = self.digest(body)
+        path = self._path(key)
+        if previous is not None and previous.digest == digest:
+            self.unchanged += 1
+            unchanged = True
+        else:
+            unchanged = False
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wb") as f:
+            f.write(
+                json.dumps(
+                    {
+                        "sha256": digest,
+                        "encoding": encoding,
+                        "stored_at": time.time(),
+                    }
+                ).encode("utf-8") + b"\n"
+            )
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        self._account(path, os.path.getsize(path))
+        return unchanged
+
+    def _scan(self):
+        self._sizes = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".gz"):
+                    path = os.path.join(root, name)
+                    self._sizes[path] = os.path.getsize(path)
+        self._total = sum(self._sizes.values())
+
+    def _account(self, path: str, size: int):
+        with self._lock:
+            if self._sizes is None:
+                self._scan()
+            self._total += size - self._sizes.get(path, 0)
+            self._sizes[path] = size
+            if self._total <= self.max_bytes:
+                return
+            self._evict()
+
+    def _evict(self):
+        # 刪到剩 90%，避免每次寫入都要重新排序
+        by_mtime = sorted(
+            self._sizes,
+            key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0
+        )
+        for path in by_mtime:
+            if self._total <= self.max_bytes * 0.9:
+                break
+            self._total -= self._sizes.pop(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def metrics(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "unchanged": self.unchanged,
+        }
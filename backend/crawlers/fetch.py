@@ -0,0 +1,460 @@
+import time
+import json
+import random
+import typing
+import asyncio
+import threading
+import contextlib
+import collections
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+from .cache import ResponseCache
+from .stats import StageTimer
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+class CircuitOpenError(FetchError):
+    def __init__(self, endpoint: str, retry_at: float) -> None:
+        super().__init__(f"circuit open: {endpoint}")
+        self.endpoint = endpoint
+        self.retry_at = retry_at
+
+
+class RetryableResponse(FetchError):
+    def __init__(self, message: str, retry_after: float = None) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Unchanged:
+    # if_changed=True 且回應內容與上次快取的相同時，request 回傳這個包裝
+    def __init__(self, body) -> None:
+        self.body = body
+
+
+class RetryBudget:
+    # 重試次數不超過 min_retries + 請求數 * ratio，避免整個 run 都在重試
+    def __init__(self, ratio: float = 0.2, min_retries: int = 10) -> None:
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+
+    def record_request(self):
+        self.requests += 1
+
+    def try_retry(self) -> bool:
+        if self.retries >= self.min_retries + self.requests * self.ratio:
+            return False
+        self.retries += 1
+        return True
+
+
+class CircuitBreaker:
+    # 連續失敗 failure_threshold 次後暫停 reset_timeout 秒，之後只放行一個試探請求
+    def __init__(
+        self,
+        endpoint: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0
+    ) -> None:
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        # 進行中的試探請求 (before_request 回傳的 token)，沒有時為 None
+        self._probing = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    def before_request(self) -> typing.Optional[object]:
+        # 試探請求回傳一個 token，請求結束時 (不論結果) 交給 end_probe
+        state = self.state
+        if state == "open" or (
+            state == "half-open" and self._probing is not None
+        ):
+            raise CircuitOpenError(
+                self.endpoint,
+                (self.opened_at or time.monotonic()) + self.reset_timeout
+            )
+        if state == "half-open":
+            self._probing = object()
+            return self._probing
+        return None
+
+    def end_probe(self, probe: typing.Optional[object]):
+        # 試探請求以非暫時性錯誤 (例如 404) 結束或被取消時，讓下一個請求試探；
+        # 已由 record_success / record_failure 處理或已換成別的試探時不做事
+        if probe is not None and self._probing is probe:
+            self._probing = None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self._probing is not None or (
+            self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+        self._probing = None
+
+
+# 所有爬蟲共用的 HTTP 請求層: 指數退避 + jitter 重試、重試預算、
+# 每個 endpoint 一個 circuit breaker。limiter 為 RateLimiter 或 AIMDLimiter；
+# request_sync 的 limiter 須為 RateLimiter (limiter.sync)。
+#
+# validate(body) 回傳 False 時視為暫時性錯誤並重試 (例如 Shopee 偶爾回傳空的商品列表)。
+#
+# 有 cache 時，快取未過期 (或 replay 模式) 直接回傳快取內容，不發出請求；
+# 否則發出請求並更新快取。if_changed=True 時內容與上次相同會回傳 Unchanged，
+# 呼叫端可以跳過解析與寫入；內容有變時先不寫入快取，呼叫端把結果寫入 DB 後
+# 以 cache_key 的 key 呼叫 confirm 才寫入，寫入失敗或中斷時下一次執行
+# 不會誤判為沒變而跳過寫入。
+#
+# timer 記錄網路請求 ("fetch") 與回應解碼 ("parse") 的時間，可以與呼叫端共用，
+# 例如爬蟲解析 HTML 也記在同一個 timer 的 "parse"。
+class Fetcher:
+    def __init__(
+        self,
+        limiter=None,
+        max_retries: int = 4,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        retry_budget: RetryBudget = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        timeout: float = 30.0,
+        cache: ResponseCache = None,
+        timer: StageTimer = None,
+        max_circuit_wait: float = 300.0,
+        max_pending: int = 10000,
+    ) -> None:
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_budget = retry_budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.timeout = timeout
+        self.max_circuit_wait = max_circuit_wait
+        # 等待 confirm 的回應: key -> (body, encoding)，超過上限時丟掉最舊的
+        # (只是少一次快取，不影響正確性)
+        self.max_pending = max_pending
+        self._pending = collections.OrderedDict()
+        self._pending_lock = threading.Lock()
+        self.breakers: typing.Dict[str, CircuitBreaker] = {}
+        self.failed_requests = 0
+        self.cache = cache
+        self.timer = timer or StageTimer()
+        self.bytes_received = 0
+
+    def metrics(self) -> dict:
+        metrics = {
+            "requests": self.retry_budget.requests,
+            "retries": self.retry_budget.retries,
+            "failed_requests": self.failed_requests,
+            "bytes": self.bytes_received,
+            "open_circuits": [
+                endpoint for endpoint, breaker in self.breakers.items()
+                if breaker.state != "closed"
+            ],
+        }
+        if self.cache is not None:
+            metrics["cache"] = self.cache.metrics()
+        return metrics
+
+    def _cached(self, method: str, url: str, **kwargs):
+        # 回傳 (key, 上次的快取, 是否可以直接使用)
+        if self.cache is None:
+            return None, None, False
+        key = self.cache.key(method, url, **kwargs)
+        entry = self.cache.get(key)
+        if self.cache.fresh(entry):
+            self.cache.hits += 1
+            return key, entry, True
+        if self.cache.replay:
+            raise FetchError(f"not in cache: {method} {url}")
+        self.cache.misses += 1
+        return key, entry, False
+
+    def _store(
+        self, key, entry, body: bytes, encoding: str, if_changed: bool
+    ) -> bool:
+        # 回傳內容是否與上次 confirm 過的相同
+        if key is None:
+            return False
+        if if_changed and not self.cache.same(entry, body):
+            with self._pending_lock:
+                self._pending[key] = (body, encoding)
+                self._pending.move_to_end(key)
+                while len(self._pending) > self.max_pending:
+                    self._pending.popitem(last=False)
+            return False
+        return self.cache.put(key, body, encoding, entry)
+
+    def cache_key(
+        self, method: str, url: str, **kwargs
+    ) -> typing.Optional[str]:
+        # 沒有快取時回傳 None，不需要 confirm
+        if self.cache is None:
+            return None
+        return self.cache.key(method, url, **kwargs)
+
+    def confirm(self, key: str):
+        with self._pending_lock:
+            pending = self._pending.pop(key, None)
+        if pending is not None:
+            self.cache.put(key, *pending)
+
+    @staticmethod
+    def _decode(body: bytes, encoding: str, parse: str):
+        # 與 aiohttp 的 resp.json(content_type=None) / resp.text() 相同
+        if parse == "json":
+            body = body.strip()
+            return json.loads(body.decode(encoding)) if body else None
+        return body.decode(encoding)
+
+    def breaker(self, method: str, url: str) -> CircuitBreaker:
+        parts = urlsplit(url)
+        endpoint = f"{method} {parts.netloc}{parts.path}"
+        if endpoint not in self.breakers:
+            self.breakers[endpoint] = CircuitBreaker(
+                endpoint, self.failure_threshold, self.reset_timeout
+            )
+        return self.breakers[endpoint]
+
+    def backoff_delay(self, attempt: int, error: Exception) -> float:
+        if isinstance(error, CircuitOpenError):
+            # 試探請求進行中時 retry_at 已經過去，至少等 base_delay 並加上
+            # jitter，避免所有等待中的請求同時重試
+            return max(error.retry_at - time.monotonic(), self.base_delay) + \
+                random.uniform(0, self.base_delay)
+        if isinstance(error, RetryableResponse) and error.retry_after:
+            return error.retry_after
+        # full jitter
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**attempt)
+        )
+
+    def _next_delay(self, attempt: int, error: Exception) -> float:
+        if attempt >= self.max_retries or not self.retry_budget.try_retry():
+            self.failed_requests += 1
+            raise FetchError(f"giving up after {attempt + 1} attempts") from error
+        return self.backoff_delay(attempt, error)
+
+    def _circuit_delay(self, error: CircuitOpenError, waited: float) -> float:
+        # 等待 circuit 重新開放不算重試次數，也不消耗重試預算，
+        # 只限制總等待時間
+        delay = self.backoff_delay(0, error)
+        if waited + delay > self.max_circuit_wait:
+            self.failed_requests += 1
+            raise FetchError(
+                f"circuit open after waiting {waited:.0f}s: {error.endpoint}"
+            ) from error
+        return delay
+
+    @contextlib.asynccontextmanager
+    async def _limit(self, url: str):
+        if self.limiter is None:
+            yield None
+        else:
+            async with self.limiter(url) as slot:
+                yield slot
+
+    @contextlib.contextmanager
+    def _limit_sync(self, url: str):
+        if self.limiter is None:
+            yield None
+        else:
+            with self.limiter.sync(url) as slot:
+                yield slot
+
+    async def request(
+        self,
+        session: aiohttp.ClientSession,
+        method: str,
+        url: str,
+        parse: str = "json",
+        validate: typing.Callable[[typing.Any], bool] = None,
+        if_changed: bool = False,
+        **kwargs
+    ) -> typing.Any:
+        key, entry, hit = self._cached(method, url, **kwargs)
+        if hit:
+            with self.timer.span("parse"):
+                return self._decode(entry.body, entry.encoding, parse)
+
+        breaker = self.breaker(method, url)
+        self.retry_budget.record_request()
+
+        attempt = 0
+        circuit_wait = 0.0
+        while True:
+            probe = None
+            try:
+                probe = breaker.before_request()
+                async with self._limit(url) as slot:
+                    try:
+                        body, raw, encoding = await self._send(
+                            session, method, url, parse, validate, **kwargs
+                        )
+                    except RetryableResponse:
+                        if slot is not None:
+                            slot.backoff()
+                        raise
+                breaker.record_success()
+                unchanged = self._store(key, entry, raw, encoding, if_changed)
+                if unchanged and if_changed:
+                    return Unchanged(body)
+                return body
+            except CircuitOpenError as e:
+                delay = self._circuit_delay(e, circuit_wait)
+                circuit_wait += delay
+                await asyncio.sleep(delay)
+            except (
+                RetryableResponse, aiohttp.ClientError, asyncio.TimeoutError
+            ) as e:
+                breaker.record_failure()
+                await asyncio.sleep(self._next_delay(attempt, e))
+                attempt += 1
+            finally:
+                breaker.end_probe(probe)
+
+    async def _send(self, session, method, url, parse, validate, **kwargs):
+        with self.timer.span("fetch"):
+            async with session.request(
+                method,
+                url,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                **kwargs
+            ) as resp:
+                if resp.status in RETRY_STATUS:
+                    retry_after = resp.headers.get("Retry-After")
+                    raise RetryableResponse(
+                        f"HTTP {resp.status}: {url}",
+                        float(retry_after)
+                        if retry_after and retry_after.isdigit() else None
+                    )
+                if resp.status != 200:
+                    raise FetchError(f"HTTP {resp.status}: {url}")
+
+                raw = await resp.read()
+                encoding = resp.get_encoding()
+        self.bytes_received += len(raw)
+
+        with self.timer.span("parse"):
+            try:
+                body = self._decode(raw, encoding, parse)
+            except ValueError as e:
+                # 回應不是合法的 JSON (與 _validate_sync 相同視為暫時性錯誤)
+                raise RetryableResponse(f"invalid body: {url}") from e
+        if body is None or (validate is not None and not validate(body)):
+            raise RetryableResponse(f"unexpected body: {url}")
+        return body, raw, encoding
+
+    def _send_sync(self, method, url, validate, **kwargs):
+        with self.timer.span("fetch"):
+            resp = requests.request(method, url, timeout=self.timeout, **kwargs)
+        self.bytes_received += len(resp.content)
+        if resp.status_code in RETRY_STATUS:
+            retry_after = resp.headers.get("Retry-After")
+            raise RetryableResponse(
+                f"HTTP {resp.status_code}: {url}",
+                float(retry_after)
+                if retry_after and retry_after.isdigit() else None
+            )
+        if resp.status_code != 200:
+            raise FetchError(f"HTTP {resp.status_code}: {url}")
+        if validate is not None and not self._validate_sync(validate, resp):
+            raise RetryableResponse(f"unexpected body: {url}")
+        return resp
+
+    def _validate_sync(self, validate, resp) -> bool:
+        try:
+            return validate(resp)
+        except ValueError:
+            # 回應不是合法的 JSON
+            return False
+
+    def request_sync(
+        self,
+        method: str,
+        url: str,
+        validate: typing.Callable[[requests.Response], bool] = None,
+        if_changed: bool = False,
+        **kwargs
+    ) -> requests.Response:
+        key, entry, hit = self._cached(method, url, **kwargs)
+        if hit:
+            resp = requests.Response()
+            resp.status_code = 200
+            resp.url = url
+            resp.encoding = entry.encoding
+            resp._content = entry.body
+            return resp
+
+        breaker = self.breaker(method, url)
+        self.retry_budget.record_request()
+
+        attempt = 0
+        circuit_wait = 0.0
+        while True:
+            probe = None
+            try:
+                probe = breaker.before_request()
+                with self._limit_sync(url) as slot:
+                    try:
+                        resp = self._send_sync(method, url, validate, **kwargs)
+                    except RetryableResponse:
+                        if slot is not None:
+                            slot.backoff()
+                        raise
+                breaker.record_success()
+                unchanged = self._store(
+                    key, entry, resp.content, resp.encoding, if_changed
+                )
+                if unchanged and if_changed:
+                    return Unchanged(resp)
+                return resp
+            except CircuitOpenError as e:
+                delay = self._circuit_delay(e, circuit_wait)
+                circuit_wait += delay
+                time.sleep(delay)
+            except (RetryableResponse, requests.RequestException) as e:
+                breaker.record_failure()
+                time.sleep(self._next_delay(attempt, e))
+                attempt += 1
+            finally:
+                breaker.end_probe(probe)
+
+
+async def gather_isolated(tasks, failures: list) -> list:
+    # 單一 task 失敗只記錄下來，不中斷其他 task
+    results = []
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        if isinstance(result, Exception):
+            failures.append(result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            results.append(result)
+    return results
@@ -1,124 +1,178 @@
-import requests
+import re
+import math
 import pandas as pd
 import datetime
 from pathlib import Path
 from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
 import typing
 import asyncio
 import aiohttp
+import concurrent.futures
+
+from .fetch import Fetcher, FetchError, Unchanged, gather_isolated
+from .ratelimit import RateLimiter
+from .stream import Marker, stream_batches
+
+BASE_URL = "https://m.momoshop.com.tw"
+
+
+def menu_request(cn, subId, base_url: str = BASE_URL) -> dict:
+    # ajaxTool.jsp getMenuNew 的請求參數
+    headers = {
+        'authority':
+            'm.momoshop.com.tw',
+        'origin':
+            'https://m.momoshop.com.tw',
+        'user-agent':
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
+    }
+
+    shop_url = f"{base_url}/ajax/ajaxTool.jsp"
+    params = {
+        "n": "getMenuNew",
+        "t": int(datetime.datetime.now().timestamp() * 1000)
+    }
+    data = {
+        'data':
+            '{"flag":"getMenuNew","data":{"cn":"' + str(cn) + '","subId":"' +
+            str(subId) + '"}}',
+    }
+    return {"url": shop_url, "params": params, "data": data, "headers": headers}
+
+
+def brand_page_request(cn, n, base_url: str = BASE_URL) -> dict:
+    # 品牌商品列表第 n 頁的請求參數
+    headers = {
+        'authority':
+            'm.momoshop.com.tw',
+        'origin':
+            'https://m.momoshop.com.tw',
+        'user-agent':
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
+    }
+
+    params = {
+        'cn': cn,
+        'page': n,
+        'sortType': '6',
+        'imgSH': 'fourCardStyle',
+    }
+    return {
+        "url": f"{base_url}/category.momo",
+        "params": params,
+        "headers": headers
+    }
+
+
+def extract_parent_categories(resp_json) -> typing.List[dict]:
+    extracted_items = []
+    for item in resp_json["rtnData"]["cateGoodsHM"]["parentCategories"]:
+        if item["parentCategoryCode"] == "brandAll":
+            # 跳過自己
+            continue
+        extracted_items.append(
+            {
+                "parentCategoryCode": item["parentCategoryCode"],
+                "parentCategoryName": item["parentCategoryName"],
+                "parentCategoryId": item["parentCategoryId"],
+            }
+        )
+    return extracted_items
 
 
-class MomoDownloader:
-    def get_all_parentCategoryCode_of_brands(self):
-
-        headers = {
-            'authority':
-                'm.momoshop.com.tw',
-            'origin':
-                'https://m.momoshop.com.tw',
-            'user-agent':
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-        }
+def extract_child_categories(
+    resp_json
+) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+    child_categories = []
+    if "childCategories" in resp_json["rtnData"]["cateGoodsHM"]:
+        for child_category in resp_json["rtnData"]['cateGoodsHM'][
+            'childCategories']:
+            categoryTitle = child_category["categoryTitle"]
 
-        shop_url = "https://m.momoshop.com.tw/ajax/ajaxTool.jsp"
-        params = {
-            "n": "getMenuNew",
-            "t": int(datetime.datetime.now().timestamp() * 1000)
-        }
-        data = {
-            'data':
-                '{"flag":"getMenuNew","data":{"cn":"brandAll","subId":"brandAll"}}',
-        }
+            for brand in child_category["childCategoriesInfo"]:
+                child_categories.append(
+                    {
+                        "categoryTitle": categoryTitle,
+                        "childCategoryCode": brand["childCategoryCode"],
+                        "childCategoryName": brand["childCategoryName"],
+                    }
+                )
+    extra_child_categories = []
+    if "extraChildCategories" in resp_json["rtnData"]["cateGoodsHM"]:
+        for extra_child_category in resp_json["rtnData"]["cateGoodsHM"][
+            "extraChildCategories"]:
+            categoryTitle = extra_child_category["categoryTitle"]
+
+            for brand in extra_child_category["childCategoriesInfo"]:
+                extra_child_categories.append(
+                    {
+                        "categoryTitle": categoryTitle,
+                        "childCategoryCode": brand["childCategoryCode"],
+                        "childCategoryName": brand["childCategoryName"],
+                    }
+                )
 
-        resp = requests.post(
-            shop_url,
-            params=params,
-            data=data,
-            headers=headers,
+    return child_categories, extra_child_categories
+
+
+def build_brands(
+    parent_category, child_category_list, extra_child_category_list
+) -> typing.List[dict]:
+    brands = []
+    for child_category in child_category_list + extra_child_category_list:
+        brands.append(
+            {
+                "parent_category_code": parent_category["parentCategoryCode"],
+                "parent_category_name": parent_category["parentCategoryName"],
+                "parent_category_id": parent_category["parentCategoryId"],
+                "category_title": child_category["categoryTitle"],
+                "child_category_code": child_category["childCategoryCode"],
+                "child_category_name": child_category["childCategoryName"],
+            }
         )
-        extracted_items = []
-        for item in resp.json()["rtnData"]["cateGoodsHM"]["parentCategories"]:
-            if item["parentCategoryCode"] == "brandAll":
-                # 跳過自己
-                continue
-            extracted_items.append(
-                {
-                    "parentCategoryCode": item["parentCategoryCode"],
-                    "parentCategoryName": item["parentCategoryName"],
-                    "parentCategoryId": item["parentCategoryId"],
-                }
-            )
-        return extracted_items
+    return brands
 
-    def get_childCategoryCode_of_category_brand(
-        self, parentCategoryCode, parentCategoryId
-    ) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
-        parentCategoryCode = str(parentCategoryCode)
-        parentCategoryId = str(parentCategoryId)
 
-        headers = {
-            'authority':
-                'm.momoshop.com.tw',
-            'origin':
-                'https://m.momoshop.com.tw',
-            'user-agent':
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-        }
+def brands_to_df(brands) -> pd.DataFrame:
+    df = pd.DataFrame(brands)
+    df.drop_duplicates(
+        subset=[
+            "parent_category_code",
+            "parent_category_id",
+            "child_category_code",
+        ],
+        keep="last",
+        inplace=True
+    )
+    return df
 
-        shop_url = "https://m.momoshop.com.tw/ajax/ajaxTool.jsp"
-        params = {
-            "n": "getMenuNew",
-            "t": int(datetime.datetime.now().timestamp() * 1000)
-        }
-        data = {
-            'data':
-                '{"flag":"getMenuNew","data":{"cn":"' + parentCategoryCode +
-                '","subId":"' + parentCategoryId + '"}}',
-        }
 
-        resp = requests.post(
-            shop_url,
-            params=params,
-            data=data,
-            headers=headers,
-        )
+class MomoDownloader:
+    def __init__(self, fetcher: Fetcher = None, base_url: str = BASE_URL):
+        self.fetcher = fetcher or Fetcher()
+        self.base_url = base_url
 
-        resp_json = resp.json()
-
-        child_categories = []
-        if "childCategories" in resp_json["rtnData"]["cateGoodsHM"]:
-            for child_category in resp_json["rtnData"]['cateGoodsHM'][
-                'childCategories']:
-                categoryTitle = child_category["categoryTitle"]
-
-                for brand in child_category["childCategoriesInfo"]:
-                    # if brand["childCategoryCode"] == '':
-                    #     print(brand)
-                    child_categories.append(
-                        {
-                            "categoryTitle": categoryTitle,
-                            "childCategoryCode": brand["childCategoryCode"],
-                            "childCategoryName": brand["childCategoryName"],
-                        }
-                    )
-        extra_child_categories = []
-        if "extraChildCategories" in resp_json["rtnData"]["cateGoodsHM"]:
-            for extra_child_category in resp_json["rtnData"]["cateGoodsHM"][
-                "extraChildCategories"]:
-                categoryTitle = extra_child_category["categoryTitle"]
-
-                for brand in extra_child_category["childCategoriesInfo"]:
-                    # if brand["childCategoryCode"] == '':
-                    #     print(brand)
-                    extra_child_categories.append(
-                        {
-                            "categoryTitle": categoryTitle,
-                            "childCategoryCode": brand["childCategoryCode"],
-                            "childCategoryName": brand["childCategoryName"],
-                        }
-                    )
+    def get_all_parentCategoryCode_of_brands(self):
+        resp = self.fetcher.request_sync(
+            "POST",
+            validate=lambda resp: "rtnData" in resp.json(),
+            **menu_request("brandAll", "brandAll", self.base_url)
+        )
+        return extract_parent_categories(resp.json())
 
-        return child_categories, extra_child_categories
+    def get_childCategoryCode_of_category_brand(
+        self, parentCategoryCode, parentCategoryId
+    ) -> typing.Tuple[typing.List[dict], typing.List[dict]]:
+        resp = self.fetcher.request_sync(
+            "POST",
+            validate=lambda resp: "rtnData" in resp.json(),
+            **menu_request(
+                parentCategoryCode, parentCategoryId, self.base_url
+            )
+        )
+        return extract_child_categories(resp.json())
 
     def get_brand_product_page(self, childCategoryCode):
         params = {
@@ -137,135 +191,222 @@ class MomoDownloader:
                 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
         }
 
-        response = requests.get(
-            'https://m.momoshop.com.tw/category.momo',
+        response = self.fetcher.request_sync(
+            "GET",
+            f'{self.base_url}/category.momo',
             params=params,
             headers=headers
         )
 
         return response
 
-    def get_brand_product_page_n(self, childCategoryCode, n):
-        params = {
-            'cn': childCategoryCode,
-            'page': n,
-            'sortType': '6',
-            'imgSH': 'fourCardStyle',
-        }
-
-        headers = {
-            'authority':
-                'm.momoshop.com.tw',
-            'origin':
-                'https://m.momoshop.com.tw',
-            'user-agent':
-                'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-        }
-
-        response = requests.get(
-            'https://m.momoshop.com.tw/category.momo',
-            params=params,
-            headers=headers
+    def get_brand_product_page_n(
+        self, childCategoryCode, n, if_changed=False
+    ):
+        response = self.fetcher.request_sync(
+            "GET",
+            **brand_page_request(childCategoryCode, n, self.base_url),
+            if_changed=if_changed,
         )
         return response
 
 
 class AioMomoBrandProductCrawler:
-    def __init__(self):
+    def __init__(
+        self,
+        fetcher: Fetcher = None,
+        concurrency: int = 32,
+        parser_backend: str = "bs4",
+        parse_executor: concurrent.futures.Executor = None,
+        markers: bool = False,
+        base_url: str = BASE_URL,
+    ):
         self.products = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=RateLimiter())
+        self.concurrency = concurrency
+        self.parser_backend = parser_backend
+        # 指定 ProcessPoolExecutor 時 HTML 解析不會佔用 event loop
+        self.parse_executor = parse_executor
+        # 品牌的每一頁都產出後再產出 Marker("momo_brand", child_category_code)；
+        # 有快取時，內容有變的頁面之後一定產出 Marker("response", cache key)，
+        # 寫入 DB 後交給 fetcher.confirm
+        self.markers = markers
+        self.base_url = base_url
+
+    async def parse_products(self, text) -> typing.List[dict]:
+        with self.fetcher.timer.span("parse"):
+            if self.parse_executor is None:
+                return parse_products(text, self.parser_backend)
+            return await asyncio.get_running_loop().run_in_executor(
+                self.parse_executor, parse_products, text, self.parser_backend
+            )
 
-    async def __call__(self, childCategoryCode_list):
-        raise Exception("will be banned")
-
-        async def crawl_page_1(aioclient, childCategoryCode):
-            params = {
-                'cn': childCategoryCode,
-                'cid': 'dir',
-                'oid': 'dir',
-                'imgSH': 'fourCardStyle',
-            }
-
-            headers = {
-                'authority':
-                    'm.momoshop.com.tw',
-                'origin':
-                    'https://m.momoshop.com.tw',
-                'user-agent':
-                    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-            }
-            url = 'https://m.momoshop.com.tw/category.momo'
-
-            async with aioclient.get(
-                url, params=params, headers=headers
-            ) as resp:
-                resp = await resp.text()
+    async def crawl_page_n(
+        self, aioclient, childCategoryCode, n, if_changed=False
+    ):
+        return await self.fetcher.request(
+            aioclient,
+            "GET",
+            **brand_page_request(childCategoryCode, n, self.base_url),
+            parse="text",
+            if_changed=if_changed,
+        )
 
-            return resp
+    def page_key(self, childCategoryCode, n) -> typing.Optional[str]:
+        return self.fetcher.cache_key(
+            "GET", **brand_page_request(childCategoryCode, n, self.base_url)
+        )
 
-        async def crawl_page_n(aioclient, childCategoryCode, n):
-            params = {
-                'cn': childCategoryCode,
-                'page': n,
-                'sortType': '6',
-                'imgSH': 'fourCardStyle',
-            }
+    async def crawl_page(self, aioclient, brand, n, if_changed=False):
+        # 與上次快取的內容相同時不解析，product_list 為 None
+        response = await self.crawl_page_n(
+            aioclient, brand["child_category_code"], n, if_changed
+        )
+        if isinstance(response, Unchanged):
+            return response.body, None
 
-            headers = {
-                'authority':
-                    'm.momoshop.com.tw',
-                'origin':
-                    'https://m.momoshop.com.tw',
-                'user-agent':
-                    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36',
-            }
+        product_list = await self.parse_products(response)
 
-            url = 'https://m.momoshop.com.tw/category.momo'
-            async with aioclient.get(
-                url, params=params, headers=headers
-            ) as resp:
-                resp = await resp.text()
-            return resp
+        for item in product_list:
+            item["child_category_code"] = brand["child_category_code"]
+            item["child_category_name"] = brand["child_category_name"]
+        return response, product_list
 
-        async def crawl_and_parse(aioclient, childCategoryCode):
-            all_product_list = []
+    async def crawl_and_parse(self, aioclient, brand, failures: list):
+        # 每一頁產出一個 batch，失敗的頁面記在 failures
+        if brand["child_category_code"] == "":
+            return
 
-            n = 1
-            while True:
-                if n == 1:
-                    response = await crawl_page_1(aioclient, childCategoryCode)
-                else:
-                    response = await crawl_page_n(
-                        aioclient, childCategoryCode, n
-                    )
+        response, product_list = await self.crawl_page(aioclient, brand, 1)
+        if len(product_list) == 0:
+            return
+        yield product_list
 
-                product_list = MomoProductPageParser().parse_products(response)
+        page_size = len(product_list)
+        page_count = parse_page_count(response, page_size)
 
-                all_product_list.extend(product_list)
+        n = 1
+        if page_count is not None and page_count > 1:
+            # 已知總頁數: 其餘頁面同時下載 (仍受 fetcher 的限速控制)
+            # 第一頁與最後一頁要用來判斷頁數，一定要解析
+            async def crawl_page_n(n):
+                _, product_list = await self.crawl_page(
+                    aioclient, brand, n, if_changed=n < page_count
+                )
+                return n, product_list
+
+            tasks = [
+                asyncio.ensure_future(crawl_page_n(n))
+                for n in range(2, page_count + 1)
+            ]
+            last_page_size = None
+            try:
+                for future in asyncio.as_completed(tasks):
+                    try:
+                        n, product_list = await future
+                    except FetchError as e:
+                        failures.append(e)
+                        continue
+                    if product_list is None:
+                        continue
+                    if n == page_count:
+                        last_page_size = len(product_list)
+                    if len(product_list) > 0:
+                        yield product_list
+                    key = self.page_key(brand["child_category_code"], n)
+                    if n < page_count and key is not None:
+                        yield Marker("response", key)
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+            # 最後一頁不滿一頁代表已經抓完，否則繼續逐頁確認
+            if last_page_size is not None and last_page_size < page_size:
+                return
+            n = page_count
+        # 總頁數為 1 時第一頁一定是滿的 (page_size 就是它的筆數)，頁數可能
+        # 是誤判，與其他頁數相同繼續逐頁確認到空頁為止
+        while True:
+            n += 1
+            _, product_list = await self.crawl_page(aioclient, brand, n)
+            if len(product_list) == 0:
+                break
+            yield product_list
+
+    async def crawl_brand(self, aioclient, brand):
+        # 有頁面失敗時不產出 marker，接續執行或下一輪排程會重爬這個品牌
+        failures = []
+        try:
+            async for product_list in self.crawl_and_parse(
+                aioclient, brand, failures
+            ):
+                yield product_list
+        finally:
+            self.failures.extend(failures)
+        if self.markers and not failures:
+            yield Marker("momo_brand", brand["child_category_code"])
+
+    async def stream(
+        self, brands: typing.Union[typing.Iterable, typing.AsyncIterable]
+    ) -> typing.AsyncIterator[typing.List[dict]]:
+        async with aiohttp.ClientSession() as session:
+            async for product_list in stream_batches(
+                brands,
+                lambda brand: self.crawl_brand(session, brand),
+                self.failures,
+                concurrency=self.concurrency,
+            ):
+                yield product_list
+
+    async def __call__(self, brands: typing.List[dict]) -> pd.DataFrame:
+        async for product_list in self.stream(brands):
+            if isinstance(product_list, Marker):
+                continue
+            self.products.extend(product_list)
 
-                if len(product_list) == 0:
-                    break
-                n += 1
+        df = pd.DataFrame(self.products)
+        df.drop_duplicates(inplace=True)
 
-            self.products.append((childCategoryCode, all_product_list))
+        return df
 
-        async def main():
-            nonlocal childCategoryCode_list
-            async with aiohttp.ClientSession() as session:
-                tasks = [
-                    crawl_and_parse(session, childCategoryCode)
-                    for childCategoryCode in childCategoryCode_list
-                ]
-                await asyncio.gather(*tasks)
 
-        await main()
+def _has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(
+        name
+    )
 
-        df = pd.DataFrame(self.products)
 
-        return df
+# 與 BeautifulSoup 的 find(tag, class_=...) 相同: 第一個符合的子孫節點
+LXML_ARTICLE = etree.XPath(
+    "//article[{}][1]".format(_has_class("prdListArea"))
+)
+LXML_FIELDS = {
+    "product_url_path": etree.XPath(
+        "(.//a[{}])[1]".format(_has_class("productInfo"))
+    ),
+    "product_event": etree.XPath(
+        "(.//p[{}])[1]".format(_has_class("prdEvent"))
+    ),
+    "product_name": etree.XPath("(.//h3[{}])[1]".format(_has_class("prdName"))),
+    "product_price": etree.XPath("(.//b[{}])[1]".format(_has_class("price"))),
+    "product_price_text": etree.XPath(
+        "(.//b[{}])[1]".format(_has_class("priceText"))
+    ),
+}
 
 
 class MomoProductPageParser:
+    # backend: "bs4" (html.parser) 或 "lxml"，兩者回傳相同的結果
+    def __init__(self, backend: str = "bs4"):
+        self.backend = backend
+
     def parse_products(self, text) -> typing.List[dict]:
+        if self.backend == "lxml":
+            return self.parse_products_lxml(text)
+        return self.parse_products_bs4(text)
+
+    def parse_products_bs4(self, text) -> typing.List[dict]:
         soup = BeautifulSoup(text, 'html.parser')
         article = soup.find("article", class_="prdListArea")
         if article is None:
@@ -291,31 +432,131 @@ class MomoProductPageParser:
             product_list.append(item)
         return product_list
 
+    def parse_products_lxml(self, text) -> typing.List[dict]:
+        if not text or not text.strip():
+            return []
+        article = LXML_ARTICLE(lxml_html.fromstring(text))
+        if len(article) == 0:
+            return []
+
+        product_list = []
+        for li in article[0].iter("li"):
+            item = {}
+            for field, xpath in LXML_FIELDS.items():
+                found = xpath(li)
+                # 欄位缺少時與 bs4 相同: None["href"] 為 TypeError，
+                # None.text 為 AttributeError，沒有 href 為 KeyError
+                if field == "product_url_path":
+                    if len(found) == 0:
+                        raise TypeError(f"{field} not found in product <li>")
+                    item[field] = found[0].attrib["href"]
+                else:
+                    if len(found) == 0:
+                        raise AttributeError(
+                            f"{field} not found in product <li>"
+                        )
+                    item[field] = found[0].text_content().strip()
+            product_list.append(item)
+        return product_list
+
+
+# 商品頁中可能出現的總頁數或商品總數，找不到時回傳 None 改為逐頁確認
+PAGE_COUNT_PATTERNS = [
+    re.compile(
+        r"""(?:totalPage|maxPage|pageCount|lastPage)["']?\s*[:=]\s*["']?(\d+)""",
+        re.IGNORECASE
+    ),
+]
+TOTAL_COUNT_PATTERNS = [
+    re.compile(
+        r"""(?:totalCount|totalCnt|goodsCount|totalSize)["']?\s*[:=]\s*["']?(\d+)""",
+        re.IGNORECASE
+    ),
+    re.compile(r"共\s*([\d,]+)\s*(?:筆|項|件|個商品)"),
+]
+
+
+def parse_page_count(text, page_size: int) -> typing.Optional[int]:
+    for pattern in PAGE_COUNT_PATTERNS:
+        match = pattern.search(text)
+        if match and int(match.group(1)) > 0:
+            return int(match.group(1))
+
+    if page_size > 0:
+        for pattern in TOTAL_COUNT_PATTERNS:
+            match = pattern.search(text)
+            if match and int(match.group(1).replace(",", "")) > 0:
+                return math.ceil(
+                    int(match.group(1).replace(",", "")) / page_size
+                )
+    return None
+
+
+def parse_products(text, backend: str = "bs4") -> typing.List[dict]:
+    # 給 ProcessPoolExecutor 使用的 module-level 函式
+    return MomoProductPageParser(backend).parse_products(text)
+
 
 class MomoCrawler:
-    def __init__(self):
-        self.momo = MomoDownloader()
-        self.momo_product_page = MomoProductPageParser()
+    def __init__(
+        self,
+        fetcher: Fetcher = None,
+        parser_backend: str = "bs4",
+        base_url: str = BASE_URL,
+    ):
+        self.momo = MomoDownloader(fetcher, base_url)
+        self.momo_product_page = MomoProductPageParser(parser_backend)
+        # 內容有變的 if_changed 頁面的快取 key，寫入 DB 後交給 fetcher.confirm
+        self.response_keys = []
 
     def collect_brand_products(self, brand: dict):
 
         all_product_list = []
 
         n = 1
+        page_count = None
         while True:
 
             if brand["child_category_code"] == "":
                 break
 
             response = self.momo.get_brand_product_page_n(
-                brand["child_category_code"], n
+                brand["child_category_code"],
+                n,
+                # 第一頁與最後一頁要用來判斷頁數，一定要解析
+                if_changed=page_count is not None and 1 < n < page_count,
             )
-            product_list = self.momo_product_page.parse_products(response.text)
+            if isinstance(response, Unchanged):
+                # 與上次快取的內容相同，不需要解析與寫入
+                n += 1
+                continue
+            with self.momo.fetcher.timer.span("parse"):
+                product_list = self.momo_product_page.parse_products(
+                    response.text
+                )
+            if page_count is not None and 1 < n < page_count:
+                key = self.momo.fetcher.cache_key(
+                    "GET",
+                    **brand_page_request(
+                        brand["child_category_code"], n, self.momo.base_url
+                    )
+                )
+                if key is not None:
+                    self.response_keys.append(key)
 
             all_product_list.extend(product_list)
 
             if len(product_list) == 0:
                 break
+            if n == 1:
+                page_size = len(product_list)
+                page_count = parse_page_count(response.text, page_size)
+            # 已知總頁數時，最後一頁不滿一頁就不用再多抓一個空頁；第一頁一定
+            # 是滿的，總頁數為 1 時仍要確認第二頁
+            if page_count is not None and n >= page_count and (
+                len(product_list) < page_size
+            ):
+                break
             n += 1
 
         for item in all_product_list:
@@ -327,64 +568,71 @@ class MomoCrawler:
 
         return df
 
-    def collect_brands(self) -> typing.List[dict]:
+    def collect_brands(self) -> pd.DataFrame:
         brands = []
         parent_category_list = self.momo.get_all_parentCategoryCode_of_brands()
 
         for parent_category in parent_category_list:
-            parentCategoryCode = parent_category["parentCategoryCode"]
-            parentCategoryName = parent_category["parentCategoryName"]
-            parentCategoryId = parent_category["parentCategoryId"]
-
             child_category_list, extra_child_category_list = self.momo.get_childCategoryCode_of_category_brand(
                 parent_category["parentCategoryCode"],
                 parent_category["parentCategoryId"]
             )
-
-            for child_category in child_category_list:
-                categoryTitle = child_category["categoryTitle"]
-                childCategoryCode = child_category["childCategoryCode"]
-                childCategoryName = child_category["childCategoryName"]
-
-                brands.append(
-                    {
-                        "parent_category_code": parentCategoryCode,
-                        "parent_category_name": parentCategoryName,
-                        "parent_category_id": parentCategoryId,
-                        "category_title": categoryTitle,
-                        "child_category_code": childCategoryCode,
-                        "child_category_name": childCategoryName,
-                    }
+            brands.extend(
+                build_brands(
+                    parent_category, child_category_list,
+                    extra_child_category_list
                 )
+            )
 
-            for extra_child_category in extra_child_category_list:
-                categoryTitle = extra_child_category["categoryTitle"]
-                childCategoryCode = extra_child_category["childCategoryCode"]
-                childCategoryName = extra_child_category["childCategoryName"]
+        return brands_to_df(brands)
+
+
+class AioMomoBrandCrawler:
+    # 同時查詢各個上層分類的品牌列表，結果與 MomoCrawler.collect_brands 相同
+    def __init__(self, fetcher: Fetcher = None, base_url: str = BASE_URL):
+        self.brands = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=RateLimiter())
+        self.base_url = base_url
+
+    async def __call__(self) -> pd.DataFrame:
+        def has_rtn_data(resp_json):
+            return "rtnData" in resp_json
+
+        async def get_brands_of_parent_category(aioclient, parent_category):
+            resp_json = await self.fetcher.request(
+                aioclient,
+                "POST",
+                validate=has_rtn_data,
+                **menu_request(
+                    parent_category["parentCategoryCode"],
+                    parent_category["parentCategoryId"], self.base_url
+                )
+            )
+            self.brands.extend(
+                build_brands(
+                    parent_category, *extract_child_categories(resp_json)
+                )
+            )
 
-                brands.append(
-                    {
-                        "parent_category_code": parentCategoryCode,
-                        "parent_category_name": parentCategoryName,
-                        "parent_category_id": parentCategoryId,
-                        "category_title": categoryTitle,
-                        "child_category_code": childCategoryCode,
-                        "child_category_name": childCategoryName,
-                    }
+        async def main():
+            async with aiohttp.ClientSession() as session:
+                resp_json = await self.fetcher.request(
+                    session,
+                    "POST",
+                    validate=has_rtn_data,
+                    **menu_request("brandAll", "brandAll", self.base_url)
                 )
+                tasks = [
+                    get_brands_of_parent_category(session, parent_category)
+                    for parent_category in
+                    extract_parent_categories(resp_json)
+                ]
+                await gather_isolated(tasks, self.failures)
 
-        df = pd.DataFrame(brands)
-        df.drop_duplicates(
-            subset=[
-                "parent_category_code",
-                "parent_category_id",
-                "child_category_code",
-            ],
-            keep="last",
-            inplace=True
-        )
+        await main()
 
-        return df
+        return brands_to_df(self.brands)
 
 
 if __name__ == "__main__":
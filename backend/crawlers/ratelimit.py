@@ -0,0 +1,209 @@
+import time
+import random
+import typing
+import asyncio
+import threading
+import contextlib
+import collections
+from urllib.parse import urlsplit
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = None
+
+    def _refill(self, now: float):
+        if self._updated_at is not None:
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated_at) * self.rate
+            )
+        self._updated_at = now
+
+    def delay(self, now: float) -> float:
+        # 先扣除一個 token，回傳需要等待的秒數
+        self._refill(now)
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class Slot:
+    def __init__(self) -> None:
+        self.failed = False
+
+    def backoff(self):
+        # 回應雖然沒有例外，但內容異常 (例如空的 body)
+        self.failed = True
+
+
+# 全域與各 host 的 token bucket 限速，加上同時連線數上限與隨機延遲
+#
+#     async with limiter(url):
+#         async with session.get(url) as resp:
+#             ...
+#
+# 同步的請求 (在 thread 中執行) 改用 limiter.sync(url)，與 async 的請求
+# 共用同一組 token bucket
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float = 5.0,
+        per_host_rate: float = 2.0,
+        burst: float = 2.0,
+        max_concurrency: int = 8,
+        jitter: float = 0.5,
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.jitter = jitter
+        self.per_host_rate = per_host_rate
+        self.burst = burst
+        self._global = TokenBucket(rate, burst)
+        self._hosts: typing.Dict[str, TokenBucket] = {}
+        self._loop = None
+        self._semaphore = None
+        # token bucket 可能同時被 event loop 與 thread 使用
+        self._lock = threading.Lock()
+        self._sync_semaphore = threading.BoundedSemaphore(max_concurrency)
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlsplit(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = TokenBucket(self.per_host_rate, self.burst)
+        return self._hosts[host]
+
+    def _ensure_semaphore(self):
+        # asyncio 物件與 event loop 綁定，換了 loop (asyncio.run) 就重建
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _reserve(self, url: str, now: float) -> float:
+        # 兩個 bucket 都先預約 token，取較長的等待時間
+        with self._lock:
+            delay = max(self._global.delay(now), self._bucket(url).delay(now))
+        return delay + random.uniform(0, self.jitter)
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, url: str):
+        async with self._ensure_semaphore():
+            # loop.time() 與 time.monotonic() 是同一個時鐘
+            await asyncio.sleep(self._reserve(url, self._loop.time()))
+            yield Slot()
+
+    @contextlib.contextmanager
+    def sync(self, url: str):
+        with self._sync_semaphore:
+            time.sleep(self._reserve(url, time.monotonic()))
+            yield Slot()
+
+
+# AIMD 自適應並行數: 延遲與錯誤率正常時每個 window 加一，
+# 遇到 429 / 5xx / 空回應 / 延遲暴增時減半
+#
+#     async with limiter() as slot:
+#         async with session.get(url) as resp:
+#             if resp.status == 429:
+#                 slot.backoff()
+class AIMDLimiter:
+    def __init__(
+        self,
+        initial_window: float = 8,
+        min_window: float = 1,
+        max_window: float = 128,
+        decrease_factor: float = 0.5,
+        latency_threshold: float = 3.0,
+    ) -> None:
+        self.window = float(initial_window)
+        self.min_window = min_window
+        self.max_window = max_window
+        self.decrease_factor = decrease_factor
+        # 延遲超過平均延遲的幾倍視為壅塞
+        self.latency_threshold = latency_threshold
+
+        self.in_flight = 0
+        self.latency = None
+        self.successes = 0
+        self.failures = 0
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+
+    def metrics(self) -> dict:
+        return {
+            "window": self.window,
+            "in_flight": self.in_flight,
+            "latency": self.latency,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+    async def _acquire(self):
+        loop = asyncio.get_running_loop()
+        while self.in_flight >= int(self.window):
+            waiter = loop.create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif waiter.done() and not waiter.cancelled():
+                    # 已經被叫醒才取消: 把名額交給下一個等待的請求
+                    self._wake()
+                raise
+        self.in_flight += 1
+
+    def _release(self, failed: bool, latency: float, now: float):
+        self.in_flight -= 1
+
+        congested = (
+            self.latency is not None and
+            latency > self.latency * self.latency_threshold
+        )
+        if failed or congested:
+            self.failures += failed
+            # 同一波壅塞只減一次
+            if now - self._last_decrease > (self.latency or 0):
+                self.window = max(
+                    self.min_window, self.window * self.decrease_factor
+                )
+                self._last_decrease = now
+        else:
+            self.successes += 1
+            self.window = min(self.max_window, self.window + 1 / self.window)
+
+        if not failed:
+            self.latency = latency if self.latency is None else (
+                0.9 * self.latency + 0.1 * latency
+            )
+
+        self._wake()
+
+    def _wake(self):
+        free = int(self.window) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, url: str = None):
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        slot = Slot()
+        try:
+            yield slot
+        except BaseException:
+            slot.failed = True
+            raise
+        finally:
+            now = loop.time()
+            self._release(slot.failed, now - start, now)
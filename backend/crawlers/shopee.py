@@ -4,31 +4,41 @@ import datetime
 import typing
 import pandas as pd
 
+from .fetch import Fetcher, FetchError, Unchanged, gather_isolated
+from .ratelimit import AIMDLimiter
+from .stream import Marker, stream_batches
+
+BASE_URL = "https://shopee.tw"
+SHOP_COLUMNS = ["username", "shopid", "brand_name", "ctime"]
+
 
 class AioShopCrawler:
-    def __init__(self) -> None:
+    def __init__(
+        self, fetcher: Fetcher = None, base_url: str = BASE_URL
+    ) -> None:
         self.brands = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=AIMDLimiter())
+        self.base_url = base_url
 
     async def __call__(self, *args, **kwds) -> pd.DataFrame:
         async def get_all_categories(aioclient):
-            async with aioclient.get(
-                "https://shopee.tw/api/v4/official_shop/get_categories?tab_type=0"
-            ) as resp:
-
-                resp_json = await resp.json()
-                categories = resp_json["data"]["categories"]
+            resp_json = await self.fetcher.request(
+                aioclient, "GET",
+                f"{self.base_url}/api/v4/official_shop/get_categories?tab_type=0"
+            )
+            categories = resp_json["data"]["categories"]
             return [item for item in categories]
 
         async def get_shop_by_category_id(aioclient, category_id):
-            async with aioclient.get(
-                f"https://shopee.tw/api/v4/official_shop/get_shops_by_category?need_zhuyin=1&category_id={category_id}"
-            ) as resp:
-
-                resp_json = await resp.json()
-                brands = resp_json["data"]["brands"]
-                self.brands.extend(
-                    [brand for item in brands for brand in item["brand_ids"]]
-                )
+            resp_json = await self.fetcher.request(
+                aioclient, "GET",
+                f"{self.base_url}/api/v4/official_shop/get_shops_by_category?need_zhuyin=1&category_id={category_id}"
+            )
+            brands = resp_json["data"]["brands"]
+            self.brands.extend(
+                [brand for item in brands for brand in item["brand_ids"]]
+            )
 
         async def main():
             async with aiohttp.ClientSession() as session:
@@ -38,11 +48,14 @@ class AioShopCrawler:
                     get_shop_by_category_id(session, cat["category_id"])
                     for cat in categories
                 ]
-                await asyncio.gather(*tasks)
+                await gather_isolated(tasks, self.failures)
 
         await main()
 
         df = pd.DataFrame(self.brands)
+        if df.empty:
+            # 所有分類都失敗時沒有任何欄位，回傳有欄位的空表
+            return pd.DataFrame(columns=SHOP_COLUMNS)
         df.sort_values(by=["ctime"], inplace=True)
         df.drop_duplicates(['username', 'shopid'], keep="last", inplace=True)
         df.sort_values(by="username", inplace=True)
@@ -50,151 +63,270 @@ class AioShopCrawler:
         return df
 
 
-class AioShopProductsCrawler:
-    def __init__(self) -> None:
-        self.items = []
-
-    async def __call__(self, shopids: typing.Iterable) -> pd.DataFrame:
-        def extract_item_fields(items):
-            need_fields = [
-                'itemid',
-                'shopid',
-                'name',
-                'currency',
-                'stock',
-                'status',
-                'ctime',
-                'sold',
-                'historical_sold',
-                'liked',
-                'liked_count',
-                'view_count',
-                'catid',
-                'brand',
-                'item_status',
-                'price',
-                'price_min',
-                'price_max',
-                'price_min_before_discount',
-                'price_max_before_discount',
-                'hidden_price_display',
-                'price_before_discount',
-                'has_lowest_price_guarantee',
-                'show_discount',
-                'raw_discount',
-                'discount',
-            ]
-            new_items = []
-            for item in items:
-                new_item = {key: item[key] for key in need_fields}
-                new_items.append(new_item)
-
-            return new_items
-
-        async def get_shop_product(aioclient, shopid, limit=30, offset=0):
-            url = "https://shopee.tw/api/v4/recommend/recommend"
-            params = {
-                "bundle": "shop_page_category_tab_main",
-                "item_card": "2",
-                "limit": limit,
-                "offset": offset,
-                "section": "shop_page_category_tab_main_sec",
-                "shopid": shopid,
-            }
-            sorting_choice = [
+class AioShopResolver:
+    # 只查詢指定 username 的商店，不走完整的官方商店目錄
+    def __init__(
+        self, fetcher: Fetcher = None, base_url: str = BASE_URL
+    ) -> None:
+        self.shops = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=AIMDLimiter())
+        self.base_url = base_url
+
+    async def __call__(self, usernames) -> pd.DataFrame:
+        async def get_shop_detail(aioclient, username):
+            resp_json = await self.fetcher.request(
+                aioclient,
+                "GET",
+                f"{self.base_url}/api/v4/shop/get_shop_detail",
+                params={"username": username},
+            )
+            shop = resp_json.get("data")
+            if not shop:
+                raise FetchError(f"shop not found: {username}")
+            self.shops.append(
                 {
-                    "sort_type": "1",
-                    "tab_name": "popular",
-                },
-                {
-                    "sort_type": "2",
-                    "tab_name": "latest",
-                },
-                {
-                    "sort_type": "13",
-                    "tab_name": "topsale",
-                },
-            ]
-            async with aioclient.get(
-                url, params={
-                    **params,
-                    **sorting_choice[1]
+                    "username": username,
+                    "shopid": shop["shopid"],
+                    "brand_name": shop["name"],
+                    "ctime": shop["ctime"],
                 }
-            ) as resp:
-                assert resp.status == 200
-                resp_json = await resp.json()
-                sections = resp_json["data"]["sections"]
-                assert len(sections) == 1
-                section = sections[0]
-                items = section["data"]["item"]
-
-                if items is None:
-                    # print( "此賣場尚無商品", "shopid:", shopid, resp_json)
-                    pass
-                else:
-                    self.items.extend(extract_item_fields(items))
-
-                total = section["total"]
-
-            while offset + limit < total:
-                offset += limit
-                params = {
-                    "bundle": "shop_page_category_tab_main",
-                    "item_card": "2",
-                    "limit": limit,
-                    "offset": offset,
-                    "section": "shop_page_category_tab_main_sec",
-                    "shopid": shopid,
-                }
-                retry_cnt = 3
-                while retry_cnt:
-                    async with aioclient.get(
-                        url, params={
-                            **params,
-                            **sorting_choice[1]
-                        }
-                    ) as resp:
-                        assert resp.status == 200
-                        resp_json = await resp.json()
-                        if resp_json is None:
-                            print(
-                                "resp_json, 此賣場怪怪", "shopid:", shopid, "limit:",
-                                limit, "offset:", offset, resp_json
-                            )
-
-                            retry_cnt -= 1
-                            continue
-
-                        sections = resp_json["data"]["sections"]
-                        assert len(sections) == 1
-                        section = sections[0]
-                        items = section["data"]["item"]
-
-                        if items is None:
-                            print(
-                                "items, 此賣場怪怪", "shopid:", shopid, "limit:",
-                                limit, "offset:", offset, resp_json
-                            )
-
-                            retry_cnt -= 1
-
-                        else:
-                            self.items.extend(extract_item_fields(items))
-
-                            retry_cnt = 0
-
-                        total = section["total"]
+            )
 
         async def main():
-            nonlocal shopids
             async with aiohttp.ClientSession() as session:
                 tasks = [
-                    get_shop_product(session, shopid) for shopid in shopids
+                    get_shop_detail(session, username) for username in usernames
                 ]
-                await asyncio.gather(*tasks)
+                await gather_isolated(tasks, self.failures)
 
         await main()
 
+        return pd.DataFrame(self.shops, columns=SHOP_COLUMNS)
+
+
+def extract_item_fields(items):
+    need_fields = [
+        'itemid',
+        'shopid',
+        'name',
+        'currency',
+        'stock',
+        'status',
+        'ctime',
+        'sold',
+        'historical_sold',
+        'liked',
+        'liked_count',
+        'view_count',
+        'catid',
+        'brand',
+        'item_status',
+        'price',
+        'price_min',
+        'price_max',
+        'price_min_before_discount',
+        'price_max_before_discount',
+        'hidden_price_display',
+        'price_before_discount',
+        'has_lowest_price_guarantee',
+        'show_discount',
+        'raw_discount',
+        'discount',
+    ]
+    new_items = []
+    for item in items:
+        new_item = {key: item[key] for key in need_fields}
+        new_item["single_model"] = is_single_model(item)
+        new_items.append(new_item)
+
+    return new_items
+
+
+def is_single_model(item) -> bool:
+    # 沒有任何一層規格有兩個以上的選項，代表只有一個規格
+    tier_variations = item.get("tier_variations")
+    if tier_variations is None:
+        return False
+    return all(len(tier.get("options") or []) <= 1 for tier in tier_variations)
+
+
+def extract_model_fields(models):
+    need_fields = ['itemid', 'modelid', 'name', 'price']
+    new_models = []
+    for model in models:
+        new_model = {key: model[key] for key in need_fields}
+        new_models.append(new_model)
+    return new_models
+
+
+# 接續執行時已寫入 (done_pages) 的頁面的商品: 不需要寫入，但規格可能還沒抓完
+class WrittenPage(Unchanged):
+    pass
+
+
+class AioShopProductsCrawler:
+    def __init__(
+        self,
+        fetcher: Fetcher = None,
+        concurrency: int = 32,
+        markers: bool = False,
+        done_pages: typing.Container[str] = (),
+        base_url: str = BASE_URL,
+    ) -> None:
+        self.items = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=AIMDLimiter())
+        self.concurrency = concurrency
+        # markers: 每一頁之後產出 Marker("shopee_page", "shopid:offset")
+        # 有快取時，內容有變的頁面之後一定產出 Marker("response", cache key)，
+        # 寫入 DB 後交給 fetcher.confirm
+        # done_pages: 已寫入的頁面，商品以 WrittenPage 產出，不再寫入但仍交給
+        # 規格爬取 (中斷時這些商品的規格可能還沒抓完)
+        self.markers = markers
+        self.done_pages = done_pages
+        self.base_url = base_url
+
+    def page_request(self, shopid, limit, offset) -> tuple:
+        # 回傳 (url, params)
+        url = f"{self.base_url}/api/v4/recommend/recommend"
+        params = {
+            "bundle": "shop_page_category_tab_main",
+            "item_card": "2",
+            "limit": limit,
+            "offset": offset,
+            "section": "shop_page_category_tab_main_sec",
+            "shopid": shopid,
+        }
+        sorting_choice = [
+            {
+                "sort_type": "1",
+                "tab_name": "popular",
+            },
+            {
+                "sort_type": "2",
+                "tab_name": "latest",
+            },
+            {
+                "sort_type": "13",
+                "tab_name": "topsale",
+            },
+        ]
+        return url, {**params, **sorting_choice[1]}
+
+    def page_key(self, shopid, limit, offset):
+        url, params = self.page_request(shopid, limit, offset)
+        return self.fetcher.cache_key("GET", url, params=params)
+
+    async def get_shop_product_page(
+        self, aioclient, shopid, limit, offset, if_changed=False
+    ):
+        def has_one_section(resp_json):
+            return resp_json.get("data") is not None and len(
+                resp_json["data"]["sections"]
+            ) == 1
+
+        def has_items(resp_json):
+            return has_one_section(resp_json) and resp_json["data"][
+                "sections"][0]["data"]["item"] is not None
+
+        url, params = self.page_request(shopid, limit, offset)
+        resp_json = await self.fetcher.request(
+            aioclient,
+            "GET",
+            url,
+            params=params,
+            # 第一頁沒有商品代表此賣場尚無商品，之後的頁面沒有商品則重試
+            validate=has_one_section if offset == 0 else has_items,
+            if_changed=if_changed,
+        )
+        if isinstance(resp_json, Unchanged):
+            return Unchanged(resp_json.body["data"]["sections"][0])
+        return resp_json["data"]["sections"][0]
+
+    async def get_shop_product(self, aioclient, shopid, limit=30, offset=0):
+        # 每一頁產出一個 batch
+        section = await self.get_shop_product_page(
+            aioclient, shopid, limit, offset, if_changed=True
+        )
+        for batch in self.page_batches(
+            shopid, offset, section, self.page_key(shopid, limit, offset)
+        ):
+            yield batch
+        total = self.section_total(section)
+
+        while offset + limit < total:
+            offset += limit
+            try:
+                section = await self.get_shop_product_page(
+                    aioclient, shopid, limit, offset, if_changed=True
+                )
+            except FetchError as e:
+                # 跳過這一頁，繼續抓下一頁
+                print(
+                    "此賣場怪怪", "shopid:", shopid, "limit:", limit, "offset:",
+                    offset, repr(e)
+                )
+                self.failures.append(e)
+                continue
+
+            for batch in self.page_batches(
+                shopid, offset, section, self.page_key(shopid, limit, offset)
+            ):
+                yield batch
+            total = self.section_total(section)
+
+    @staticmethod
+    def section_total(section) -> int:
+        if isinstance(section, Unchanged):
+            section = section.body
+        return section["total"]
+
+    def page_batches(self, shopid, offset, section, key=None) -> list:
+        page = f"{shopid}:{offset}"
+        if page in self.done_pages:
+            if isinstance(section, Unchanged):
+                section = section.body
+            if section["data"]["item"] is None:
+                return []
+            return [WrittenPage(extract_item_fields(section["data"]["item"]))]
+
+        batches = []
+        if isinstance(section, Unchanged):
+            # 與上次快取的內容相同: 商品不需要寫入，但仍要交給規格爬取判斷
+            if section.body["data"]["item"] is not None:
+                batches.append(
+                    Unchanged(extract_item_fields(section.body["data"]["item"]))
+                )
+        else:
+            if section["data"]["item"] is not None:
+                batches.append(extract_item_fields(section["data"]["item"]))
+            if key is not None:
+                batches.append(Marker("response", key))
+        if self.markers:
+            batches.append(Marker("shopee_page", page))
+        return batches
+
+    async def stream(
+        self, shopids: typing.Union[typing.Iterable, typing.AsyncIterable]
+    ) -> typing.AsyncIterator[typing.List[dict]]:
+        async with aiohttp.ClientSession() as session:
+            async for items in stream_batches(
+                shopids,
+                lambda shopid: self.get_shop_product(session, shopid),
+                self.failures,
+                concurrency=self.concurrency,
+            ):
+                yield items
+
+    async def __call__(self, shopids: typing.Iterable) -> pd.DataFrame:
+        async for items in self.stream(shopids):
+            if isinstance(items, Marker):
+                continue
+            if isinstance(items, Unchanged):
+                items = items.body
+            self.items.extend(items)
+
         df = pd.DataFrame(self.items)
         df.drop_duplicates(inplace=True)
 
@@ -202,41 +334,65 @@ class AioShopProductsCrawler:
 
 
 class AioProductModelsCrawler:
-    def __init__(self) -> None:
+    def __init__(
+        self,
+        fetcher: Fetcher = None,
+        concurrency: int = 32,
+        markers: bool = False,
+        base_url: str = BASE_URL,
+    ) -> None:
         self.item_models = []
+        self.failures = []
+        self.fetcher = fetcher or Fetcher(limiter=AIMDLimiter())
+        self.concurrency = concurrency
+        # 每個商品的規格之後產出 Marker("shopee_item", itemid)；有快取時
+        # 規格有變的商品之後一定產出 Marker("response", cache key)
+        self.markers = markers
+        self.base_url = base_url
+
+    async def get_item_info(self, aioclient, itemid, shopid):
+        url = f"{self.base_url}/api/v4/item/get"
+        params = {
+            "itemid": itemid,
+            "shopid": shopid,
+        }
+        resp_json = await self.fetcher.request(
+            aioclient,
+            "GET",
+            url,
+            params=params,
+            validate=lambda resp_json: resp_json.get("data") is not None,
+            if_changed=True,
+        )
+        # 與上次快取的內容相同時規格沒有變動，不需要寫入
+        if not isinstance(resp_json, Unchanged):
+            yield extract_model_fields(resp_json["data"]["models"])
+            key = self.fetcher.cache_key("GET", url, params=params)
+            if key is not None:
+                yield Marker("response", key)
+        if self.markers:
+            yield Marker("shopee_item", itemid)
+
+    async def stream(
+        self,
+        item_shop_list: typing.Union[typing.Iterable, typing.AsyncIterable],
+    ) -> typing.AsyncIterator[typing.List[dict]]:
+        async with aiohttp.ClientSession() as session:
+            async for models in stream_batches(
+                item_shop_list,
+                lambda item_shop: self.get_item_info(session, *item_shop),
+                self.failures,
+                concurrency=self.concurrency,
+            ):
+                yield models
 
     async def __call__(
         self, item_shop_list: typing.List[tuple]
     ) -> pd.DataFrame:
-        def extract_model_fields(models):
-            need_fields = ['itemid', 'modelid', 'name', 'price']
-            new_models = []
-            for model in models:
-                new_model = {key: model[key] for key in need_fields}
-                new_models.append(new_model)
-            return new_models
-
-        async def get_item_info(aioclient, itemid, shopid):
-            url = "https://shopee.tw/api/v4/item/get"
-            params = {
-                "itemid": itemid,
-                "shopid": shopid,
-            }
-            async with aioclient.get(url, params=params) as resp:
-                resp_json = await resp.json()
-                models = resp_json["data"]["models"]
-                self.item_models.extend(extract_model_fields(models))
-
-        async def main():
-            nonlocal item_shop_list
-            async with aiohttp.ClientSession() as session:
-                tasks = [
-                    get_item_info(session, itemid, shopid)
-                    for itemid, shopid in item_shop_list
-                ]
-                await asyncio.gather(*tasks)
-
-        await main()
+        async for models in self.stream(item_shop_list):
+            if isinstance(models, Marker):
+                continue
+            self.item_models.extend(models)
 
         df = pd.DataFrame(self.item_models)
         df.drop_duplicates(inplace=True)
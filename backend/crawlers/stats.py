@@ -0,0 +1,37 @@
+import time
+import threading
+import contextlib
+import collections
+
+
+# 一次爬取中各 stage (fetch / parse / normalize / persist) 的累計時間與次數
+#
+# 同一個 stage 可能同時在多個 coroutine 或 thread 中執行，累計時間是每次的
+# 加總，可能大於 wall time。
+class StageTimer:
+    def __init__(self) -> None:
+        self.seconds = collections.defaultdict(float)
+        self.calls = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.calls[stage] += 1
+
+    @contextlib.contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                stage: {
+                    "seconds": round(seconds, 3),
+                    "calls": self.calls[stage]
+                } for stage, seconds in self.seconds.items()
+            }
@@ -0,0 +1,91 @@
+import typing
+import asyncio
+
+DONE = object()
+
+
+class Marker:
+    # 夾在 batch 之間的標記: 排在它前面、同一個來源的 batch 都處理完後才會
+    # 被處理，用來記錄 checkpoint
+    def __init__(self, kind: str, key) -> None:
+        self.kind = kind
+        self.key = key
+
+
+async def iterate_queue(queue: asyncio.Queue) -> typing.AsyncIterator:
+    while True:
+        item = await queue.get()
+        if item is DONE:
+            return
+        yield item
+
+
+def put_done_nowait(queue: asyncio.Queue, count: int = 1):
+    # 失敗或被取消時使用: 其他 task 也會一起被取消，等待已滿的 queue
+    # 會永遠卡住，放不下就不放
+    for _ in range(count):
+        try:
+            queue.put_nowait(DONE)
+        except asyncio.QueueFull:
+            return
+
+
+async def _feed(items, queue: asyncio.Queue, workers: int):
+    try:
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await queue.put(item)
+        else:
+            for item in items:
+                await queue.put(item)
+    except BaseException:
+        put_done_nowait(queue, workers)
+        raise
+    for _ in range(workers):
+        await queue.put(DONE)
+
+
+async def stream_batches(
+    items: typing.Union[typing.Iterable, typing.AsyncIterable],
+    handle: typing.Callable[[typing.Any], typing.AsyncIterator[list]],
+    failures: list,
+    concurrency: int = 32,
+    maxsize: int = 32,
+) -> typing.AsyncIterator[list]:
+    # 以 concurrency 個 worker 執行 handle(item)，依完成順序輸出每個 batch
+    #
+    # 輸入與輸出都是有上限的 queue: 下游處理不及時 worker 會停下來等待，
+    # 不會把整份結果堆在記憶體中。單一 item 失敗只記錄在 failures。
+    inbox = asyncio.Queue(maxsize)
+    outbox = asyncio.Queue(maxsize)
+
+    async def worker():
+        try:
+            async for item in iterate_queue(inbox):
+                try:
+                    async for batch in handle(item):
+                        await outbox.put(batch)
+                except Exception as e:
+                    failures.append(e)
+        except BaseException:
+            put_done_nowait(outbox)
+            raise
+        await outbox.put(DONE)
+
+    tasks = [asyncio.ensure_future(_feed(items, inbox, concurrency))]
+    tasks += [asyncio.ensure_future(worker()) for _ in range(concurrency)]
+
+    try:
+        finished = 0
+        while finished < concurrency:
+            batch = await outbox.get()
+            if batch is DONE:
+                finished += 1
+            else:
+                yield batch
+        # 讓 feeder 的例外 (例如上游失敗) 往外傳
+        await tasks[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
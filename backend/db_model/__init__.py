@@ -1,4 +1,5 @@
 from . import shopee
 from . import momo
+from . import crawl
 
-from .base import Base
+from .base import Base, create_all
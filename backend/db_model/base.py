@@ -1,3 +1,82 @@
+import sqlalchemy as sa
 from sqlalchemy.orm import declarative_base
 
 Base = declarative_base()
+
+# 商品名稱的 trigram 索引需要 pg_trgm
+sa.event.listen(
+    Base.metadata, "before_create",
+    sa.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+)
+
+# *_current 資料表、對應的歷史資料表與唯一鍵
+CURRENT_TABLES = [
+    ("shopee_product_current", "shopee_product", ["shopid", "itemid"]),
+    (
+        "shopee_product_model_current", "shopee_product_model",
+        ["itemid", "modelid"]
+    ),
+    ("momo_product_current", "momo_product", ["product_url_path"]),
+]
+
+# 搜尋改查 *_current 之後不再使用、只增加寫入成本的索引
+OBSOLETE_INDEXES = [
+    "shopee_product_name_trgm_idx",
+    "momo_product_product_name_trgm_idx",
+]
+
+
+def backfill_current(conn, current: sa.Table, history: sa.Table, keys):
+    # *_current 還是空的時候 (剛建立) 以歷史資料中每個鍵最新的一筆補上，
+    # 否則搜尋要等到下一次爬取才有資料
+    if conn.execute(sa.select(current.c.id).limit(1)).first() is not None:
+        return
+    columns = ", ".join(
+        column.name
+        for column in current.c
+        if column.name != "id" and column.name in history.c
+    )
+    key_columns = ", ".join(keys)
+    not_null = " AND ".join(f"{key} IS NOT NULL" for key in keys)
+    conn.execute(
+        sa.text(
+            f"INSERT INTO {current.name} ({columns}) "
+            f"SELECT DISTINCT ON ({key_columns}) {columns} "
+            f"FROM {history.name} WHERE {not_null} "
+            f"ORDER BY {key_columns}, crawled_at DESC, id DESC "
+            "ON CONFLICT DO NOTHING"
+        )
+    )
+
+
+def create_all(engine):
+    Base.metadata.create_all(engine)
+
+    # create_all 不會替既有的資料表補建新加的欄位 (須可為 NULL 或有
+    # server_default，既有的資料列會填入預設值) 與索引
+    inspector = sa.inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.c:
+                if column.name not in existing:
+                    column_spec = sa.schema.CreateColumn(column).compile(
+                        dialect=engine.dialect
+                    )
+                    conn.execute(
+                        sa.text(
+                            f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS"
+                            f" {column_spec}"
+                        )
+                    )
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for name in OBSOLETE_INDEXES:
+            conn.execute(sa.text(f"DROP INDEX IF EXISTS {name}"))
+
+    tables = Base.metadata.tables
+    with engine.begin() as conn:
+        for current, history, keys in CURRENT_TABLES:
+            backfill_current(conn, tables[current], tables[history], keys)
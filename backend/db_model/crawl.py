@@ -0,0 +1,86 @@
+import sqlalchemy as sa
+import datetime
+
+from .base import Base
+
+
+# 每次執行 runner 一筆，finished_at 為空代表中途停止，可以 --resume 接續
+#
+# stats 為結束時各平台的 wall time、各 stage 時間、請求/重試/位元組數與寫入筆數，
+# 供 runner.py --report 與之前的執行比較
+class CrawlRun(Base):
+    __tablename__ = "crawl_run"
+    id = sa.Column(sa.Integer, primary_key=True)
+    started_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+    finished_at = sa.Column(sa.TIMESTAMP)
+    stats = sa.Column(sa.JSON(none_as_null=True))
+
+
+# 某次執行中已經完整寫入 DB 的工作單位 (商店、頁面、品牌、商品)
+class CrawlCheckpoint(Base):
+    __tablename__ = "crawl_checkpoint"
+    id = sa.Column(sa.Integer, primary_key=True)
+    run_id = sa.Column(
+        sa.Integer, sa.ForeignKey("crawl_run.id"), nullable=False
+    )
+    kind = sa.Column(sa.String, nullable=False)
+    key = sa.Column(sa.String, nullable=False)
+
+    created_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'run_id', 'kind', 'key', name='crawl_checkpoint_uc'
+        ),
+    )
+
+
+# 工作佇列中的一個工作，多個 worker 以 FOR UPDATE SKIP LOCKED 領取
+#
+# status: pending / done / failed。lease_until 之前此工作屬於 worker，
+# 過期後 (例如 worker 死掉) 其他 worker 可以重新領取。
+class CrawlTask(Base):
+    __tablename__ = "crawl_task"
+    id = sa.Column(sa.BigInteger, primary_key=True)
+    run_id = sa.Column(
+        sa.Integer, sa.ForeignKey("crawl_run.id"), nullable=False
+    )
+    kind = sa.Column(sa.String, nullable=False)
+    payload = sa.Column(sa.JSON, nullable=False)
+    status = sa.Column(sa.String, nullable=False, default="pending")
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    lease_until = sa.Column(sa.TIMESTAMP)
+    worker = sa.Column(sa.String)
+    error = sa.Column(sa.String)
+
+    created_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+    finished_at = sa.Column(sa.TIMESTAMP)
+
+    __table_args__ = (
+        sa.Index('crawl_task_status_idx', 'status', 'lease_until', 'id'),
+        sa.Index('crawl_task_run_id_idx', 'run_id', 'status'),
+    )
+
+
+# 排程模式下每個商店、品牌、商品的變動頻率與上次爬取時間
+class CrawlSchedule(Base):
+    __tablename__ = "crawl_schedule"
+    id = sa.Column(sa.Integer, primary_key=True)
+    kind = sa.Column(sa.String, nullable=False)
+    key = sa.Column(sa.String, nullable=False)
+    rate = sa.Column(sa.Float)  # 每小時變動次數
+    cost = sa.Column(sa.Integer)  # 預估請求數
+    interval_hours = sa.Column(sa.Float)
+    last_crawled_at = sa.Column(sa.TIMESTAMP)
+
+    __table_args__ = (
+        sa.UniqueConstraint('kind', 'key', name='crawl_schedule_uc'),
+    )
+
+
+# 資料版本，爬取完成時遞增；API 的 /product/ 快取看到新版本時清空
+class DataVersion(Base):
+    __tablename__ = "data_version"
+    id = sa.Column(sa.Integer, primary_key=True)
+    version = sa.Column(sa.BigInteger, nullable=False, default=0)
+    updated_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
@@ -60,4 +60,47 @@ class MomoProduct(Base):
         sa.Index('momo_product_product_price_idx', 'product_price'),
         sa.Index('momo_product_product_price_text_idx', 'product_price_text'),
         sa.Index('momo_product_crawled_at_idx', 'crawled_at'),
-    )
\ No newline at end of file
+    )
+
+
+# 每個商品最新一次爬到的狀態，歷史資料仍保留在 momo_product
+class MomoProductCurrent(Base):
+    __tablename__ = "momo_product_current"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+
+    child_category_code = sa.Column(sa.String)
+    child_category_name = sa.Column(sa.String)
+
+    product_url_path = sa.Column(sa.String, nullable=False)
+    product_event = sa.Column(sa.String)
+    product_name = sa.Column(sa.String)
+    product_price = sa.Column(sa.String)
+    product_price_parsed = sa.Column(sa.Float)
+    product_price_text = sa.Column(sa.String)
+
+    crawled_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+    # 最後一次寫入的 transaction id (由 DB 設定)，搜尋索引以此判斷要重新載入
+    # 哪些商品
+    write_txid = sa.Column(
+        sa.BigInteger, server_default=sa.text("txid_current()")
+    )
+
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'product_url_path', name='momo_product_current_uc'
+        ),
+        sa.Index(
+            'momo_product_current_product_name_trgm_idx',
+            'product_name',
+            postgresql_using='gin',
+            postgresql_ops={'product_name': 'gin_trgm_ops'}
+        ),
+        sa.Index(
+            'momo_product_current_product_price_parsed_idx',
+            'product_price_parsed'
+        ),
+        sa.Index(
+            'momo_product_current_write_txid_idx', 'write_txid', 'id'
+        ),
+    )
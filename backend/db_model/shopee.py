@@ -70,3 +70,65 @@ class ShopeeProductModel(Base):
         sa.Index('shopee_product_model_name_idx', 'name'),
         sa.Index('shopee_product_model_crawled_at_idx', 'crawled_at'),
     )
+
+
+# 每個商品最新一次爬到的狀態，歷史資料仍保留在 shopee_product
+class ShopeeProductCurrent(Base):
+    __tablename__ = "shopee_product_current"
+    id = sa.Column(sa.Integer, primary_key=True)
+    itemid = sa.Column(sa.BigInteger, nullable=False)
+    shopid = sa.Column(sa.Integer, nullable=False)
+    name = sa.Column(sa.String)
+    currency = sa.Column(sa.String)
+    stock = sa.Column(sa.Integer)
+    item_created_time = sa.Column(sa.TIMESTAMP)
+    price = sa.Column(sa.Float)
+    price_min = sa.Column(sa.FLOAT)
+    price_max = sa.Column(sa.FLOAT)
+    price_min_before_discount = sa.Column(sa.FLOAT)
+    price_max_before_discount = sa.Column(sa.FLOAT)
+    discount = sa.Column(sa.Float)
+
+    crawled_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+    # 最後一次寫入的 transaction id (由 DB 設定)，搜尋索引以此判斷要重新載入
+    # 哪些商品
+    write_txid = sa.Column(
+        sa.BigInteger, server_default=sa.text("txid_current()")
+    )
+
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'shopid', 'itemid', name='shopee_product_current_uc'
+        ),
+        sa.Index(
+            'shopee_product_current_name_trgm_idx',
+            'name',
+            postgresql_using='gin',
+            postgresql_ops={'name': 'gin_trgm_ops'}
+        ),
+        sa.Index('shopee_product_current_price_idx', 'price'),
+        sa.Index(
+            'shopee_product_current_write_txid_idx', 'write_txid', 'id'
+        ),
+    )
+
+
+# 每個商品規格最新一次爬到的狀態，歷史資料仍保留在 shopee_product_model
+class ShopeeProductModelCurrent(Base):
+    __tablename__ = "shopee_product_model_current"
+    id = sa.Column(sa.Integer, primary_key=True)
+    itemid = sa.Column(sa.BigInteger, nullable=False)
+    modelid = sa.Column(sa.BigInteger, nullable=False)
+    name = sa.Column(sa.String)
+    price = sa.Column(sa.Float)
+
+    crawled_at = sa.Column(sa.TIMESTAMP, default=datetime.datetime.now)
+
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'itemid', 'modelid', name='shopee_product_model_current_uc'
+        ),
+        sa.Index(
+            'shopee_product_model_current_crawled_at_idx', 'crawled_at'
+        ),
+    )
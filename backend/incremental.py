@@ -0,0 +1,131 @@
+import datetime
+import collections
+import typing
+import threading
+
+import sqlalchemy as sa
+
+import db_model
+
+
+def _price(value):
+    # 與 ShopeeRunner.normalize_products 相同的單位換算
+    return value if value == -1 else value / 100000
+
+
+# 決定哪些 Shopee 商品需要呼叫 item/get 抓規格
+#
+# 以 shopee_product_current 中上次的列表資料為基準: 價格區間、上架時間與庫存
+# 都沒變的商品不重抓規格，只有單一規格且已經抓過規格的商品不再重抓。
+# 沒變動的商品依 itemid 分散到 refresh_days 天中的某一天定期重抓，
+# 確保只改了規格內容的商品最晚 refresh_days 天後也會更新。
+class ModelCrawlFilter:
+    def __init__(self, engine, refresh_days: int = 7) -> None:
+        self.engine = engine
+        self.refresh_days = max(refresh_days, 1)
+        self.counts = collections.Counter()
+        self._listings = None
+        self._crawled_items = None
+        self._load_lock = threading.Lock()
+
+    def load(self, items: typing.List[dict] = None):
+        # 指定 items 時只重新載入這些商品 (工作佇列模式下其他 worker
+        # 可能在這之後才寫入)，否則載入全部
+        product = db_model.shopee.ShopeeProductCurrent.__table__
+        model = db_model.shopee.ShopeeProductModelCurrent.__table__
+
+        product_stmt = sa.select(
+            product.c.shopid, product.c.itemid, product.c.price_min,
+            product.c.price_max, product.c.item_created_time, product.c.stock
+        )
+        model_stmt = sa.select(model.c.itemid).distinct()
+        if items is None:
+            self._listings = {}
+            self._crawled_items = set()
+        else:
+            if self._listings is None:
+                self._listings = {}
+                self._crawled_items = set()
+            keys = [(item["shopid"], item["itemid"]) for item in items]
+            itemids = [item["itemid"] for item in items]
+            for key in keys:
+                self._listings.pop(key, None)
+            self._crawled_items.difference_update(itemids)
+            product_stmt = product_stmt.where(
+                sa.tuple_(product.c.shopid, product.c.itemid).in_(keys)
+            )
+            model_stmt = model_stmt.where(model.c.itemid.in_(itemids))
+
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(
+                product_stmt
+            )
+            for row in result:
+                self._listings[(row[0], row[1])] = tuple(row[2:])
+
+            result = conn.execution_options(stream_results=True).execute(
+                model_stmt
+            )
+            for row in result:
+                self._crawled_items.add(row[0])
+
+    def ensure_loaded(self):
+        # 同時爬多個商店時只載入一次，之後以 remember_* 更新
+        with self._load_lock:
+            if self._listings is None:
+                self.load()
+
+    def remember_listings(self, df):
+        # 寫入 shopee_product 之後呼叫，同一個 process 之後的判斷 (例如排程
+        # 模式的下一輪) 以這次寫入的列表資料為準
+        columns = [
+            "shopid", "itemid", "price_min", "price_max", "item_created_time",
+            "stock"
+        ]
+        with self._load_lock:
+            if self._listings is None:
+                return
+            for row in df[columns].itertuples(index=False):
+                self._listings[(row[0], row[1])] = tuple(row[2:])
+
+    def remember_models(self, itemids: typing.Iterable[int]):
+        # 寫入 shopee_product_model 之後呼叫
+        with self._load_lock:
+            if self._crawled_items is not None:
+                self._crawled_items.update(itemids)
+
+    def _due(self, itemid) -> bool:
+        today = datetime.date.today().toordinal()
+        return (itemid + today) % self.refresh_days == 0
+
+    def reason(self, item: dict) -> str:
+        # 單一規格的商品也要先抓過一次，shopee_product_model 才會有資料
+        if item.get("single_model") and item["itemid"] in self._crawled_items:
+            return "single_model"
+
+        listing = (
+            _price(item["price_min"]),
+            _price(item["price_max"]),
+            datetime.datetime.fromtimestamp(item["ctime"]),
+            item["stock"],
+        )
+        old_listing = self._listings.get((item["shopid"], item["itemid"]))
+        if old_listing is None:
+            return "new"
+        if old_listing != listing:
+            return "changed"
+        if item["itemid"] not in self._crawled_items:
+            return "never_crawled"
+        if self._due(item["itemid"]):
+            return "refresh"
+        return "unchanged"
+
+    def __call__(self, item: dict) -> bool:
+        self.ensure_loaded()
+
+        reason = self.reason(item)
+        self.counts[reason] += 1
+        return reason not in ("single_model", "unchanged")
+
+    def saved(self) -> int:
+        return self.counts["single_model"] + self.counts["unchanged"]
@@ -1,39 +1,96 @@
 from typing import Optional, List
-from fastapi import FastAPI, status
+from fastapi import FastAPI, HTTPException, Query, Response, status
 from pydantic import BaseModel, Field
 from databases import Database
 import asyncio
+import base64
+import heapq
+import itertools
+import json
+import time
+
+import prometheus_client
 
 import sqlalchemy as sa
 
 import db_model
+import search_index
+import search_cache
+import metrics
 
 from settings import settings
 
 engine = sa.create_engine(settings.DB_URI)
-db_model.Base.metadata.create_all(engine)
+db_model.create_all(engine)
 
 database = Database(settings.DB_URI)
 
+product_index = search_index.ProductSearchIndex()
+
+product_cache = search_cache.SearchCache(
+    max_entries=settings.SEARCH_CACHE_MAX_ENTRIES,
+    ttl=settings.SEARCH_CACHE_TTL_SECONDS,
+)
+
 app = FastAPI(
     title="Price comparing API",
     description="This is a price comparing API of e-commerce platforms",
     version="0.0.1"
 )
+app.add_middleware(metrics.MetricsMiddleware)
+prometheus_client.REGISTRY.register(
+    metrics.SearchCacheCollector(product_cache)
+)
+
+
+async def refresh_product_index():
+    while True:
+        await asyncio.sleep(settings.SEARCH_INDEX_REFRESH_SECONDS)
+        try:
+            await product_index.refresh(database)
+        except Exception as e:
+            # 下一輪再從 watermark 繼續
+            print("product index refresh failed:", repr(e))
+
+
+async def watch_data_version():
+    while True:
+        await asyncio.sleep(settings.SEARCH_CACHE_VERSION_SECONDS)
+        try:
+            product_cache.set_version(
+                await search_cache.data_version(database)
+            )
+        except Exception as e:
+            print("data version check failed:", repr(e))
 
 
 @app.on_event("startup")
 async def startup():
     await database.connect()
 
+    if settings.SEARCH_BACKEND == "memory":
+        await product_index.refresh(database)
+        app.state.refresh_task = asyncio.create_task(refresh_product_index())
+
+    if settings.SEARCH_CACHE_TTL_SECONDS > 0:
+        product_cache.set_version(await search_cache.data_version(database))
+        app.state.version_task = asyncio.create_task(watch_data_version())
+
 
 @app.on_event("shutdown")
 async def shutdown():
+    if settings.SEARCH_BACKEND == "memory":
+        app.state.refresh_task.cancel()
+    if settings.SEARCH_CACHE_TTL_SECONDS > 0:
+        app.state.version_task.cancel()
+
     await database.disconnect()
 
 
-shopee_url_template = "https://shopee.tw/{}-i.{}.{}"  # name, shopid, itemid
-momo_url_template = "https://m.momoshop.com.tw{}"  # product_url_path
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 
 class ProductOut(BaseModel):
@@ -44,70 +101,194 @@ class ProductOut(BaseModel):
     platform: str
 
 
-def deduplicate_keep_first(items) -> list:
-    seen = set()
-    result = []
-    for item in items:
-        if not item["url"] in seen:
-            seen.add(item["url"])
-            result.append(item)
-    return result
+def encode_cursor(item: dict) -> str:
+    # cursor 為最後一筆的排序鍵 (price, -id, platform)，client 不需要解讀
+    key = json.dumps([item["price"], -item["id"], item["platform"]])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        price, neg_id, platform = json.loads(
+            base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        )
+        if platform not in search_index.PLATFORMS:
+            raise ValueError(platform)
+        return (float(price), int(neg_id), platform)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="invalid cursor"
+        ) from e
 
 
 @app.get("/product/", response_model=List[ProductOut])
-async def search_product(product_name: str) -> List[ProductOut]:
+async def search_product(
+    response: Response,
+    product_name: str,
+    limit: int = Query(
+        settings.SEARCH_PAGE_SIZE, ge=1, le=settings.SEARCH_MAX_PAGE_SIZE
+    ),
+    cursor: Optional[str] = None,
+) -> List[ProductOut]:
+    # 價格低到高排序，還有下一頁時以 X-Next-Cursor header 回傳下一頁的 cursor
+    after = None if cursor is None else decode_cursor(cursor)
+    if settings.SEARCH_CACHE_TTL_SECONDS > 0:
+        # 快取的 list 由多個請求共用，回傳前不可修改
+        items, next_cursor = await product_cache.get(
+            search_product_page, product_name, after, limit
+        )
+    else:
+        items, next_cursor = await search_product_page(
+            product_name, after, limit
+        )
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return items
 
-    shopee_stmt = """
-    SELECT * FROM public.shopee_product
-    WHERE name LIKE :product_name_pattern
-    ORDER BY crawled_at DESC LIMIT 10
-    """
 
-    momo_stmt = """
-    SELECT * from momo_product
-    WHERE product_name LIKE :product_name_pattern
-    ORDER BY crawled_at DESC LIMIT 10
-    """
+async def search_product_page(
+    product_name: str, after: Optional[tuple], limit: int
+) -> tuple:
+    # 多取一筆判斷是否還有下一頁，回傳 (商品, 下一頁的 cursor 或 None)
+    if settings.SEARCH_BACKEND == "memory":
+        with metrics.SEARCH_STAGE_SECONDS.labels("memory_search").time():
+            items = product_index.page(product_name, after, limit + 1)
+    else:
+        items = await search_product_in_db(product_name, after, limit + 1)
 
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+
+    for platform in search_index.PLATFORMS:
+        metrics.SEARCH_RESULT_ROWS.labels(platform).observe(
+            sum(1 for item in items if item["platform"] == platform)
+        )
+    metrics.SEARCH_RESULT_ROWS.labels("all").observe(len(items))
+    return items, next_cursor
+
+
+# 一個平台的一頁商品，依 (price, -id) 排序，以 keyset 取出 cursor 之後的一頁，
+# 後面的頁面不需要 OFFSET 掃過前面的商品。沒有任何名稱符合 (LIKE) 的商品時，
+# 改以 trigram 相似度 (name % :product_name) 取出相近的商品，同樣依價格分頁。
+# 兩個分支各自套用 keyset 與 LIMIT，最多只有 2 * limit 筆。
+# *_current 每個商品只有一筆 (shopid, itemid / product_url_path 唯一)，url 不會
+# 重複。url 與 search_index 的 shopee_url_template / momo_url_template 相同
+PLATFORM_PAGE_STMT = """
+(
+    SELECT id, {name} AS name, {price} AS price, {url} AS url
+    FROM {table}
+    WHERE {name} LIKE :product_name_pattern AND {price} IS NOT NULL
+        {keyset}
+    ORDER BY {price}, id DESC
+    LIMIT :limit
+)
+UNION ALL
+(
+    SELECT id, {name} AS name, {price} AS price, {url} AS url
+    FROM {table}
+    WHERE {name} % :product_name AND {price} IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM {table}
+            WHERE {name} LIKE :product_name_pattern AND {price} IS NOT NULL
+        )
+        {keyset}
+    ORDER BY {price}, id DESC
+    LIMIT :limit
+)
+ORDER BY price, id DESC
+LIMIT :limit
+"""
+
+PLATFORM_COLUMNS = {
+    "shopee": {
+        "table": "shopee_product_current",
+        "name": "name",
+        "price": "price",
+        "url":
+            "'https://shopee.tw/' || name || '-i.' || shopid || '.' || itemid",
+    },
+    "momo": {
+        "table": "momo_product_current",
+        "name": "product_name",
+        "price": "product_price_parsed",
+        "url": "'https://m.momoshop.com.tw' || product_url_path",
+    },
+}
+
+# {price} >= :price 讓價格索引可以直接從 cursor 的位置開始掃描
+KEYSET_CLAUSE = (
+    "AND {price} >= :price "
+    "AND ({price}, -id, '{platform}') > (:price, :neg_id, :platform)"
+)
+
+
+def page_stmt(platform: str, after: Optional[tuple]) -> str:
+    columns = PLATFORM_COLUMNS[platform]
+    keyset = "" if after is None else KEYSET_CLAUSE.format(
+        price=columns["price"], platform=platform
+    )
+    return PLATFORM_PAGE_STMT.format(keyset=keyset, **columns)
+
+
+def sort_key(item: dict) -> tuple:
+    return (item["price"], -item["id"], item["platform"])
+
+
+async def search_platform_page(
+    platform: str, values: dict, after: Optional[tuple]
+) -> list:
+    # 每個平台各用一個連線，分開記錄連線池的等待時間與查詢時間
+    start = time.perf_counter()
+    async with database.connection():
+        metrics.DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+        # LIKE 與相似度查詢都由 gin_trgm_ops 索引提供，不會整表掃描
+        with metrics.SEARCH_QUERY_SECONDS.labels(platform).time():
+            rows = await database.fetch_all(
+                page_stmt(platform, after), values=values
+            )
+
+    with metrics.SEARCH_STAGE_SECONDS.labels("to_dict").time():
+        return [
+            {
+                "platform": platform,
+                "id": row["id"],
+                "name": row["name"],
+                "price": float(row["price"]),
+                "url": row["url"],
+            } for row in rows
+        ]
+
+
+def page_values(
+    product_name: str, after: Optional[tuple], limit: int
+) -> dict:
     values = {
         "product_name_pattern":
-            "%{}%".format("%".join(product_name.strip().split(" ")))
+            "%{}%".format("%".join(product_name.strip().split(" "))),
+        "product_name": product_name.strip(),
+        "limit": limit,
     }
+    if after is not None:
+        values["price"], values["neg_id"], values["platform"] = after
+    return values
 
-    shopee_result, momo_result = await asyncio.gather(
-        database.fetch_all(shopee_stmt, values=values),
-        database.fetch_all(momo_stmt, values=values)
-    )
 
-    shopee_products = [
-        {
-            "platform":
-                "shopee",
-            "id":
-                row["id"],
-            "name":
-                row["name"],
-            "price":
-                row["price"],
-            "url":
-                shopee_url_template.format(
-                    row["name"], row["shopid"], row["itemid"]
-                ),
-        } for row in shopee_result
-    ]
-
-    momo_products = [
-        {
-            "platform": "momo",
-            "id": row["id"],
-            "name": row["product_name"],
-            "price": row["product_price_parsed"],
-            "url": momo_url_template.format(row["product_url_path"]),
-        } for row in momo_result
-    ]
-
-    mix = shopee_products + momo_products
-    mix.sort(key=lambda x: x["id"], reverse=True)  # let the latest one be first
-    mix.sort(key=lambda x: x["price"], reverse=False)
-
-    return deduplicate_keep_first(mix)
+async def search_product_in_db(
+    product_name: str, after: Optional[tuple], limit: int
+) -> list:
+    values = page_values(product_name, after, limit)
+
+    # 兩個平台同時查詢，各自已依排序鍵排好，合併時只看前 limit 筆
+    pages = await asyncio.gather(
+        *[
+            search_platform_page(platform, values, after)
+            for platform in search_index.PLATFORMS
+        ]
+    )
+    with metrics.SEARCH_STAGE_SECONDS.labels("merge").time():
+        return list(
+            itertools.islice(heapq.merge(*pages, key=sort_key), limit)
+        )
@@ -0,0 +1,106 @@
+import time
+
+import prometheus_client
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.routing import Match
+
+# 搜尋內部各段多在 1ms 以下，預設的 bucket 從 5ms 開始太粗
+FAST_BUCKETS = (
+    0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+    0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+)
+SIZE_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+REQUEST_SECONDS = prometheus_client.Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route", "status"],
+)
+SEARCH_QUERY_SECONDS = prometheus_client.Histogram(
+    "search_query_duration_seconds",
+    "Per-platform search page query time",
+    ["platform"],
+    buckets=FAST_BUCKETS,
+)
+SEARCH_STAGE_SECONDS = prometheus_client.Histogram(
+    "search_stage_duration_seconds",
+    "Time spent in each in-process stage of /product/",
+    ["stage"],
+    buckets=FAST_BUCKETS,
+)
+DB_POOL_WAIT_SECONDS = prometheus_client.Histogram(
+    "db_pool_wait_seconds",
+    "Time waiting for a connection from the databases pool",
+    buckets=FAST_BUCKETS,
+)
+SEARCH_RESULT_ROWS = prometheus_client.Histogram(
+    "search_result_rows",
+    "Items per page by platform, and in total (all)",
+    ["platform"],
+    buckets=SIZE_BUCKETS,
+)
+
+
+def route_path(scope) -> str:
+    # 以路由的 path 作為 label (例如 /product/)，不同的參數不會產生新的序列
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+# 記錄每個 HTTP 請求的延遲，以純 ASGI middleware 實作，每個請求只多一次
+# histogram observe
+class MetricsMiddleware:
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.labels(
+                scope["method"], route_path(scope), str(status)
+            ).observe(time.perf_counter() - start)
+
+
+# 在 /metrics 讀取時才從 SearchCache 取出計數，請求路徑上沒有額外成本
+class SearchCacheCollector:
+    def __init__(self, cache) -> None:
+        self.cache = cache
+
+    def collect(self):
+        stats = self.cache.metrics()
+        for name in ["hits", "misses", "coalesced"]:
+            yield CounterMetricFamily(
+                f"search_cache_{name}",
+                f"/product/ result cache {name}",
+                value=stats[name],
+            )
+        yield GaugeMetricFamily(
+            "search_cache_entries",
+            "/product/ result cache entries",
+            value=stats["entries"],
+        )
+
+
+def render() -> tuple:
+    # 回傳 (body, content type)
+    return (
+        prometheus_client.generate_latest(),
+        prometheus_client.CONTENT_TYPE_LATEST
+    )
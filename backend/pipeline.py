@@ -0,0 +1,76 @@
+import typing
+import asyncio
+
+from crawlers.stream import DONE, Marker, iterate_queue, put_done_nowait
+
+# 一個 stage: (處理一個 batch 的函式, 是否在 thread pool 中執行)
+# 函式回傳 None 時該 batch 不再往下傳。Marker 不經過 stage 函式，
+# 依原本的順序傳到最後交給 on_marker
+Stage = typing.Tuple[typing.Callable[[typing.Any], typing.Any], bool]
+
+
+async def gather_or_cancel(*aws):
+    # 任一個失敗就取消其他的，避免上游卡在已滿的 queue 上
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _feed(source: typing.AsyncIterable, outbox: asyncio.Queue):
+    try:
+        async for batch in source:
+            await outbox.put(batch)
+    except BaseException:
+        put_done_nowait(outbox)
+        raise
+    await outbox.put(DONE)
+
+
+async def _run_stage(
+    stage: Stage, inbox: asyncio.Queue, outbox, on_marker=None
+):
+    func, in_thread = stage
+    loop = asyncio.get_running_loop()
+    try:
+        async for batch in iterate_queue(inbox):
+            if isinstance(batch, Marker):
+                if outbox is not None:
+                    await outbox.put(batch)
+                elif on_marker is not None:
+                    on_marker(batch)
+                continue
+
+            if in_thread:
+                result = await loop.run_in_executor(None, func, batch)
+            else:
+                result = func(batch)
+            if outbox is not None and result is not None:
+                await outbox.put(result)
+    except BaseException:
+        if outbox is not None:
+            put_done_nowait(outbox)
+        raise
+    if outbox is not None:
+        await outbox.put(DONE)
+
+
+async def run(
+    source: typing.AsyncIterable,
+    stages: typing.List[Stage],
+    maxsize: int = 8,
+    on_marker: typing.Callable[[Marker], typing.Any] = None,
+):
+    # source -> stage 1 -> stage 2 ...，每兩個相鄰 stage 之間是有上限的 queue，
+    # 下游處理不及時上游會停下來等待 (backpressure)
+    queues = [asyncio.Queue(maxsize) for _ in stages]
+    outboxes = queues[1:] + [None]
+    await gather_or_cancel(
+        _feed(source, queues[0]), *[
+            _run_stage(stage, inbox, outbox, on_marker)
+            for stage, inbox, outbox in zip(stages, queues, outboxes)
+        ]
+    )
@@ -1,147 +1,662 @@
 import os
+import argparse
 import asyncio
+import threading
+import collections
+import typing
+import concurrent.futures
 import sqlalchemy as sa
 import datetime
+import pandas as pd
+import aiohttp
 from sqlalchemy.orm import sessionmaker
 
 import db_model
 import crawlers
+import writer
+import pipeline
+import incremental
+import checkpoint
+import workqueue
+import scheduler
+import search_cache
+import crawl_report
 from settings import settings
 
 engine = sa.create_engine(settings.DB_URI)
 Session = sessionmaker(bind=engine)
-db_model.Base.metadata.create_all(engine)
+db_model.create_all(engine)
+bulk_writer = writer.BulkWriter(engine)
+# 兩個平台共用同一個快取目錄與大小上限
+response_cache = crawlers.cache.ResponseCache(
+    settings.HTTP_CACHE_DIR,
+    ttl=settings.HTTP_CACHE_TTL_SECONDS,
+    max_bytes=settings.HTTP_CACHE_MAX_MB * 1024 * 1024,
+    replay=settings.HTTP_CACHE_REPLAY,
+) if settings.HTTP_CACHE_DIR else None
 
 
 class ShopeeRunner:
+    def __init__(self, checkpoint: checkpoint.Checkpoint = None):
+        self.checkpoint = checkpoint
+        # 三個 Shopee 爬蟲共用同一個並行數 window
+        self.limiter = crawlers.ratelimit.AIMDLimiter(
+            initial_window=settings.SHOPEE_INITIAL_CONCURRENCY,
+            max_window=settings.SHOPEE_MAX_CONCURRENCY,
+        )
+        self.timer = crawlers.stats.StageTimer()
+        self.fetcher = crawlers.fetch.Fetcher(
+            limiter=self.limiter, cache=response_cache, timer=self.timer
+        )
+        self.failures = []
+        # 成功寫入的 (kind, key)，例如 ("shopee_shop", "123")；排程模式只記錄
+        # 這些對象的爬取時間
+        self.completed = set()
+        self.product_filter = writer.ChangeFilter(
+            engine, db_model.shopee.ShopeeProductCurrent, ["shopid", "itemid"],
+            [
+                "name", "currency", "stock", "price", "price_min", "price_max",
+                "price_min_before_discount", "price_max_before_discount"
+            ]
+        )
+        self.product_model_filter = writer.ChangeFilter(
+            engine, db_model.shopee.ShopeeProductModelCurrent,
+            ["itemid", "modelid"], ["name", "price"]
+        )
+        self.model_crawl_filter = incremental.ModelCrawlFilter(
+            engine, refresh_days=settings.SHOPEE_MODEL_REFRESH_DAYS
+        )
+        # 同時爬多個商店或工作佇列模式下，同時只有一個 thread 寫入
+        self.write_lock = threading.RLock()
+
+    def reset(self):
+        # 排程模式每一輪開始時呼叫，failures 與 completed 只保留這一輪的
+        self.failures.clear()
+        self.completed.clear()
+
+    def report(self):
+        print("shopee_product", dict(self.product_filter.counts))
+        print("shopee_product_model", dict(self.product_model_filter.counts))
+        if settings.SHOPEE_MODEL_CRAWL == "incremental":
+            print(
+                "shopee_model_crawl", dict(self.model_crawl_filter.counts),
+                "saved item/get calls:", self.model_crawl_filter.saved()
+            )
+        print("shopee_concurrency", self.limiter.metrics())
+        print("shopee_fetch", self.fetcher.metrics())
+        print("shopee_stages", self.timer.metrics())
+        print("shopee_failed_tasks", len(self.failures))
+
+    def stats(self) -> dict:
+        # 寫入 crawl_run.stats 的內容
+        fetch = self.fetcher.metrics()
+        return {
+            "stages": self.timer.metrics(),
+            "requests": fetch["requests"],
+            "retries": fetch["retries"],
+            "failed_requests": fetch["failed_requests"],
+            "bytes": fetch["bytes"],
+            "rows": {
+                "shopee_product": dict(self.product_filter.counts),
+                "shopee_product_model": dict(self.product_model_filter.counts),
+            },
+            "failed_tasks": len(self.failures),
+        }
+
     # TODO: shop_username only for POC, need to be removed in production.
     async def __call__(self, shop_username):
+        shop_df = await self.resolve_shops([shop_username])
+        await self.crawl_shop(shop_username, shop_df)
 
-        shop_df = await self.crawl_shop_to_db()
+    async def crawl_shops(self, shop_usernames, concurrency=4):
+        # 商店只解析一次，之後多個商店同時爬 (共用 fetcher 的並行數控制)
+        shop_df = await self.resolve_shops(shop_usernames)
+        semaphore = asyncio.Semaphore(concurrency)
 
-        cond = shop_df["username"] == shop_username
-        shop_products_df = await self.crawl_product_to_db(shop_df[cond])
-        assert len(shop_products_df) > 0
+        async def crawl(shop_username):
+            async with semaphore:
+                await self.crawl_shop(
+                    shop_username, shop_df[shop_df["username"] == shop_username]
+                )
+
+        await crawlers.fetch.gather_isolated(
+            [crawl(shop_username) for shop_username in shop_usernames],
+            self.failures
+        )
+
+    async def crawl_shop(self, shop_username, shop_df):
+        if self.checkpoint and self.checkpoint.is_done(
+            "shopee_shop", shop_username
+        ):
+            print("skip finished shop", shop_username)
+            return
+
+        crawled_items, failed = await self.crawl_product_to_db(shop_df)
+        # 接續執行時已完成的頁面重新下載失敗也不會產出商品
+        assert crawled_items > 0 or self.has_done_pages(shop_df), shop_username
 
-        product_models_df = await self.crawl_product_model_to_db(
-            shop_products_df
+        # 有頁面或商品失敗時不記錄，接續執行時會補抓缺少的部分
+        if failed == 0:
+            for shopid in shop_df["shopid"]:
+                self.completed.add(("shopee_shop", str(shopid)))
+            if self.checkpoint:
+                self.checkpoint.mark("shopee_shop", shop_username)
+
+    def mark_checkpoint(self, marker: crawlers.stream.Marker):
+        # 前面的 batch 都寫入後才會收到 marker
+        if marker.kind == "response":
+            self.fetcher.confirm(marker.key)
+            return
+        self.completed.add((marker.kind, str(marker.key)))
+        if self.checkpoint is not None:
+            self.checkpoint.mark(marker.kind, marker.key)
+
+    def has_done_pages(self, shop_df) -> bool:
+        if self.checkpoint is None:
+            return False
+        shopids = {str(shopid) for shopid in shop_df["shopid"]}
+        return any(
+            page.split(":")[0] in shopids
+            for page in self.checkpoint.done("shopee_page")
         )
 
-    async def crawl_shop_to_db(self):
-        shop_df = await crawlers.shopee.AioShopCrawler()()
+    def shop_fresh_since(self):
+        return datetime.datetime.now() - datetime.timedelta(
+            hours=settings.SHOPEE_SHOP_DIRECTORY_TTL_HOURS
+        )
+
+    def shop_directory_is_fresh(self) -> bool:
+        with Session() as db:
+            last_updated_at = db.query(
+                sa.func.max(db_model.shopee.ShopeeShop.updated_at)
+            ).scalar()
+        if last_updated_at is None:
+            return False
+        return last_updated_at >= self.shop_fresh_since()
 
+    def load_shops(self, usernames=None, fresh_only=False) -> pd.DataFrame:
+        ShopeeShop = db_model.shopee.ShopeeShop
+        with Session() as db:
+            query = db.query(
+                ShopeeShop.username, ShopeeShop.shopid, ShopeeShop.brand_name
+            )
+            if usernames is not None:
+                query = query.filter(ShopeeShop.username.in_(usernames))
+            if fresh_only:
+                query = query.filter(
+                    ShopeeShop.updated_at >= self.shop_fresh_since()
+                )
+            rows = query.all()
+        return pd.DataFrame(rows, columns=["username", "shopid", "brand_name"])
+
+    async def resolve_shops(self, usernames) -> pd.DataFrame:
+        if settings.SHOPEE_SHOP_RESOLVE == "directory":
+            await self.crawl_shop_to_db()
+
+        shop_df = self.load_shops(usernames, fresh_only=True)
+
+        # 快取中沒有或已過期的 username 才個別查詢
+        missing = sorted(set(usernames) - set(shop_df["username"]))
+        if missing:
+            resolver = crawlers.shopee.AioShopResolver(
+                self.fetcher, base_url=settings.SHOPEE_BASE_URL
+            )
+            self.save_shops(await resolver(missing))
+            self.failures.extend(resolver.failures)
+            shop_df = self.load_shops(usernames, fresh_only=True)
+
+        return shop_df
+
+    async def crawl_shop_to_db(self, force=False):
+        if not force and self.shop_directory_is_fresh():
+            return self.load_shops()
+
+        crawler = crawlers.shopee.AioShopCrawler(
+            self.fetcher, base_url=settings.SHOPEE_BASE_URL
+        )
+        shop_df = await crawler()
+        self.failures.extend(crawler.failures)
+
+        self.save_shops(shop_df)
+        return shop_df
+
+    def save_shops(self, shop_df):
         shops = shop_df.to_dict(orient="records")
+        if not shops:
+            return
 
+        ShopeeShop = db_model.shopee.ShopeeShop
         with Session() as db:
-            indb = db.query(
-                db_model.shopee.ShopeeShop.username,
-                db_model.shopee.ShopeeShop.shopid
-            ).all()
-            indb_dict = {(x.username, x.shopid): True for x in indb}
+            indb_dict = {
+                (x.username, x.shopid): x
+                for x in db.query(ShopeeShop).filter(
+                    ShopeeShop.username.in_({x["username"] for x in shops})
+                ).all()
+            }
 
+            seen_ids = []
             shop_objs = []
             for shop in shops:
-                if (shop["username"], shop["shopid"]) not in indb_dict:
-                    shop_obj = db_model.shopee.ShopeeShop()
-                    for k in shop:
-                        setattr(shop_obj, k, shop[k])
-                    shop_obj.shop_created_time = datetime.datetime.fromtimestamp(
-                        shop["ctime"]
+                shop_obj = indb_dict.get((shop["username"], shop["shopid"]))
+                if shop_obj is None:
+                    shop_obj = ShopeeShop(
+                        username=shop["username"],
+                        shopid=shop["shopid"],
+                        brand_name=shop.get("brand_name"),
+                        shop_created_time=datetime.datetime.fromtimestamp(
+                            shop["ctime"]
+                        ),
                     )
                     shop_objs.append(shop_obj)
+                    continue
+
+                seen_ids.append(shop_obj.id)
+                if shop.get("brand_name") != shop_obj.brand_name:
+                    shop_obj.brand_name = shop.get("brand_name")
 
             db.add_all(shop_objs)
+            # updated_at 作為商店快取的新鮮度
+            db.execute(
+                sa.update(ShopeeShop).where(
+                    ShopeeShop.id.in_(seen_ids)
+                ).values(updated_at=datetime.datetime.now())
+            )
             db.commit()
-        return shop_df
 
     async def crawl_product_to_db(self, shop_df):
-        shop_products_df = await crawlers.shopee.AioShopProductsCrawler()(
-            shopids=shop_df.shopid.to_list()
+        # 商品與規格都是邊抓邊寫: fetch -> normalize -> DB write，
+        # 抓到的商品同時送去抓規格，各 stage 之間以有上限的 queue 連接
+        markers = self.checkpoint is not None
+        product_crawler = crawlers.shopee.AioShopProductsCrawler(
+            self.fetcher,
+            concurrency=settings.SHOPEE_MAX_CONCURRENCY,
+            markers=markers,
+            done_pages=self.checkpoint.done("shopee_page") if markers else (),
+            base_url=settings.SHOPEE_BASE_URL,
+        )
+        model_crawler = crawlers.shopee.AioProductModelsCrawler(
+            self.fetcher,
+            concurrency=settings.SHOPEE_MAX_CONCURRENCY,
+            markers=markers,
+            base_url=settings.SHOPEE_BASE_URL,
         )
-        shop_products = shop_products_df.to_dict(orient="records")
+        done_items = self.checkpoint.done("shopee_item") if markers else ()
+        item_queue = asyncio.Queue(settings.PIPELINE_QUEUE_SIZE)
+        crawled_items = 0
 
-        with Session() as db:
-            product_objs = []
-            for shop_product in shop_products:
-                product_obj = db_model.shopee.ShopeeProduct()
-                for k in shop_product:
-                    if k.startswith("price") and shop_product[k] != -1:
-                        setattr(product_obj, k, shop_product[k] / 100000)
-                    else:
-                        setattr(product_obj, k, shop_product[k])
-                product_obj.item_created_time = datetime.datetime.fromtimestamp(
-                    shop_product["ctime"]
-                )
-                product_objs.append(product_obj)
+        incremental_models = settings.SHOPEE_MODEL_CRAWL == "incremental"
+        if incremental_models:
+            # 在寫入這次的商品之前載入上次的列表資料
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.model_crawl_filter.ensure_loaded
+            )
 
-            db.add_all(product_objs)
-            db.commit()
+        async def products():
+            nonlocal crawled_items
+            seen = set()
+            try:
+                async for items in product_crawler.stream(
+                    shop_df.shopid.to_list()
+                ):
+                    if isinstance(items, crawlers.stream.Marker):
+                        yield items
+                        continue
+                    # 列表頁與上次快取的相同或已經寫入時不寫入，只判斷是否抓規格
+                    unchanged = isinstance(items, crawlers.fetch.Unchanged)
+                    # 中斷前已寫入的頁面: 列表資料已是這次的，無法判斷是否有變動，
+                    # 還沒完成的商品都重抓規格
+                    resumed = isinstance(items, crawlers.shopee.WrittenPage)
+                    if unchanged:
+                        items = items.body
 
-        return shop_products_df
+                    crawled_items += len(items)
+                    for item in items:
+                        item_shop = (item["itemid"], item["shopid"])
+                        if item_shop in seen:
+                            continue
+                        seen.add(item_shop)
+                        if str(item["itemid"]) in done_items:
+                            continue
+                        if incremental_models and not (
+                            resumed or self.model_crawl_filter(item)
+                        ):
+                            continue
+                        await item_queue.put(item_shop)
+                    if not unchanged:
+                        yield items
+            finally:
+                await item_queue.put(crawlers.stream.DONE)
 
-    async def crawl_product_model_to_db(self, shop_products_df):
-        product_models_df = await crawlers.shopee.AioProductModelsCrawler()(
-            item_shop_list=list(
-                zip(
-                    shop_products_df["itemid"].to_list(),
-                    shop_products_df["shopid"].to_list()
-                )
+        await pipeline.gather_or_cancel(
+            pipeline.run(
+                products(),
+                [(self.normalize_products, False), (self.write_products, True)],
+                maxsize=settings.PIPELINE_QUEUE_SIZE,
+                on_marker=self.mark_checkpoint,
+            ),
+            pipeline.run(
+                model_crawler.stream(
+                    crawlers.stream.iterate_queue(item_queue)
+                ),
+                [
+                    (self.normalize_product_models, False),
+                    (self.write_product_models, True),
+                ],
+                maxsize=settings.PIPELINE_QUEUE_SIZE,
+                on_marker=self.mark_checkpoint,
+            ),
+        )
+        self.failures.extend(product_crawler.failures)
+        self.failures.extend(model_crawler.failures)
+
+        # 回傳 (列表中的商品數, 這個商店失敗的頁面與商品數)
+        return crawled_items, len(product_crawler.failures) + len(
+            model_crawler.failures
+        )
+
+    def normalize_products(self, items):
+        if len(items) == 0:
+            return None
+
+        with self.timer.span("normalize"):
+            df = pd.DataFrame(items)
+            for k in df.columns:
+                if k.startswith("price"):
+                    df[k] = df[k].where(df[k] == -1, df[k] / 100000)
+            df["item_created_time"] = df["ctime"].map(
+                datetime.datetime.fromtimestamp
+            )
+            df["crawled_at"] = datetime.datetime.now()
+        return df
+
+    def write_products(self, df):
+        with self.write_lock, self.timer.span("persist"):
+            bulk_writer.write(
+                db_model.shopee.ShopeeProduct,
+                self.product_filter(df),
+                current_model=db_model.shopee.ShopeeProductCurrent,
+                keys=["shopid", "itemid"],
+                on_commit=self.product_filter.commit,
+            )
+        self.model_crawl_filter.remember_listings(df)
+
+    def normalize_product_models(self, models):
+        if len(models) == 0:
+            return None
+
+        with self.timer.span("normalize"):
+            df = pd.DataFrame(models)
+            df["price"] = df["price"] / 100000
+            df["crawled_at"] = datetime.datetime.now()
+        return df
+
+    def write_product_models(self, df):
+        with self.write_lock, self.timer.span("persist"):
+            bulk_writer.write(
+                db_model.shopee.ShopeeProductModel,
+                self.product_model_filter(df),
+                current_model=db_model.shopee.ShopeeProductModelCurrent,
+                keys=["itemid", "modelid"],
+                on_commit=self.product_model_filter.commit,
             )
+        self.model_crawl_filter.remember_models(df["itemid"].unique())
+
+    async def crawl_models_to_db(self, item_shops):
+        # 只重抓指定商品的規格 (排程模式)，寫入後的商品記在 completed
+        model_crawler = crawlers.shopee.AioProductModelsCrawler(
+            self.fetcher,
+            concurrency=settings.SHOPEE_MAX_CONCURRENCY,
+            markers=True,
+            base_url=settings.SHOPEE_BASE_URL,
+        )
+        await pipeline.run(
+            model_crawler.stream(item_shops),
+            [
+                (self.normalize_product_models, False),
+                (self.write_product_models, True),
+            ],
+            maxsize=settings.PIPELINE_QUEUE_SIZE,
+            on_marker=self.mark_checkpoint,
         )
+        self.failures.extend(model_crawler.failures)
 
-        product_models = product_models_df.to_dict(orient="records")
+    # 工作佇列模式: 一個工作是一頁商品，或一批商品的規格
+    def task_handlers(self, session) -> dict:
+        return {
+            "shopee_shop_page":
+                lambda payload: self.handle_shop_page(session, payload),
+            "shopee_item_batch":
+                lambda payload: self.handle_item_batch(session, payload),
+        }
 
-        with Session() as db:
-            product_model_objs = []
-            for product_model in product_models:
-                product_model_obj = db_model.shopee.ShopeeProductModel()
-                for k in product_model:
-                    if k == "price":
-                        setattr(product_model_obj, k, product_model[k] / 100000)
-                    else:
-                        setattr(product_model_obj, k, product_model[k])
-
-                product_model_obj.crawled_at = datetime.datetime.now()
-                product_model_objs.append(product_model_obj)
-
-            db.add_all(product_model_objs)
-            db.commit()
+    def shop_page_tasks(self, shop_df, limit=30) -> list:
+        return [
+            (
+                "shopee_shop_page", {
+                    "shopid": int(shopid),
+                    "limit": limit,
+                    "offset": 0
+                }
+            ) for shopid in shop_df["shopid"]
+        ]
+
+    async def handle_shop_page(self, session, payload):
+        shopid = payload["shopid"]
+        limit = payload["limit"]
+        offset = payload["offset"]
+        crawler = crawlers.shopee.AioShopProductsCrawler(
+            self.fetcher, base_url=settings.SHOPEE_BASE_URL
+        )
+        section = await crawler.get_shop_product_page(
+            session, shopid, limit, offset
+        )
+
+        tasks = []
+        if offset == 0:
+            # 第一頁才知道商品總數，其餘頁面放回佇列給其他 worker
+            tasks += [
+                ("shopee_shop_page", {
+                    **payload, "offset": n
+                }) for n in range(limit, section["total"], limit)
+            ]
+        if section["data"]["item"] is None:
+            return tasks
+
+        items = crawlers.shopee.extract_item_fields(section["data"]["item"])
+        item_shops = await asyncio.get_running_loop().run_in_executor(
+            None, self.write_item_page, items
+        )
+        batch_size = settings.WORK_QUEUE_ITEM_BATCH
+        for start in range(0, len(item_shops), batch_size):
+            tasks.append(
+                (
+                    "shopee_item_batch", {
+                        "items": item_shops[start:start + batch_size]
+                    }
+                )
+            )
+        return tasks
+
+    def write_item_page(self, items) -> list:
+        with self.write_lock:
+            if settings.SHOPEE_MODEL_CRAWL == "incremental":
+                # 以寫入前的狀態判斷，其他 worker 之前寫入的也要重新載入
+                self.model_crawl_filter.load(items)
+                items_to_crawl = [
+                    item for item in items if self.model_crawl_filter(item)
+                ]
+            else:
+                items_to_crawl = items
+
+            df = self.normalize_products(items)
+            if df is not None:
+                self.write_products(df)
+        return [[item["itemid"], item["shopid"]] for item in items_to_crawl]
+
+    async def handle_item_batch(self, session, payload):
+        crawler = crawlers.shopee.AioProductModelsCrawler(
+            self.fetcher, base_url=settings.SHOPEE_BASE_URL
+        )
+        models = []
+        response_keys = []
+
+        async def get_models(itemid, shopid):
+            async for batch in crawler.get_item_info(session, itemid, shopid):
+                if isinstance(batch, crawlers.stream.Marker):
+                    response_keys.append(batch.key)
+                else:
+                    models.extend(batch)
 
-        return product_models_df
+        await crawlers.fetch.gather_isolated(
+            [get_models(*item_shop) for item_shop in payload["items"]],
+            self.failures
+        )
+        df = self.normalize_product_models(models)
+        if df is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.write_product_models, df
+            )
+        for key in response_keys:
+            self.fetcher.confirm(key)
+        return []
 
 
 class MomoRunner:
-    def crawl_brand_to_db(self):
-        brands_df = crawlers.momo.MomoCrawler().collect_brands()
+    def __init__(self, checkpoint: checkpoint.Checkpoint = None):
+        self.checkpoint = checkpoint
+        self.timer = crawlers.stats.StageTimer()
+        self.fetcher = crawlers.fetch.Fetcher(
+            limiter=crawlers.ratelimit.RateLimiter(
+                rate=settings.MOMO_RATE_LIMIT,
+                per_host_rate=settings.MOMO_HOST_RATE_LIMIT,
+                burst=settings.MOMO_BURST,
+                max_concurrency=settings.MOMO_MAX_CONCURRENCY,
+                jitter=settings.MOMO_JITTER_SECONDS,
+            ),
+            cache=response_cache,
+            timer=self.timer,
+        )
+        self.failures = []
+        # 成功寫入的 (kind, key)，例如 ("shopee_shop", "123")；排程模式只記錄
+        # 這些對象的爬取時間
+        self.completed = set()
+        self.product_filter = writer.ChangeFilter(
+            engine, db_model.momo.MomoProductCurrent, ["product_url_path"], [
+                "product_event", "product_name", "product_price",
+                "product_price_text"
+            ]
+        )
+        self.write_lock = threading.RLock()
+
+    def reset(self):
+        # 排程模式每一輪開始時呼叫，failures 與 completed 只保留這一輪的
+        self.failures.clear()
+        self.completed.clear()
 
-        brands = brands_df.to_dict(orient="records")
+    def report(self):
+        print("momo_product", dict(self.product_filter.counts))
+        print("momo_fetch", self.fetcher.metrics())
+        print("momo_stages", self.timer.metrics())
+        print("momo_failed_tasks", len(self.failures))
 
+    def stats(self) -> dict:
+        fetch = self.fetcher.metrics()
+        return {
+            "stages": self.timer.metrics(),
+            "requests": fetch["requests"],
+            "retries": fetch["retries"],
+            "failed_requests": fetch["failed_requests"],
+            "bytes": fetch["bytes"],
+            "rows": {
+                "momo_product": dict(self.product_filter.counts)
+            },
+            "failed_tasks": len(self.failures),
+        }
+
+    def brand_directory_is_fresh(self) -> bool:
         with Session() as db:
-            indb = db.query(
-                db_model.momo.MomoBrand.parent_category_code,
-                db_model.momo.MomoBrand.parent_category_id
-            ).all()
+            last_updated_at = db.query(
+                sa.func.max(db_model.momo.MomoBrand.updated_at)
+            ).scalar()
+
+        if last_updated_at is None:
+            return False
+        ttl = datetime.timedelta(hours=settings.MOMO_BRAND_DIRECTORY_TTL_HOURS)
+        return datetime.datetime.now() - last_updated_at < ttl
+
+    def collect_brands(self) -> pd.DataFrame:
+        if settings.MOMO_CRAWLER == "async":
+            crawler = crawlers.momo.AioMomoBrandCrawler(
+                self.fetcher, base_url=settings.MOMO_BASE_URL
+            )
+            brands_df = asyncio.run(crawler())
+            self.failures.extend(crawler.failures)
+            return brands_df
+        return crawlers.momo.MomoCrawler(
+            self.fetcher, base_url=settings.MOMO_BASE_URL
+        ).collect_brands()
+
+    def crawl_brand_to_db(self, force=False):
+        if not force and self.brand_directory_is_fresh():
+            print("momo brand directory is fresh, skip crawling")
+            return
 
+        brands = self.collect_brands().to_dict(orient="records")
+        if not brands:
+            # 爬取失敗時保留舊的目錄與更新時間，下次再重試
+            print("momo brand directory crawl returned no brands")
+            return
+
+        key_fields = [
+            "parent_category_code", "parent_category_id", "child_category_code"
+        ]
+        value_fields = [
+            "parent_category_name", "category_title", "child_category_name"
+        ]
+
+        with Session() as db:
             indb_dict = {
-                (x.parent_category_code, x.parent_category_id): True
-                for x in indb
+                tuple(str(getattr(x, k)) for k in key_fields): x
+                for x in db.query(db_model.momo.MomoBrand).all()
             }
 
+            seen_ids = []
             brand_objs = []
+            updated = 0
             for brand in brands:
-                if (
-                    brand["parent_category_code"], brand["parent_category_id"]
-                ) not in indb_dict:
+                # parent_category_id 在 API 回應中可能是數字，DB 中是字串
+                brand_obj = indb_dict.get(
+                    tuple(str(brand[k]) for k in key_fields)
+                )
+                if brand_obj is None:
                     brand_obj = db_model.momo.MomoBrand()
                     for k in brand:
                         setattr(brand_obj, k, brand[k])
                     brand_objs.append(brand_obj)
+                    continue
+
+                seen_ids.append(brand_obj.id)
+                if any(getattr(brand_obj, k) != brand[k] for k in value_fields):
+                    for k in value_fields:
+                        setattr(brand_obj, k, brand[k])
+                    updated += 1
 
             db.add_all(brand_objs)
+            # 沒有變動的品牌也要更新 updated_at，作為目錄的新鮮度
+            db.execute(
+                sa.update(db_model.momo.MomoBrand).where(
+                    db_model.momo.MomoBrand.id.in_(seen_ids)
+                ).values(updated_at=datetime.datetime.now())
+            )
             db.commit()
 
-    # TODO: brand_name only for POC, need to be removed in production.
-    def crawl_product_to_db(self, brand_name):
+        print(
+            f"momo brands: {len(brand_objs)} added, {updated} updated, "
+            f"{len(seen_ids) - updated} unchanged, "
+            f"{len(indb_dict) - len(seen_ids)} missing"
+        )
+
+    def load_brands(self, brand_name) -> typing.List[dict]:
         with Session() as db:
             if brand_name:
                 brand_objs = db.query(db_model.momo.MomoBrand).filter(
@@ -150,49 +665,434 @@ class MomoRunner:
             else:
                 brand_objs = db.query(db_model.momo.MomoBrand).all()
 
-            for brand_obj in brand_objs:
-                brand_dict = {
+            return [
+                {
                     c.name: getattr(brand_obj, c.name)
                     for c in db_model.momo.MomoBrand.__table__.c
+                } for brand_obj in brand_objs
+            ]
+
+    # TODO: brand_name only for POC, need to be removed in production.
+    def crawl_product_to_db(self, brand_name):
+        brand_dicts = self.pending_brands(self.load_brands(brand_name))
+
+        if settings.MOMO_CRAWLER == "async":
+            asyncio.run(self.stream_products_to_db(brand_dicts))
+        else:
+            self.collect_products_to_db(brand_dicts)
+
+    async def crawl_products(self, brand_names):
+        # 供 orchestrate 使用: async 模式直接在目前的 event loop 上執行，
+        # sync 模式放到 thread pool 中，不會卡住同時在跑的其他平台
+        loop = asyncio.get_running_loop()
+        brand_dicts = []
+        for brand_name in brand_names:
+            brand_dicts += await loop.run_in_executor(
+                None, self.load_brands, brand_name
+            )
+        await self.crawl_brand_dicts(self.pending_brands(brand_dicts))
+
+    async def crawl_brand_dicts(self, brand_dicts):
+        if settings.MOMO_CRAWLER == "async":
+            await self.stream_products_to_db(brand_dicts)
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.collect_products_to_db, brand_dicts
+            )
+
+    def pending_brands(self, brand_dicts) -> typing.List[dict]:
+        if self.checkpoint is None:
+            return brand_dicts
+        done_brands = self.checkpoint.done("momo_brand")
+        return [
+            brand_dict for brand_dict in brand_dicts
+            if brand_dict["child_category_code"] not in done_brands
+        ]
+
+    async def stream_products_to_db(self, brand_dicts):
+        parse_executor = None
+        if settings.MOMO_PARSE_WORKERS > 0:
+            parse_executor = concurrent.futures.ProcessPoolExecutor(
+                settings.MOMO_PARSE_WORKERS
+            )
+
+        crawler = crawlers.momo.AioMomoBrandProductCrawler(
+            self.fetcher,
+            concurrency=settings.MOMO_MAX_CONCURRENCY,
+            parser_backend=settings.MOMO_PARSER,
+            parse_executor=parse_executor,
+            markers=True,
+            base_url=settings.MOMO_BASE_URL,
+        )
+        try:
+            await pipeline.run(
+                crawler.stream(brand_dicts),
+                [
+                    (self.normalize_products, False),
+                    (self.write_products, True),
+                ],
+                maxsize=settings.PIPELINE_QUEUE_SIZE,
+                on_marker=self.mark_checkpoint,
+            )
+        finally:
+            if parse_executor is not None:
+                parse_executor.shutdown()
+        self.failures.extend(crawler.failures)
+
+    def collect_products_to_db(self, brand_dicts):
+        for brand_dict in brand_dicts:
+            crawler = crawlers.momo.MomoCrawler(
+                self.fetcher,
+                parser_backend=settings.MOMO_PARSER,
+                base_url=settings.MOMO_BASE_URL,
+            )
+            try:
+                products_df = crawler.collect_brand_products(brand_dict)
+            except crawlers.fetch.FetchError as e:
+                # 單一品牌失敗不影響其他品牌
+                self.failures.append(e)
+                continue
+            if len(products_df) > 0:
+                self.write_products(self.normalize_products(products_df))
+            for key in crawler.response_keys:
+                self.fetcher.confirm(key)
+            code = brand_dict["child_category_code"]
+            self.completed.add(("momo_brand", code))
+            if self.checkpoint:
+                self.checkpoint.mark("momo_brand", code)
+
+    def mark_checkpoint(self, marker: crawlers.stream.Marker):
+        # 前面的 batch 都寫入後才會收到 marker
+        if marker.kind == "response":
+            self.fetcher.confirm(marker.key)
+            return
+        self.completed.add((marker.kind, str(marker.key)))
+        if self.checkpoint is not None:
+            self.checkpoint.mark(marker.kind, marker.key)
+
+    # 工作佇列模式: 一個工作是一個品牌的一頁商品
+    def task_handlers(self, session) -> dict:
+        return {
+            "momo_brand_page":
+                lambda payload: self.handle_brand_page(session, payload),
+        }
+
+    def brand_page_tasks(self, brand_dicts) -> list:
+        return [
+            (
+                "momo_brand_page", {
+                    "brand": {
+                        "child_category_code": brand["child_category_code"],
+                        "child_category_name": brand["child_category_name"],
+                    },
+                    "page": 1,
+                }
+            ) for brand in brand_dicts if brand["child_category_code"] != ""
+        ]
+
+    async def handle_brand_page(self, session, payload):
+        brand = payload["brand"]
+        n = payload["page"]
+        crawler = crawlers.momo.AioMomoBrandProductCrawler(
+            self.fetcher,
+            parser_backend=settings.MOMO_PARSER,
+            base_url=settings.MOMO_BASE_URL,
+        )
+        response, product_list = await crawler.crawl_page(session, brand, n)
+        if len(product_list) > 0:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.write_products,
+                self.normalize_products(product_list)
+            )
+
+        def page_task(m, probe):
+            return (
+                "momo_brand_page", {
+                    "brand": brand,
+                    "page": m,
+                    "page_size": page_size,
+                    "probe": probe,
                 }
+            )
+
+        # 逐頁確認時，遇到不滿一頁代表已經是最後一頁
+        if n > 1:
+            page_size = payload["page_size"]
+            if payload["probe"] and len(product_list) >= page_size:
+                return [page_task(n + 1, True)]
+            return []
+
+        if len(product_list) == 0:
+            return []
+        page_size = len(product_list)
+        page_count = crawlers.momo.parse_page_count(response, page_size)
+        if page_count is None:
+            return [page_task(2, True)]
+        # 已知總頁數: 其餘頁面同時放進佇列，最後一頁滿了才繼續逐頁確認
+        return [page_task(m, m == page_count) for m in range(2, page_count + 1)]
+
+    def normalize_products(self, products):
+        with self.timer.span("normalize"):
+            df = pd.DataFrame(products)
+            df["product_price_parsed"] = df["product_price"].map(
+                lambda x: int(x.replace(",", ""))
+            )
+            df["crawled_at"] = datetime.datetime.now()
+        return df
+
+    def write_products(self, df):
+        with self.write_lock, self.timer.span("persist"):
+            bulk_writer.write(
+                db_model.momo.MomoProduct,
+                self.product_filter(df),
+                current_model=db_model.momo.MomoProductCurrent,
+                keys=["product_url_path"],
+                on_commit=self.product_filter.commit,
+            )
+
+
+async def orchestrate(run: checkpoint.Checkpoint = None) -> dict:
+    # Momo 與 Shopee 在同一個 event loop 上同時爬，同步的部分放到 thread pool，
+    # 總時間接近較慢的平台，而不是兩個平台相加。回傳各平台的 stats
+    loop = asyncio.get_running_loop()
+    shopee_runner = ShopeeRunner(run)
+    momo_runner = MomoRunner(run)
+    wall_seconds = {}
+
+    async def timed(name, platform_runner, coro):
+        start = loop.time()
+        try:
+            await coro
+        except Exception as e:
+            # 整個平台失敗也記在 failures，這次執行不會被標記為完成
+            platform_runner.failures.append(e)
+            print("platform failed", repr(e))
+        finally:
+            wall_seconds[name] = round(loop.time() - start, 3)
+            print(name, "finished in", round(wall_seconds[name], 1), "s")
+
+    async def momo():
+        await loop.run_in_executor(None, momo_runner.crawl_brand_to_db)
+        await momo_runner.crawl_products(settings.CRAWL_MOMO_BRANDS)
+
+    await asyncio.gather(
+        timed("momo", momo_runner, momo()),
+        timed(
+            "shopee",
+            shopee_runner,
+            shopee_runner.crawl_shops(
+                settings.CRAWL_SHOPEE_SHOPS,
+                concurrency=settings.CRAWL_SHOP_CONCURRENCY,
+            ),
+        ),
+    )
+
+    shopee_runner.report()
+    momo_runner.report()
+    return {
+        name: {
+            "wall_seconds": wall_seconds.get(name),
+            **platform_runner.stats()
+        }
+        for name, platform_runner in [("shopee", shopee_runner),
+                                      ("momo", momo_runner)]
+    }
 
-                if len(brand_dict) == 1:
-                    print(brand_obj.id)
 
-                products_df = crawlers.momo.MomoCrawler(
-                ).collect_brand_products(brand_dict)
+def bump_data_version():
+    with engine.begin() as conn:
+        search_cache.bump_data_version(conn)
 
-                products = products_df.to_dict(orient="records")
 
-                for product in products:
-                    product_obj = db_model.momo.MomoProduct()
-                    for k in product:
-                        if k == "product_price":
-                            setattr(
-                                product_obj, "product_price_parsed",
-                                int(product[k].replace(",", ""))
-                            )
-                        setattr(product_obj, k, product[k])
+async def schedule():
+    # 排程模式: 每小時依變動頻率挑出要重爬的商店、品牌與商品，
+    # 預估請求數不超過 SCHEDULER_REQUESTS_PER_HOUR
+    loop = asyncio.get_running_loop()
+    crawl_scheduler = scheduler.CrawlScheduler(
+        engine,
+        requests_per_hour=settings.SCHEDULER_REQUESTS_PER_HOUR,
+        window_days=settings.SCHEDULER_WINDOW_DAYS,
+        min_interval_hours=settings.SCHEDULER_MIN_INTERVAL_HOURS,
+        max_interval_hours=settings.SCHEDULER_MAX_INTERVAL_HOURS,
+        model_crawl=settings.SHOPEE_MODEL_CRAWL,
+        model_refresh_days=settings.SHOPEE_MODEL_REFRESH_DAYS,
+    )
+    shopee_runner = ShopeeRunner()
+    momo_runner = MomoRunner()
+
+    def requests():
+        return shopee_runner.fetcher.metrics()["requests"] + \
+            momo_runner.fetcher.metrics()["requests"]
+
+    # 上一輪實際請求數超過預算的部分，從下一輪的預算中扣除
+    overspent = 0
+    while True:
+        started_at = loop.time()
+        requests_before = requests()
+        shopee_runner.reset()
+        momo_runner.reset()
 
-                    db.add(product_obj)
-                db.commit()
+        shop_df = await shopee_runner.resolve_shops(settings.CRAWL_SHOPEE_SHOPS)
+        await loop.run_in_executor(None, momo_runner.crawl_brand_to_db)
+        brand_dicts = {}
+        for brand_name in settings.CRAWL_MOMO_BRANDS:
+            for brand_dict in await loop.run_in_executor(
+                None, momo_runner.load_brands, brand_name
+            ):
+                brand_dicts[brand_dict["child_category_code"]] = brand_dict
+
+        entities = await loop.run_in_executor(
+            None, crawl_scheduler.entities,
+            [int(shopid) for shopid in shop_df["shopid"]], list(brand_dicts)
+        )
+        # 商店解析與品牌列表的請求已經用掉預算
+        budget = settings.SCHEDULER_REQUESTS_PER_HOUR - overspent - (
+            requests() - requests_before
+        )
+        planned = crawl_scheduler.plan(entities, budget=budget)
+        by_kind = collections.defaultdict(list)
+        for entity in planned:
+            by_kind[entity["kind"]].append(entity)
+        print(
+            "scheduled",
+            {kind: len(v) for kind, v in by_kind.items()},
+            "of",
+            len(entities),
+            "estimated requests:",
+            sum(entity["cost"] for entity in planned),
+        )
 
+        shopids = {entity["key"] for entity in by_kind["shopee_shop"]}
+        shop_usernames = [
+            username
+            for username, shopid in zip(shop_df["username"], shop_df["shopid"])
+            if str(shopid) in shopids
+        ]
+        brands = [
+            brand_dicts[entity["child_category_code"]]
+            for entity in by_kind["momo_brand"]
+        ]
+        item_shops = [
+            (entity["itemid"], entity["shopid"])
+            for entity in by_kind["shopee_item"]
+        ]
 
-async def async_crawl():
-    runner = ShopeeRunner()
-    await runner(shop_username="google.tw")
-    await runner(shop_username="microsoft_tw")
-    await runner(shop_username="3mofficial")
+        failures = []
+        await crawlers.fetch.gather_isolated(
+            [
+                shopee_runner.crawl_shops(
+                    shop_usernames, concurrency=settings.CRAWL_SHOP_CONCURRENCY
+                ),
+                momo_runner.crawl_brand_dicts(brands),
+                shopee_runner.crawl_models_to_db(item_shops),
+            ],
+            failures,
+        )
+        for e in failures:
+            print("scheduled crawl failed", repr(e))
+        completed = shopee_runner.completed | momo_runner.completed
+        crawled = [
+            entity for entity in planned
+            if (entity["kind"], entity["key"]) in completed
+        ]
+        await loop.run_in_executor(None, crawl_scheduler.record, crawled)
+        await loop.run_in_executor(None, bump_data_version)
 
+        used = requests() - requests_before
+        overspent = max(
+            0, overspent + used - settings.SCHEDULER_REQUESTS_PER_HOUR
+        )
+        print(
+            "actual requests:", used, "crawled:", len(crawled), "of",
+            len(planned), "failed tasks:",
+            len(shopee_runner.failures) + len(momo_runner.failures)
+        )
+        await asyncio.sleep(max(0, 3600 - (loop.time() - started_at)))
+
+
+def enqueue(run: checkpoint.Checkpoint):
+    # 工作佇列模式的起點: 放入每個商店的第一頁與每個品牌的第一頁
+    shopee_runner = ShopeeRunner()
+    shop_df = asyncio.run(
+        shopee_runner.resolve_shops(settings.CRAWL_SHOPEE_SHOPS)
+    )
 
-def crawl():
     momo_runner = MomoRunner()
     momo_runner.crawl_brand_to_db()
-    momo_runner.crawl_product_to_db(brand_name="Google")
-    momo_runner.crawl_product_to_db(brand_name="Microsoft微軟")
-    momo_runner.crawl_product_to_db(brand_name="3M")
+    brand_dicts = [
+        brand_dict for brand_name in settings.CRAWL_MOMO_BRANDS
+        for brand_dict in momo_runner.load_brands(brand_name)
+    ]
+
+    tasks = shopee_runner.shop_page_tasks(shop_df)
+    tasks += momo_runner.brand_page_tasks(brand_dicts)
+    workqueue.WorkQueue(engine).enqueue(run.run_id, tasks)
+    print("enqueued", len(tasks), "tasks to crawl_run", run.run_id)
+
+
+async def work():
+    queue = workqueue.WorkQueue(
+        engine,
+        lease_seconds=settings.WORK_QUEUE_LEASE_SECONDS,
+        max_attempts=settings.WORK_QUEUE_MAX_ATTEMPTS,
+    )
+    shopee_runner = ShopeeRunner()
+    momo_runner = MomoRunner()
+    async with aiohttp.ClientSession() as session:
+        await queue.work(
+            {
+                **shopee_runner.task_handlers(session),
+                **momo_runner.task_handlers(session),
+            },
+            concurrency=settings.WORK_QUEUE_CONCURRENCY,
+            idle_seconds=settings.WORK_QUEUE_IDLE_SECONDS,
+        )
+    shopee_runner.report()
+    momo_runner.report()
 
 
 if __name__ == "__main__":
-    crawl()
-    asyncio.run(async_crawl())
+    parser = argparse.ArgumentParser()
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument(
+        "--resume",
+        action="store_true",
+        help="接續上一次沒有完成的執行，跳過已完成的商店、頁面、品牌與商品"
+    )
+    mode.add_argument(
+        "--enqueue", action="store_true", help="把這次要爬的工作放進工作佇列"
+    )
+    mode.add_argument(
+        "--worker", action="store_true", help="從工作佇列領取工作，直到佇列清空"
+    )
+    mode.add_argument(
+        "--schedule",
+        action="store_true",
+        help="持續執行，每小時依價格變動頻率在請求預算內挑選要重爬的對象"
+    )
+    mode.add_argument(
+        "--report",
+        action="store_true",
+        help="比較最後一次執行與之前的執行，有效能退步時 exit code 為 1"
+    )
+    parser.add_argument("--runs", type=int, default=10, help="--report 比較的次數")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.report:
+        if crawl_report.report(engine, args.runs, args.threshold):
+            raise SystemExit(1)
+    elif args.worker:
+        asyncio.run(work())
+    elif args.schedule:
+        asyncio.run(schedule())
+    elif args.enqueue:
+        enqueue(checkpoint.Checkpoint.start(engine))
+    else:
+        run = checkpoint.Checkpoint.start(engine, resume=args.resume)
+        stats = asyncio.run(orchestrate(run))
+        # 有失敗的工作時不標記為完成，--resume 會接續這次執行補抓
+        run.finish(
+            stats,
+            completed=not any(s["failed_tasks"] for s in stats.values())
+        )
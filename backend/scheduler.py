@@ -0,0 +1,242 @@
+import math
+import datetime
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import db_model
+
+SHOPEE_PAGE_SIZE = 30
+MOMO_PAGE_SIZE = 40
+
+
+# 依照歷史資料中觀察到的價格變動頻率，決定每個小時要重爬哪些商店、品牌與商品
+#
+# 歷史表只在內容有變動時才新增一筆，因此時間窗內「筆數 - 商品數」即為變動次數。
+# 變動頻率 rate (次/小時) 加上先驗 (prior_hours 內變動一次)，避免從未變動過的
+# 對象永遠排不到。距離上次爬取 elapsed 小時後內容已變動的機率為
+# 1 - exp(-rate * elapsed)，以「變動機率 / 預估請求數」由高到低挑選，
+# 直到用完每小時的請求預算。超過 max_interval_hours 沒爬的對象優先處理。
+#
+# 商店的預估請求數包含列表頁與 item/get: model_crawl 為 "incremental" 時只計
+# 預估有變動與輪流重抓 (model_refresh_days) 的商品，否則每個商品都計。
+class CrawlScheduler:
+    def __init__(
+        self,
+        engine,
+        requests_per_hour: int,
+        window_days: int = 14,
+        prior_hours: float = 168,
+        min_interval_hours: float = 1,
+        max_interval_hours: float = 168,
+        model_crawl: str = "incremental",
+        model_refresh_days: int = 7,
+    ) -> None:
+        self.engine = engine
+        self.requests_per_hour = requests_per_hour
+        self.window = datetime.timedelta(days=window_days)
+        self.prior_hours = prior_hours
+        self.min_interval_hours = min_interval_hours
+        self.max_interval_hours = max_interval_hours
+        self.model_crawl = model_crawl
+        self.model_refresh_days = max(model_refresh_days, 1)
+
+    def _changes(self, conn, table, group_column, distinct_column, since):
+        rows = conn.execute(
+            sa.select(
+                table.c[group_column],
+                sa.func.count() -
+                sa.func.count(sa.distinct(table.c[distinct_column])),
+            ).where(table.c.crawled_at >= since).group_by(table.c[group_column])
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def _sizes(self, conn, table, group_column, keys):
+        rows = conn.execute(
+            sa.select(table.c[group_column], sa.func.count()).where(
+                table.c[group_column].in_(keys)
+            ).group_by(table.c[group_column])
+        )
+        return {row[0]: row[1] for row in rows}
+
+    def _last_crawled(self, conn):
+        table = db_model.crawl.CrawlSchedule.__table__
+        rows = conn.execute(
+            sa.select(table.c.kind, table.c.key, table.c.last_crawled_at)
+        )
+        return {(row[0], row[1]): row[2] for row in rows}
+
+    def rate(self, changes: int) -> float:
+        window_hours = self.window.total_seconds() / 3600
+        return (changes + 1) / (window_hours + self.prior_hours)
+
+    def item_gets(self, size: int, rate: float) -> int:
+        # 爬一次商店時 item/get 的預估次數: 約每 interval 小時爬一次，期間
+        # 列表變動 rate * interval 次，另有 interval / refresh 的商品輪到重抓
+        if self.model_crawl != "incremental":
+            return size
+        hours = self._interval(rate)
+        refresh_hours = 24 * self.model_refresh_days
+        return min(size, math.ceil(rate * hours + size * hours / refresh_hours))
+
+    def entities(
+        self, shopids: typing.List[int], brand_codes: typing.List[str]
+    ) -> typing.List[dict]:
+        shopee_product = db_model.shopee.ShopeeProduct.__table__
+        shopee_product_current = db_model.shopee.ShopeeProductCurrent.__table__
+        shopee_model = db_model.shopee.ShopeeProductModel.__table__
+        momo_product = db_model.momo.MomoProduct.__table__
+        momo_product_current = db_model.momo.MomoProductCurrent.__table__
+        since = datetime.datetime.now() - self.window
+
+        with self.engine.connect() as conn:
+            last_crawled = self._last_crawled(conn)
+            shop_changes = self._changes(
+                conn, shopee_product, "shopid", "itemid", since
+            )
+            shop_sizes = self._sizes(
+                conn, shopee_product_current, "shopid", shopids
+            )
+            brand_changes = self._changes(
+                conn, momo_product, "child_category_code", "product_url_path",
+                since
+            )
+            brand_sizes = self._sizes(
+                conn, momo_product_current, "child_category_code", brand_codes
+            )
+            # 規格價格變動過的商品才個別排程 item/get
+            item_changes = self._changes(
+                conn, shopee_model, "itemid", "modelid", since
+            )
+            hot_items = conn.execute(
+                sa.select(
+                    shopee_product_current.c.itemid,
+                    shopee_product_current.c.shopid
+                ).where(
+                    shopee_product_current.c.shopid.in_(shopids),
+                    shopee_product_current.c.itemid.in_(
+                        [itemid for itemid, n in item_changes.items() if n > 0]
+                    ),
+                )
+            ).all()
+
+        def entity(kind, key, changes, cost, **kwargs):
+            return {
+                "kind": kind,
+                "key": str(key),
+                "rate": self.rate(changes),
+                "cost": cost,
+                "last_crawled_at": last_crawled.get((kind, str(key))),
+                **kwargs
+            }
+
+        entities = []
+        for shopid in shopids:
+            size = shop_sizes.get(shopid, 0)
+            changes = shop_changes.get(shopid, 0)
+            pages = math.ceil(size / SHOPEE_PAGE_SIZE)
+            entities.append(
+                entity(
+                    "shopee_shop",
+                    shopid,
+                    changes,
+                    pages + 1 + self.item_gets(size, self.rate(changes)),
+                    shopid=shopid,
+                )
+            )
+        for code in brand_codes:
+            pages = math.ceil(brand_sizes.get(code, 0) / MOMO_PAGE_SIZE)
+            entities.append(
+                entity(
+                    "momo_brand",
+                    code,
+                    brand_changes.get(code, 0),
+                    pages + 1,
+                    child_category_code=code,
+                )
+            )
+        for itemid, shopid in hot_items:
+            entities.append(
+                entity(
+                    "shopee_item",
+                    itemid,
+                    item_changes[itemid],
+                    1,
+                    itemid=itemid,
+                    shopid=shopid,
+                )
+            )
+        return entities
+
+    def _interval(self, rate: float) -> float:
+        return min(
+            max(1 / rate, self.min_interval_hours), self.max_interval_hours
+        )
+
+    def interval_hours(self, entity: dict) -> float:
+        return self._interval(entity["rate"])
+
+    def priority(self, entity: dict, now: datetime.datetime) -> float:
+        if entity["last_crawled_at"] is None:
+            return math.inf
+        elapsed = (now - entity["last_crawled_at"]).total_seconds() / 3600
+        if elapsed < self.min_interval_hours:
+            return 0
+        if elapsed >= self.max_interval_hours:
+            return math.inf
+        return (1 - math.exp(-entity["rate"] * elapsed)) / entity["cost"]
+
+    def plan(
+        self,
+        entities: typing.List[dict],
+        now: datetime.datetime = None,
+        budget: int = None,
+    ) -> typing.List[dict]:
+        # budget 預設為 requests_per_hour，呼叫端可扣除已用掉的請求
+        now = now or datetime.datetime.now()
+        ranked = sorted(
+            ((self.priority(entity, now), entity) for entity in entities),
+            key=lambda x: x[0],
+            reverse=True,
+        )
+
+        if budget is None:
+            budget = self.requests_per_hour
+        planned = []
+        for priority, entity in ranked:
+            if priority <= 0:
+                break
+            if entity["cost"] > budget:
+                continue
+            budget -= entity["cost"]
+            planned.append(entity)
+        return planned
+
+    def record(self, entities: typing.List[dict], crawled_at=None):
+        # 只傳入這一輪成功爬完的對象，失敗的下一輪仍以原本的優先順序排程
+        if not entities:
+            return
+        crawled_at = crawled_at or datetime.datetime.now()
+        table = db_model.crawl.CrawlSchedule.__table__
+        stmt = postgresql.insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["kind", "key"],
+            set_={
+                n: stmt.excluded[n]
+                for n in ("rate", "cost", "interval_hours", "last_crawled_at")
+            }
+        )
+        with self.engine.begin() as conn:
+            conn.execute(
+                stmt, [
+                    {
+                        "kind": entity["kind"],
+                        "key": entity["key"],
+                        "rate": entity["rate"],
+                        "cost": entity["cost"],
+                        "interval_hours": self.interval_hours(entity),
+                        "last_crawled_at": crawled_at,
+                    } for entity in entities
+                ]
+            )
@@ -0,0 +1,124 @@
+import time
+import asyncio
+import collections
+import typing
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+import db_model
+
+
+def normalize(product_name: str) -> str:
+    # 只合併連續空白: 查詢以空白切詞，"a  b" 與 "a b" 結果相同；
+    # LIKE 區分大小寫，不轉小寫
+    return " ".join(term for term in product_name.strip().split(" ") if term)
+
+
+async def data_version(database) -> int:
+    row = await database.fetch_one(
+        "SELECT version FROM data_version WHERE id = 1"
+    )
+    return 0 if row is None else row["version"]
+
+
+def bump_data_version(conn):
+    # 爬取完成時呼叫，API 的快取在下一次檢查時清空
+    table = db_model.crawl.DataVersion.__table__
+    stmt = postgresql.insert(table).values(
+        id=1, version=1, updated_at=sa.func.now()
+    )
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["id"],
+            set_={
+                "version": table.c.version + 1,
+                "updated_at": sa.func.now(),
+            }
+        )
+    )
+
+
+# /product/ 的結果快取，key 為 normalize 後的 product_name 加上其他參數
+# (例如分頁的 cursor 與 limit)
+#
+# 超過 max_entries 筆時淘汰最久沒用到的，每筆 ttl 秒後過期；
+# set_version 收到新的資料版本時清空。同一個 key 同時有多個請求時只查一次，
+# 其他請求等待同一個結果 (single-flight)。
+class SearchCache:
+    def __init__(self, max_entries: int = 10000, ttl: float = 300) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = collections.OrderedDict()
+        self._inflight: typing.Dict[tuple, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_version(self, version: int):
+        if version != self.version:
+            self.version = version
+            self._entries.clear()
+
+    def _get(self, key: tuple):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: tuple, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _load(self, key: tuple, load, version):
+        value = await load(*key)
+        # 查詢途中資料版本變了，結果可能是舊的，不放進快取
+        if version == self.version:
+            self._put(key, value)
+        return value
+
+    async def get(
+        self, load: typing.Callable[..., typing.Awaitable], product_name: str,
+        *params
+    ):
+        # 以 load(normalize 後的 product_name, *params) 取得結果
+        key = (normalize(product_name), ) + params
+        entry = self._get(key)
+        if entry is not None:
+            self.hits += 1
+            return entry[1]
+
+        # 版本在請求時決定: 新版本的請求不等待舊版本的查詢
+        flight = (self.version, key)
+        task = self._inflight.get(flight)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, load, self.version))
+            self._inflight[flight] = task
+            task.add_done_callback(
+                lambda _: self._inflight.pop(flight, None)
+            )
+        else:
+            self.coalesced += 1
+        # 第一個請求被取消時，其他等待中的請求仍能拿到結果
+        return await asyncio.shield(task)
+
+    def metrics(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "version": self.version,
+        }
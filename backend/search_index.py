@@ -0,0 +1,303 @@
+import re
+import sys
+import array
+import datetime
+import heapq
+import typing
+
+# 英數字串視為一個 token，中日韓文字則切成 bigram
+CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+TOKEN_RE = re.compile(r"[0-9a-z]+|[{}]+".format(CJK))
+CJK_RE = re.compile(r"[{}]".format(CJK))
+# pg_trgm 的單字: 連續的英數字 (含中日韓文字)，不含底線
+WORD_RE = re.compile(r"[^\W_]+")
+# 與 pg_trgm.similarity_threshold 的預設值相同
+SIMILARITY_THRESHOLD = 0.3
+
+PLATFORMS = ["shopee", "momo"]
+
+shopee_url_template = "https://shopee.tw/{}-i.{}.{}"  # name, shopid, itemid
+momo_url_template = "https://m.momoshop.com.tw{}"  # product_url_path
+
+
+def tokenize(text: str) -> typing.Set[str]:
+    tokens = set()
+    for run in TOKEN_RE.findall(text.lower()):
+        if CJK_RE.match(run) and len(run) > 1:
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.add(run)
+    return tokens
+
+
+def index_keys(text: str) -> typing.Set[str]:
+    # posting list 的 key: 中日韓文字切成 bigram，英數字串切成 bigram 與
+    # trigram，只有一個字元的字串保留原字元
+    keys = set()
+    for run in TOKEN_RE.findall(text.lower()):
+        if len(run) == 1:
+            keys.add(run)
+            continue
+        keys.update(run[i:i + 2] for i in range(len(run) - 1))
+        if not CJK_RE.match(run):
+            keys.update(run[i:i + 3] for i in range(len(run) - 2))
+    return keys
+
+
+def trigrams(text: str) -> typing.Set[str]:
+    # 與 pg_trgm 相同: 每個單字轉小寫、前面補兩個空白、後面補一個空白後切成
+    # trigram
+    grams = set()
+    for word in WORD_RE.findall(text.lower()):
+        word = "  {} ".format(word)
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def similarity(a: typing.Set[str], b: typing.Set[str]) -> float:
+    # 與 pg_trgm 的 similarity() 相同: 兩邊 trigram 的交集 / 聯集
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def like_to_regex(pattern: str) -> typing.Pattern:
+    # 與 Postgres LIKE 相同的語意: % 任意長度、_ 任一字元、區分大小寫
+    parts = []
+    for char in pattern:
+        if char == "%":
+            parts.append(".*")
+        elif char == "_":
+            parts.append(".")
+        else:
+            parts.append(re.escape(char))
+    return re.compile("".join(parts), re.DOTALL)
+
+
+# 將 *_current 商品目錄載入記憶體的反向索引
+#
+# 每個商品佔一個 slot，欄位以 array 儲存；posting list 為 slot 編號的
+# array('I')，key 見 index_keys。查詢時先以 posting list 交集取得候選，再以
+# LIKE 語意逐筆驗證；某個平台沒有符合的商品時，與 SQL 查詢相同改以 trigram
+# 相似度取出相近的商品，結果與 SQL 查詢一致。
+#
+# 商品沒有價格或名稱時移除 (slot 的名稱設為 None，posting list 中的 slot
+# 查詢時略過)。
+class ProductSearchIndex:
+    def __init__(self) -> None:
+        self._slot_by_key = {}
+        self._platforms = array.array("b")
+        self._ids = array.array("q")
+        self._crawled_at = array.array("d")
+        self._prices = array.array("d")
+        self._names = []
+        self._urls = []
+        self._postings: typing.Dict[str, array.array] = {}
+        # 單一字元 -> 包含這個字元的 bigram key
+        self._bigrams_by_char: typing.Dict[str, typing.Set[str]] = {}
+        # 每個平台下一次要從哪個 transaction id (write_txid) 開始重讀
+        self.watermarks = {platform: 0 for platform in PLATFORMS}
+
+    def __len__(self) -> int:
+        return len(self._slot_by_key)
+
+    def add(
+        self, platform: str, id_: int, crawled_at: datetime.datetime,
+        name: str, price: float, url: str
+    ):
+        key = (platform, id_)
+        slot = self._slot_by_key.get(key)
+        if slot is not None and crawled_at.timestamp() < self._crawled_at[slot]:
+            return
+
+        if name is None or price is None:
+            # 不會出現在搜尋結果中，已載入的要移除
+            if slot is not None:
+                del self._slot_by_key[key]
+                self._names[slot] = None
+            return
+
+        name = sys.intern(name)
+
+        if slot is None:
+            slot = len(self._ids)
+            self._slot_by_key[key] = slot
+            self._platforms.append(PLATFORMS.index(platform))
+            self._ids.append(id_)
+            self._crawled_at.append(crawled_at.timestamp())
+            self._prices.append(price)
+            self._names.append(name)
+            self._urls.append(url)
+            new_keys = index_keys(name)
+        else:
+            old_name = self._names[slot]
+            self._crawled_at[slot] = crawled_at.timestamp()
+            self._prices[slot] = price
+            self._names[slot] = name
+            self._urls[slot] = url
+            # 名稱沒變就不需要更新 posting list
+            new_keys = set() if old_name == name else (
+                index_keys(name) - index_keys(old_name)
+            )
+
+        for index_key in new_keys:
+            postings = self._postings.get(index_key)
+            if postings is None:
+                index_key = sys.intern(index_key)
+                postings = self._postings[index_key] = array.array("I")
+                if len(index_key) == 2:
+                    for char in index_key:
+                        bigrams = self._bigrams_by_char.setdefault(char, set())
+                        bigrams.add(index_key)
+            postings.append(slot)
+
+    def _candidates(self, token: str) -> typing.Set[int]:
+        # token 為 tokenize 的結果: 英數字串、中文 bigram 或單一字元
+        if len(token) == 1:
+            # 名稱中只有這個字元的字串，或包含這個字元的 bigram
+            slots = set(self._postings.get(token, ()))
+            for bigram in self._bigrams_by_char.get(token, ()):
+                slots.update(self._postings[bigram])
+            return slots
+        if len(token) == 2:
+            return set(self._postings.get(token, ()))
+
+        # 較長的英數字串: 每個 trigram 都要出現，從最少的 posting list 開始
+        grams = sorted(
+            {token[i:i + 3]
+             for i in range(len(token) - 2)},
+            key=lambda gram: len(self._postings.get(gram, ()))
+        )
+        slots = set(self._postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            if not slots:
+                break
+            slots.intersection_update(self._postings[gram])
+        return slots
+
+    def _fuzzy(self, product_name: str, platform: int) -> typing.List[int]:
+        # 與 SQL 的 name % :product_name 相同: 相似度達 SIMILARITY_THRESHOLD
+        # 的商品。候選為至少有一個相同 n-gram 的商品
+        query = trigrams(product_name)
+        candidates = set()
+        for index_key in index_keys(product_name):
+            if len(index_key) == 1:
+                candidates.update(self._candidates(index_key))
+            else:
+                candidates.update(self._postings.get(index_key, ()))
+
+        return [
+            slot for slot in candidates
+            if self._names[slot] is not None and
+            self._platforms[slot] == platform and
+            similarity(query, trigrams(self._names[slot])) >=
+            SIMILARITY_THRESHOLD
+        ]
+
+    def sort_key(self, slot: int) -> tuple:
+        # 與 SQL 查詢相同的順序: 價格低到高，同價格時最近新增的 (id 大) 在前
+        return (
+            self._prices[slot], -self._ids[slot],
+            PLATFORMS[self._platforms[slot]]
+        )
+
+    def page(
+        self, product_name: str, after: tuple = None, limit: int = 20
+    ) -> typing.List[dict]:
+        # after 為上一頁最後一筆的 (price, -id, platform)
+        terms = product_name.strip().split(" ")
+        matcher = like_to_regex("%{}%".format("%".join(terms)))
+
+        candidates = None
+        for token in sorted(tokenize(" ".join(terms)), key=len, reverse=True):
+            slots = self._candidates(token)
+            candidates = slots if candidates is None else candidates & slots
+            if not candidates:
+                break
+        if candidates is None:
+            candidates = range(len(self._ids))
+
+        matched = []
+        for slot in candidates:
+            name = self._names[slot]
+            if name is not None and matcher.match(name):
+                matched.append(slot)
+        for platform in range(len(PLATFORMS)):
+            if not any(self._platforms[slot] == platform for slot in matched):
+                matched += self._fuzzy(product_name.strip(), platform)
+
+        # 每個商品只有一個 slot，url 不會重複；取 after 之後的 limit 筆
+        slots = matched
+        if after is not None:
+            slots = [slot for slot in slots if self.sort_key(slot) > after]
+
+        return [
+            {
+                "platform": PLATFORMS[self._platforms[slot]],
+                "id": self._ids[slot],
+                "name": self._names[slot],
+                "price": self._prices[slot],
+                "url": self._urls[slot],
+            } for slot in heapq.nsmallest(limit, slots, key=self.sort_key)
+        ]
+
+    async def refresh(self, database, batch_size: int = 50000) -> int:
+        # 以寫入的 transaction id (write_txid) 為 watermark。讀取前先取得目前
+        # snapshot 的 xmin: 比它小的 transaction 都已經結束，寫入的資料這次都
+        # 讀得到；之後才 commit 的 transaction id 一定 >= xmin，下一次從 xmin
+        # 開始重讀，不會因為 transaction 開始到 commit 的時間差而漏掉
+        shopee_stmt = """
+        SELECT id, write_txid, crawled_at, name, price, shopid, itemid
+        FROM shopee_product_current
+        WHERE (write_txid, id) > (:txid, :id)
+        ORDER BY write_txid, id LIMIT :batch_size
+        """
+
+        momo_stmt = """
+        SELECT id, write_txid, crawled_at, product_name, product_price_parsed,
+            product_url_path
+        FROM momo_product_current
+        WHERE (write_txid, id) > (:txid, :id)
+        ORDER BY write_txid, id LIMIT :batch_size
+        """
+
+        added = 0
+        for platform, stmt in (("shopee", shopee_stmt), ("momo", momo_stmt)):
+            horizon = await database.fetch_val(
+                "SELECT txid_snapshot_xmin(txid_current_snapshot())"
+            )
+            # (watermark, 0) 之後包含 write_txid == watermark 的資料
+            txid, id_ = self.watermarks[platform], 0
+
+            while True:
+                rows = await database.fetch_all(
+                    stmt,
+                    values={
+                        "txid": txid,
+                        "id": id_,
+                        "batch_size": batch_size
+                    }
+                )
+                for row in rows:
+                    if platform == "shopee":
+                        self.add(
+                            "shopee", row["id"], row["crawled_at"], row["name"],
+                            row["price"],
+                            shopee_url_template.format(
+                                row["name"], row["shopid"], row["itemid"]
+                            )
+                        )
+                    else:
+                        self.add(
+                            "momo", row["id"], row["crawled_at"],
+                            row["product_name"], row["product_price_parsed"],
+                            momo_url_template.format(row["product_url_path"])
+                        )
+                added += len(rows)
+                if len(rows) < batch_size:
+                    break
+                txid, id_ = rows[-1]["write_txid"], rows[-1]["id"]
+            # 整個平台讀完才前進，失敗時下一次從同一個位置重讀
+            self.watermarks[platform] = horizon
+
+        return added
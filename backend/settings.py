@@ -1,3 +1,4 @@
+import typing
 from pydantic import BaseSettings
 from pathlib import Path
 
@@ -5,6 +6,78 @@ from pathlib import Path
 class Settings(BaseSettings):
     DB_URI: str
 
+    # 爬取目標，.env 中以 JSON 陣列設定，例如 CRAWL_MOMO_BRANDS='["3M"]'
+    CRAWL_SHOPEE_SHOPS: typing.List[str] = [
+        "google.tw", "microsoft_tw", "3mofficial"
+    ]
+    CRAWL_MOMO_BRANDS: typing.List[str] = ["Google", "Microsoft微軟", "3M"]
+    CRAWL_SHOP_CONCURRENCY: int = 4  # 同時爬幾個 Shopee 商店
+
+    # "postgres": 每次查詢都查資料庫; "memory": 使用 price-api 內的反向索引
+    SEARCH_BACKEND: str = "postgres"
+    SEARCH_INDEX_REFRESH_SECONDS: int = 60
+    # /product/ 結果快取: TTL 為 0 時不使用；每 SEARCH_CACHE_VERSION_SECONDS
+    # 秒檢查一次資料版本，爬取完成後清空
+    SEARCH_CACHE_TTL_SECONDS: int = 300
+    SEARCH_CACHE_MAX_ENTRIES: int = 10000
+    SEARCH_CACHE_VERSION_SECONDS: int = 5
+    # /product/ 每頁筆數的預設值與上限
+    SEARCH_PAGE_SIZE: int = 20
+    SEARCH_MAX_PAGE_SIZE: int = 100
+
+    # 爬蟲連線的網站，效能測試時改為 benchmarks/fake_server.py
+    SHOPEE_BASE_URL: str = "https://shopee.tw"
+    MOMO_BASE_URL: str = "https://m.momoshop.com.tw"
+
+    # Momo 爬蟲: "sync" 逐頁以 requests 下載; "async" 以 aiohttp 並行下載
+    MOMO_CRAWLER: str = "sync"
+    MOMO_RATE_LIMIT: float = 5.0  # 全域每秒請求數
+    MOMO_HOST_RATE_LIMIT: float = 2.0  # 每個 host 每秒請求數
+    MOMO_BURST: float = 2.0
+    MOMO_MAX_CONCURRENCY: int = 8
+    MOMO_JITTER_SECONDS: float = 0.5
+    # 商品頁解析: "bs4" 或 "lxml"；MOMO_PARSE_WORKERS > 0 時以多個 process 解析
+    MOMO_PARSER: str = "bs4"
+    MOMO_PARSE_WORKERS: int = 0
+    # 品牌目錄在這段時間內更新過就不重新爬取
+    MOMO_BRAND_DIRECTORY_TTL_HOURS: int = 168
+
+    # Shopee 爬蟲共用的 AIMD 並行數上下限
+    SHOPEE_INITIAL_CONCURRENCY: int = 8
+    SHOPEE_MAX_CONCURRENCY: int = 128
+    # 商店解析: "directory" 每個 TTL 爬一次完整官方商店目錄;
+    # "targeted" 只查詢要爬的 username。兩者都會先查 shopee_shop 快取
+    SHOPEE_SHOP_RESOLVE: str = "directory"
+    SHOPEE_SHOP_DIRECTORY_TTL_HOURS: int = 24
+    # 商品規格: "full" 每個商品都抓; "incremental" 列表資料沒變的商品
+    # 不抓，改為每 SHOPEE_MODEL_REFRESH_DAYS 天輪流重抓一次
+    SHOPEE_MODEL_CRAWL: str = "incremental"
+    SHOPEE_MODEL_REFRESH_DAYS: int = 7
+
+    # 爬蟲 fetch / normalize / DB write 各 stage 之間 queue 的 batch 數上限
+    PIPELINE_QUEUE_SIZE: int = 8
+
+    # 工作佇列模式 (runner.py --enqueue / --worker)
+    WORK_QUEUE_LEASE_SECONDS: int = 300
+    WORK_QUEUE_MAX_ATTEMPTS: int = 5
+    WORK_QUEUE_CONCURRENCY: int = 16  # 每個 worker 同時處理的工作數
+    WORK_QUEUE_ITEM_BATCH: int = 20  # 每個工作抓幾個商品的規格
+    WORK_QUEUE_IDLE_SECONDS: int = 30  # 佇列空了多久 worker 結束
+
+    # 排程模式 (runner.py --schedule)
+    SCHEDULER_REQUESTS_PER_HOUR: int = 2000
+    SCHEDULER_WINDOW_DAYS: int = 14  # 以多少天內的歷史資料估計變動頻率
+    SCHEDULER_MIN_INTERVAL_HOURS: float = 1
+    SCHEDULER_MAX_INTERVAL_HOURS: float = 168
+
+    # HTTP 回應快取: HTTP_CACHE_DIR 為空時不使用
+    # TTL 秒內的相同請求直接用快取; 內容與上次相同的頁面跳過解析與寫入;
+    # HTTP_CACHE_REPLAY=true 時只讀快取 (離線重播)，快取沒有的請求視為失敗
+    HTTP_CACHE_DIR: str = ""
+    HTTP_CACHE_TTL_SECONDS: int = 0
+    HTTP_CACHE_MAX_MB: int = 1024
+    HTTP_CACHE_REPLAY: bool = False
+
     class Config:
         env_file = Path(__file__).parent / ".env"
 
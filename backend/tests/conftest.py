@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 與 runner.py / main.py 相同，以 backend 為 import 的根目錄
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,25 @@
+import sqlalchemy as sa
+
+import db_model
+from checkpoint import Checkpoint
+
+
+def make_engine():
+    engine = sa.create_engine("sqlite://")
+    db_model.crawl.CrawlRun.__table__.create(engine)
+    return engine
+
+
+def test_failed_run_can_be_resumed():
+    # 有失敗的執行不標記為完成，--resume 會選到同一個 crawl_run
+    engine = make_engine()
+    run = Checkpoint.start(engine)
+    run.finish({"shopee": {"failed_tasks": 1}}, completed=False)
+
+    table = db_model.crawl.CrawlRun.__table__
+    with engine.connect() as conn:
+        row = conn.execute(sa.select(table)).one()
+    assert row.finished_at is None
+    assert row.stats == {"shopee": {"failed_tasks": 1}}
+
+    assert Checkpoint.start(engine, resume=True).run_id == run.run_id
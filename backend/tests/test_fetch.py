@@ -0,0 +1,192 @@
+import time
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+from aiohttp import web
+
+from crawlers.cache import ResponseCache
+from crawlers.fetch import Fetcher, FetchError, Unchanged
+from crawlers.ratelimit import RateLimiter
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get("/item", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/item"
+
+
+def test_half_open_probe_does_not_drain_retries():
+    # 試探請求進行中時，其他並行的請求應等待，而不是立刻用完重試次數與預算
+    async def main():
+        async def handler(request):
+            await asyncio.sleep(0.3)
+            return web.json_response({"ok": True})
+
+        runner, url = await serve(handler)
+        fetcher = Fetcher(base_delay=0.05, max_retries=1, reset_timeout=0.1)
+        breaker = fetcher.breaker("GET", url)
+        breaker.opened_at = time.monotonic() - 1  # half-open
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                results = await asyncio.gather(
+                    *[fetcher.request(session, "GET", url) for _ in range(20)],
+                    return_exceptions=True
+                )
+        finally:
+            await runner.cleanup()
+        return fetcher, breaker, results
+
+    fetcher, breaker, results = asyncio.run(main())
+    assert results == [{"ok": True}] * 20
+    assert breaker.state == "closed"
+    assert fetcher.retry_budget.retries == 0
+    assert fetcher.failed_requests == 0
+
+
+def test_open_circuit_gives_up_after_max_circuit_wait():
+    async def main():
+        fetcher = Fetcher(base_delay=0.01, max_circuit_wait=1.0)
+        url = "http://127.0.0.1:9/item"
+        fetcher.breaker("GET", url).opened_at = time.monotonic()
+        async with aiohttp.ClientSession() as session:
+            try:
+                await fetcher.request(session, "GET", url)
+            except FetchError as e:
+                return fetcher, e
+
+    fetcher, error = asyncio.run(main())
+    assert "circuit open" in str(error)
+    assert fetcher.retry_budget.retries == 0
+
+
+def test_changed_response_is_cached_only_after_confirm(tmp_path):
+    # 內容有變的回應在 confirm (寫入 DB) 之前不能更新快取，否則寫入失敗時
+    # 下一次會被當成沒有變動而略過
+    async def main():
+        body = {"version": 1}
+
+        async def handler(request):
+            return web.json_response(body)
+
+        runner, url = await serve(handler)
+        fetcher = Fetcher(cache=ResponseCache(str(tmp_path)))
+        key = fetcher.cache_key("GET", url)
+        results = []
+        try:
+            async with aiohttp.ClientSession() as session:
+
+                async def fetch():
+                    results.append(
+                        await fetcher.request(
+                            session, "GET", url, if_changed=True
+                        )
+                    )
+
+                await fetch()
+                await fetch()  # 沒有 confirm: 仍視為有變動
+                fetcher.confirm(key)
+                await fetch()
+                body["version"] = 2
+                await fetch()
+        finally:
+            await runner.cleanup()
+        return results
+
+    results = asyncio.run(main())
+    assert results[0] == {"version": 1}
+    assert results[1] == {"version": 1}
+    assert isinstance(results[2], Unchanged)
+    assert results[3] == {"version": 2}
+
+
+def test_sync_requests_go_through_limiter():
+    # 同步模式的 Momo 爬蟲也要受 limiter 的速率限制
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/item"
+    fetcher = Fetcher(
+        limiter=RateLimiter(rate=10, per_host_rate=10, burst=1, jitter=0)
+    )
+    try:
+        start = time.monotonic()
+        bodies = [fetcher.request_sync("GET", url).text for _ in range(4)]
+        elapsed = time.monotonic() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert bodies == ["ok"] * 4
+    # 第一個請求使用 burst 的 token，之後每 0.1 秒一個
+    assert elapsed >= 0.29
+
+
+def test_probe_ending_in_non_retryable_error_frees_circuit():
+    # 試探請求以 404 結束時不能一直佔住試探的位置
+    async def main():
+        calls = []
+
+        async def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                return web.Response(status=404)
+            return web.json_response({"ok": True})
+
+        runner, url = await serve(handler)
+        fetcher = Fetcher(base_delay=0.01, max_circuit_wait=1.0)
+        breaker = fetcher.breaker("GET", url)
+        breaker.opened_at = time.monotonic() - 60  # half-open
+        try:
+            async with aiohttp.ClientSession() as session:
+                try:
+                    await fetcher.request(session, "GET", url)
+                except FetchError as e:
+                    error = e
+                result = await fetcher.request(session, "GET", url)
+        finally:
+            await runner.cleanup()
+        return error, result, breaker
+
+    error, result, breaker = asyncio.run(main())
+    assert "HTTP 404" in str(error)
+    assert result == {"ok": True}
+    assert breaker.state == "closed"
+
+
+def test_invalid_json_is_retried():
+    async def main():
+        calls = []
+
+        async def handler(request):
+            calls.append(1)
+            if len(calls) == 1:
+                return web.Response(text="<html>blocked</html>")
+            return web.json_response({"ok": True})
+
+        runner, url = await serve(handler)
+        fetcher = Fetcher(base_delay=0.01)
+        try:
+            async with aiohttp.ClientSession() as session:
+                result = await fetcher.request(session, "GET", url)
+        finally:
+            await runner.cleanup()
+        return fetcher, result
+
+    fetcher, result = asyncio.run(main())
+    assert result == {"ok": True}
+    assert fetcher.retry_budget.retries == 1
@@ -0,0 +1,55 @@
+import datetime
+
+import pandas as pd
+
+from incremental import ModelCrawlFilter
+
+
+def item(itemid, single_model):
+    return {
+        "itemid": itemid,
+        "shopid": 1,
+        "single_model": single_model,
+        "price_min": 100000,
+        "price_max": 100000,
+        "ctime": 0,
+        "stock": 1,
+    }
+
+
+def test_single_model_item_is_crawled_once():
+    crawl_filter = ModelCrawlFilter(engine=None)
+    crawl_filter._listings = {}
+    crawl_filter._crawled_items = {2}
+
+    assert crawl_filter.reason(item(1, True)) == "new"
+    assert crawl_filter.reason(item(2, True)) == "single_model"
+
+
+def test_written_rows_update_the_loaded_state():
+    # 排程模式下同一個 process 的下一輪要以這次寫入的資料判斷
+    crawl_filter = ModelCrawlFilter(engine=None)
+    crawl_filter._listings = {}
+    crawl_filter._crawled_items = set()
+    crawl_filter._due = lambda itemid: False
+
+    new_item = item(1, False)
+    assert crawl_filter.reason(new_item) == "new"
+
+    crawl_filter.remember_listings(
+        pd.DataFrame(
+            [
+                {
+                    "shopid": 1,
+                    "itemid": 1,
+                    "price_min": 1.0,
+                    "price_max": 1.0,
+                    "item_created_time": datetime.datetime.fromtimestamp(0),
+                    "stock": 1,
+                }
+            ]
+        )
+    )
+    assert crawl_filter.reason(new_item) == "never_crawled"
+    crawl_filter.remember_models([1])
+    assert crawl_filter.reason(new_item) == "unchanged"
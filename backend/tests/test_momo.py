@@ -0,0 +1,113 @@
+import asyncio
+import concurrent.futures
+from pathlib import Path
+
+import pytest
+
+from crawlers.fetch import Fetcher
+from crawlers.momo import (
+    AioMomoBrandProductCrawler, MomoCrawler, parse_products
+)
+
+FIXTURES = Path(__file__).resolve().parent.parent / "benchmarks" / "fixtures"
+
+
+@pytest.mark.parametrize(
+    "path", sorted(FIXTURES.glob("momo_*.html")), ids=lambda path: path.name
+)
+def test_lxml_parser_matches_bs4(path):
+    text = path.read_text(encoding="utf-8")
+    assert parse_products(text, "lxml") == parse_products(text, "bs4")
+
+
+@pytest.mark.parametrize(
+    "li, error", [
+        ('<h3 class="prdName">x</h3>', TypeError),
+        ('<a class="productInfo">x</a>', KeyError),
+        ('<a class="productInfo" href="/a">x</a>', AttributeError),
+    ]
+)
+def test_lxml_parser_raises_like_bs4(li, error):
+    # 呼叫端的 except 對兩種 backend 都要有效
+    text = f'<article class="prdListArea"><ul><li>{li}</li></ul></article>'
+    for backend in ["bs4", "lxml"]:
+        with pytest.raises(error):
+            parse_products(text, backend)
+
+
+@pytest.mark.parametrize("backend", ["bs4", "lxml"])
+def test_parse_in_process_pool_matches_inline(backend):
+    # 在 ProcessPoolExecutor 中解析的結果與直接解析相同
+    text = (FIXTURES / "momo_category_page.html").read_text(encoding="utf-8")
+
+    async def main(executor):
+        crawler = AioMomoBrandProductCrawler(
+            Fetcher(), parser_backend=backend, parse_executor=executor
+        )
+        return await crawler.parse_products(text)
+
+    with concurrent.futures.ProcessPoolExecutor(1) as executor:
+        pooled = asyncio.run(main(executor))
+    assert pooled
+    assert pooled == asyncio.run(main(None)) == parse_products(text, backend)
+
+
+def category_page(first, count, page_count):
+    # page_count 為誤判的總頁數 (例如頁面上其他元件的 totalPage)
+    items = "".join(
+        '<li><a class="productInfo" href="/p/{0}">'
+        '<p class="prdEvent"></p><h3 class="prdName">item {0}</h3>'
+        '<b class="price">100</b><b class="priceText">$100</b></a></li>'.format(
+            i
+        ) for i in range(first, first + count)
+    )
+    return (
+        f'<script>var totalPage = {page_count};</script>'
+        f'<article class="prdListArea"><ul>{items}</ul></article>'
+    )
+
+
+# 每頁 2 筆，共 3 頁 (最後一頁 1 筆)，但每一頁都宣稱總頁數為 1
+PAGES = {1: category_page(0, 2, 1), 2: category_page(2, 2, 1)}
+PAGES[3] = category_page(4, 1, 1)
+BRAND = {"child_category_code": "123", "child_category_name": "brand"}
+
+
+def product_paths(products):
+    return sorted(item["product_url_path"] for item in products)
+
+
+def test_single_page_count_still_probes_next_page_async():
+    crawler = AioMomoBrandProductCrawler(Fetcher())
+
+    async def crawl_page_n(aioclient, code, n, if_changed=False):
+        return PAGES.get(n, category_page(0, 0, 1))
+
+    crawler.crawl_page_n = crawl_page_n
+
+    async def main():
+        products = []
+        async for product_list in crawler.crawl_and_parse(None, BRAND, []):
+            products.extend(product_list)
+        return products
+
+    assert product_paths(asyncio.run(main())) == [
+        f"/p/{i}" for i in range(5)
+    ]
+
+
+def test_single_page_count_still_probes_next_page_sync():
+    class Response:
+        def __init__(self, text):
+            self.text = text
+
+    crawler = MomoCrawler(Fetcher())
+    crawler.momo.get_brand_product_page_n = (
+        lambda code, n, if_changed=False: Response(
+            PAGES.get(n, category_page(0, 0, 1))
+        )
+    )
+    df = crawler.collect_brand_products(BRAND)
+    assert product_paths(df.to_dict(orient="records")) == [
+        f"/p/{i}" for i in range(5)
+    ]
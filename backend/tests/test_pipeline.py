@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import pipeline
+from crawlers.stream import stream_batches
+
+
+async def source(n):
+    for i in range(n):
+        yield [i]
+
+
+def test_failing_stage_with_full_queue_raises():
+    # 寫入失敗時上游卡在已滿的 queue 上，取消後不能再等待放入 DONE
+    def write(batch):
+        raise RuntimeError("db error")
+
+    async def main():
+        await asyncio.wait_for(
+            pipeline.run(
+                source(100),
+                [(lambda batch: batch, False), (write, False)],
+                maxsize=2,
+            ),
+            timeout=5,
+        )
+
+    with pytest.raises(RuntimeError, match="db error"):
+        asyncio.run(main())
+
+
+def test_failing_thread_stage_with_full_queue_raises():
+    def write(batch):
+        raise RuntimeError("db error")
+
+    async def main():
+        await asyncio.wait_for(
+            pipeline.run(source(100), [(write, True)], maxsize=1), timeout=5
+        )
+
+    with pytest.raises(RuntimeError, match="db error"):
+        asyncio.run(main())
+
+
+def test_stage_order_and_filtering():
+    written = []
+
+    async def main():
+        await pipeline.run(
+            source(5),
+            [
+                (lambda batch: batch if batch[0] % 2 == 0 else None, False),
+                (written.append, True),
+            ],
+            maxsize=1,
+        )
+
+    asyncio.run(main())
+    assert written == [[0], [2], [4]]
+
+
+def test_stream_batches_closed_early_with_full_queue():
+    # 下游提早停止時，卡在已滿的 outbox 上的 worker 被取消後要能結束
+    async def handle(item):
+        for i in range(10):
+            yield [item, i]
+
+    async def main():
+        batches = stream_batches(
+            range(10), handle, [], concurrency=2, maxsize=1
+        )
+        async for _ in batches:
+            break
+        await asyncio.wait_for(batches.aclose(), timeout=5)
+
+    asyncio.run(main())
@@ -0,0 +1,28 @@
+import asyncio
+
+from crawlers.ratelimit import AIMDLimiter
+
+
+def test_cancelled_waiter_passes_wakeup_on():
+    # 被叫醒後、還沒執行前就被取消的請求，不能吃掉這次喚醒
+    async def main():
+        limiter = AIMDLimiter(initial_window=1, min_window=1, max_window=1)
+        loop = asyncio.get_running_loop()
+        acquired = []
+
+        async def wait(name):
+            async with limiter():
+                acquired.append(name)
+
+        await limiter._acquire()
+        first = asyncio.ensure_future(wait("first"))
+        second = asyncio.ensure_future(wait("second"))
+        await asyncio.sleep(0)
+
+        # 釋放時叫醒 first，first 還沒執行就被取消
+        limiter._release(False, 0.0, loop.time())
+        first.cancel()
+        await asyncio.wait_for(second, timeout=1)
+        return acquired
+
+    assert asyncio.run(main()) == ["second"]
@@ -0,0 +1,30 @@
+import datetime
+
+from scheduler import CrawlScheduler
+
+
+def test_shop_cost_includes_item_gets():
+    incremental = CrawlScheduler(None, 1000, model_refresh_days=7)
+    full = CrawlScheduler(None, 1000, model_crawl="full")
+    # 每小時變動 0.5 次: 每 2 小時爬一次，期間約 1 個商品變動，
+    # 另有 2 / (24 * 7) 的商品輪到重抓
+    assert incremental.item_gets(840, 0.5) == 11
+    assert incremental.item_gets(0, 0.5) == 0
+    assert full.item_gets(840, 0.5) == 840
+
+
+def test_plan_respects_given_budget():
+    scheduler = CrawlScheduler(None, 100)
+    entities = [
+        {
+            "kind": "shopee_shop",
+            "key": str(n),
+            "rate": 1.0,
+            "cost": 40,
+            "last_crawled_at": None,
+        } for n in range(3)
+    ]
+    now = datetime.datetime.now()
+    assert len(scheduler.plan(entities, now)) == 2
+    # 已經用掉的請求 (例如商店解析) 要從預算扣除
+    assert len(scheduler.plan(entities, now, budget=50)) == 1
@@ -0,0 +1,108 @@
+import asyncio
+
+from search_cache import SearchCache
+
+
+class Backend:
+    # 記錄查詢次數，release 之前查詢不會完成
+    def __init__(self) -> None:
+        self.calls = []
+        self.release = asyncio.Event()
+
+    async def __call__(self, product_name, *params):
+        self.calls.append((product_name, ) + params)
+        await self.release.wait()
+        return [product_name, len(self.calls)]
+
+
+def test_concurrent_identical_lookups_share_one_query():
+    cache = SearchCache()
+
+    async def main():
+        backend = Backend()
+        lookups = [
+            asyncio.ensure_future(cache.get(backend, name, None, 20))
+            for name in ["pixel 8", " pixel  8", "pixel 8 "]
+        ]
+        await asyncio.sleep(0)
+        backend.release.set()
+        results = await asyncio.gather(*lookups)
+        # 之後的請求直接使用快取
+        results.append(await cache.get(backend, "pixel 8", None, 20))
+        return backend.calls, results
+
+    calls, results = asyncio.run(main())
+    assert calls == [("pixel 8", None, 20)]
+    assert results == [["pixel 8", 1]] * 4
+    assert cache.metrics()["misses"] == 1
+    assert cache.metrics()["coalesced"] == 2
+    assert cache.metrics()["hits"] == 1
+
+
+def test_cancelled_first_lookup_does_not_cancel_others():
+    cache = SearchCache()
+
+    async def main():
+        backend = Backend()
+        first = asyncio.ensure_future(cache.get(backend, "pixel"))
+        second = asyncio.ensure_future(cache.get(backend, "pixel"))
+        await asyncio.sleep(0)
+        first.cancel()
+        backend.release.set()
+        return backend.calls, await second
+
+    calls, result = asyncio.run(main())
+    assert calls == [("pixel", )]
+    assert result == ["pixel", 1]
+
+
+def test_version_bump_evicts():
+    cache = SearchCache()
+
+    async def main():
+        backend = Backend()
+        backend.release.set()
+        cache.set_version(1)
+        await cache.get(backend, "pixel")
+        await cache.get(backend, "pixel")
+        cache.set_version(2)
+        assert len(cache) == 0
+        return await cache.get(backend, "pixel")
+
+    assert asyncio.run(main()) == ["pixel", 2]
+
+
+def test_result_loaded_across_version_bump_is_not_cached():
+    # 查詢途中爬取完成，舊資料的結果不能留在快取中
+    cache = SearchCache()
+
+    async def main():
+        backend = Backend()
+        cache.set_version(1)
+        lookup = asyncio.ensure_future(cache.get(backend, "pixel"))
+        await asyncio.sleep(0)
+        cache.set_version(2)
+        backend.release.set()
+        await lookup
+        return len(cache)
+
+    assert asyncio.run(main()) == 0
+
+
+def test_lookup_after_version_bump_does_not_join_old_query():
+    cache = SearchCache()
+
+    async def main():
+        backend = Backend()
+        cache.set_version(1)
+        old = asyncio.ensure_future(cache.get(backend, "pixel"))
+        await asyncio.sleep(0)
+        cache.set_version(2)
+        new = asyncio.ensure_future(cache.get(backend, "pixel"))
+        await asyncio.sleep(0)
+        backend.release.set()
+        return backend.calls, await old, await new
+
+    calls, old, new = asyncio.run(main())
+    assert calls == [("pixel", ), ("pixel", )]
+    assert new == ["pixel", 2]
@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+
+from search_index import ProductSearchIndex, similarity, trigrams
+
+NOW = datetime.datetime(2024, 1, 1)
+
+
+def build(products):
+    index = ProductSearchIndex()
+    for i, (platform, name, price) in enumerate(products, 1):
+        index.add(platform, i, NOW, name, price, f"https://example/{i}")
+    return index
+
+
+def names(items):
+    return [item["name"] for item in items]
+
+
+def test_substring_terms_use_ngram_postings():
+    index = build(
+        [
+            ("shopee", "Apple iPhone15 Pro", 30000.0),
+            ("shopee", "藍牙耳機 A", 500.0),
+            ("shopee", "無線 藍 牙", 800.0),
+            ("shopee", "phone 殼", 100.0),
+        ]
+    )
+    # 英數字串的一部分、單一字元與中文 bigram 都要找得到 (區分大小寫)
+    assert names(index.page("Phone15")) == ["Apple iPhone15 Pro"]
+    assert names(index.page("phone")) == ["phone 殼"]
+    assert names(index.page("藍")) == ["藍牙耳機 A", "無線 藍 牙"]
+    assert names(index.page("A")) == ["藍牙耳機 A", "Apple iPhone15 Pro"]
+    assert names(index.page("藍牙")) == ["藍牙耳機 A"]
+
+
+def test_fuzzy_fallback_per_platform():
+    index = build(
+        [
+            ("shopee", "wireless mouse", 500.0),
+            ("momo", "wireles mouse pad", 300.0),
+            ("momo", "keyboard", 200.0),
+        ]
+    )
+    # momo 沒有名稱符合的商品時以相似度取最相近的
+    items = index.page("wireless mouse")
+    assert [(item["platform"], item["name"]) for item in items] == [
+        ("momo", "wireles mouse pad"),
+        ("shopee", "wireless mouse"),
+    ]
+    assert similarity(
+        trigrams("wireless mouse"), trigrams("wireles mouse pad")
+    ) >= 0.3
+
+
+def test_product_without_price_is_removed():
+    index = build([("shopee", "Pixel 8", 20000.0)])
+    assert names(index.page("Pixel")) == ["Pixel 8"]
+
+    index.add("shopee", 1, NOW, "Pixel 8", None, "https://example/1")
+    assert index.page("Pixel") == []
+    assert len(index) == 0
+
+    index.add("shopee", 1, NOW, "Pixel 8", 19000.0, "https://example/1")
+    assert [item["price"] for item in index.page("Pixel")] == [19000.0]
+
+
+def test_fuzzy_results_are_paged_by_cursor():
+    index = build(
+        [("momo", f"wireless mouse {n}", float(n)) for n in range(15)]
+    )
+    # 沒有 LIKE 符合的商品時，相似的商品同樣依 after 往後分頁，不限 10 筆
+    first = index.page("wireless mice", limit=10)
+    after = (first[-1]["price"], -first[-1]["id"], first[-1]["platform"])
+    rest = index.page("wireless mice", after=after, limit=10)
+    assert [item["price"] for item in first] == [float(n) for n in range(10)]
+    assert [item["price"] for item in rest] == [float(n) for n in range(10, 15)]
+
+
+class FakeDatabase:
+    # 模擬 *_current 與 transaction 的 snapshot: rows 為已 commit 的資料
+    def __init__(self) -> None:
+        self.rows = {"shopee_product_current": [], "momo_product_current": []}
+        self.xmin = 1
+
+    def write(self, txid, id_, name, price=100.0):
+        self.rows["shopee_product_current"].append(
+            {
+                "id": id_,
+                "write_txid": txid,
+                "crawled_at": NOW,
+                "name": name,
+                "price": price,
+                "shopid": 1,
+                "itemid": id_,
+            }
+        )
+
+    async def fetch_val(self, query):
+        return self.xmin
+
+    async def fetch_all(self, query, values):
+        table = "shopee_product_current" if "shopee" in query else (
+            "momo_product_current"
+        )
+        rows = sorted(
+            (
+                row for row in self.rows[table]
+                if (row["write_txid"], row["id"]) >
+                (values["txid"], values["id"])
+            ),
+            key=lambda row: (row["write_txid"], row["id"])
+        )
+        return rows[:values["batch_size"]]
+
+
+def test_refresh_picks_up_late_commits():
+    # transaction 100 開始得早、commit 得晚: 第一次更新時還沒 commit，
+    # 它寫入的資料之後一定要讀得到
+    database = FakeDatabase()
+    index = ProductSearchIndex()
+    database.write(101, 1, "mouse")
+    database.xmin = 100  # transaction 100 還在進行中
+    asyncio.run(index.refresh(database, batch_size=1))
+    assert names(index.page("mouse")) == ["mouse"]
+
+    database.write(100, 2, "mouse pad", 50.0)
+    database.xmin = 102
+    asyncio.run(index.refresh(database, batch_size=1))
+    assert names(index.page("mouse")) == ["mouse pad", "mouse"]
+    assert index.watermarks["shopee"] == 102
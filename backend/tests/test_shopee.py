@@ -0,0 +1,62 @@
+import asyncio
+import collections
+
+from crawlers.fetch import Fetcher, FetchError
+from crawlers.shopee import (
+    SHOP_COLUMNS, AioShopCrawler, AioShopProductsCrawler, WrittenPage
+)
+from crawlers.stream import Marker
+
+
+def section(*itemids):
+    return {
+        "total": len(itemids),
+        "data": {
+            # 其他欄位以 None 代替
+            "item": [
+                collections.defaultdict(
+                    lambda: None, itemid=itemid, shopid=1
+                ) for itemid in itemids
+            ]
+        },
+    }
+
+
+def test_done_page_items_are_refed_without_writing():
+    # 接續執行時已寫入的頁面不再寫入，但商品仍要交給規格爬取
+    crawler = AioShopProductsCrawler(
+        Fetcher(), markers=True, done_pages={"1:0"}
+    )
+    done = crawler.page_batches(1, 0, section(10, 11))
+    assert len(done) == 1
+    assert isinstance(done[0], WrittenPage)
+    assert [item["itemid"] for item in done[0].body] == [10, 11]
+
+    batches = crawler.page_batches(1, 30, section(12))
+    assert [item["itemid"] for item in batches[0]] == [12]
+    assert isinstance(batches[-1], Marker)
+    assert (batches[-1].kind, batches[-1].key) == ("shopee_page", "1:30")
+
+
+class CategoryFailingFetcher:
+    # 分類列表成功，各分類的商店列表全部失敗
+    async def request(self, aioclient, method, url, **kwargs):
+        if "get_categories" in url:
+            return {
+                "data": {
+                    "categories": [{
+                        "category_id": 1
+                    }, {
+                        "category_id": 2
+                    }]
+                }
+            }
+        raise FetchError(url)
+
+
+def test_shop_directory_is_empty_when_every_category_fails():
+    crawler = AioShopCrawler(CategoryFailingFetcher())
+    df = asyncio.run(crawler())
+    assert df.empty
+    assert list(df.columns) == SHOP_COLUMNS
+    assert len(crawler.failures) == 2
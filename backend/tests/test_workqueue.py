@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+
+from sqlalchemy.dialects import postgresql
+
+import workqueue
+
+
+def sql(stmt):
+    compiled = stmt.compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}
+    )
+    return " ".join(str(compiled).split())
+
+
+class Result:
+    def __init__(self, rows=(), rowcount=0) -> None:
+        self.rows = list(rows)
+        self.rowcount = rowcount
+
+    def all(self):
+        return self.rows
+
+
+class FakeEngine:
+    # 記錄執行的語句，依序回傳預先設定的結果
+    def __init__(self, results=()) -> None:
+        self.results = list(results)
+        self.executed = []
+
+    @contextlib.contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, stmt, params=None):
+        self.executed.append((stmt, params))
+        return self.results.pop(0) if self.results else Result()
+
+
+def make_queue(results=()):
+    engine = FakeEngine(results)
+    return workqueue.WorkQueue(
+        engine, lease_seconds=60, max_attempts=3, worker="w1"
+    ), engine
+
+
+def test_claim_skips_locked_and_leased_tasks():
+    queue, engine = make_queue([Result(rows=[])])
+    queue.claim(4)
+    [(stmt, _)] = engine.executed
+    text = sql(stmt)
+    # 領取時鎖住並跳過其他 worker 正在領取的工作
+    assert "FOR UPDATE SKIP LOCKED" in text
+    assert "LIMIT 4" in text
+    # 只領取未完成、次數未用完且 lease 不存在或已過期的工作
+    assert "crawl_task.status = 'pending'" in text
+    assert "crawl_task.attempts < 3" in text
+    assert (
+        "crawl_task.lease_until IS NULL "
+        "OR crawl_task.lease_until < now()"
+    ) in text
+    # 設定新的 lease 並增加次數
+    assert "lease_until=(now() + make_interval(secs=>60.0))" in text
+    assert "attempts=(crawl_task.attempts + 1)" in text
+    assert "worker='w1'" in text
+    assert "RETURNING crawl_task.id" in text
+
+
+def test_claim_returns_tasks():
+    row = type(
+        "Row", (), {
+            "_asdict": lambda self: {
+                "id": 1,
+                "run_id": 2,
+                "kind": "shop",
+                "payload": {}
+            }
+        }
+    )()
+    queue, _ = make_queue([Result(rows=[row])])
+    assert queue.claim(1) == [
+        {
+            "id": 1,
+            "run_id": 2,
+            "kind": "shop",
+            "payload": {}
+        }
+    ]
+
+
+def test_ack_and_fail_only_touch_own_lease():
+    # lease 過期被其他 worker 重新領取後，原本的 worker 不能再改變工作的狀態
+    queue, engine = make_queue()
+    task = {"id": 7, "run_id": 2}
+    queue.ack(task)
+    queue.fail(task, "boom")
+    queue.extend([7])
+    for stmt, _ in engine.executed:
+        text = sql(stmt)
+        assert "crawl_task.worker = 'w1'" in text
+        assert "crawl_task.status = 'pending'" in text
+
+
+def test_ack_enqueues_follow_up_tasks():
+    queue, engine = make_queue([Result(rowcount=1)])
+    queue.ack({"id": 7, "run_id": 2}, [("page", {"n": 2})])
+    [(ack, _), (insert, rows)] = engine.executed
+    assert "status='done'" in sql(ack)
+    assert rows[0]["run_id"] == 2
+    assert rows[0]["kind"] == "page"
+    assert rows[0]["status"] == "pending"
+
+
+def test_ack_after_lease_lost_drops_follow_up_tasks():
+    # 由重新領取工作的 worker 產生後續工作，避免重複
+    queue, engine = make_queue([Result(rowcount=0)])
+    queue.ack({"id": 7, "run_id": 2}, [("page", {"n": 2})])
+    assert len(engine.executed) == 1
+
+
+def test_fail_retries_until_max_attempts():
+    queue, engine = make_queue()
+    queue.fail({"id": 7, "run_id": 2}, "boom")
+    [(stmt, _)] = engine.executed
+    text = sql(stmt)
+    assert (
+        "status=CASE WHEN (crawl_task.attempts >= 3) THEN 'failed' "
+        "ELSE 'pending' END"
+    ) in text
+    assert "error='boom'" in text
+
+
+def test_finish_runs_expires_exhausted_leases():
+    queue, engine = make_queue([Result(rowcount=1), Result(rowcount=0)])
+    queue.finish_runs()
+    expire, finish = (sql(stmt) for stmt, _ in engine.executed)
+    # worker 一直死掉的工作在 lease 過期後標記為失敗
+    assert "status='failed'" in expire
+    assert "crawl_task.attempts >= 3" in expire
+    assert "crawl_task.lease_until < now()" in expire
+    # 沒有未完成工作的 run 才標記為完成
+    assert "UPDATE crawl_run SET finished_at=now()" in finish
+    assert "crawl_task.status = 'pending'" in finish
+
+
+class RecordingQueue(workqueue.WorkQueue):
+    def __init__(self) -> None:
+        super().__init__(None, worker="w1")
+        self.acked = []
+        self.failed = []
+
+    def ack(self, task, new_tasks=()):
+        self.acked.append((task["id"], new_tasks))
+
+    def fail(self, task, error):
+        self.failed.append((task["id"], error))
+
+
+def test_process_acks_or_fails():
+    queue = RecordingQueue()
+
+    async def shop(payload):
+        return [("page", payload)]
+
+    async def page(payload):
+        raise RuntimeError("bad page")
+
+    async def main():
+        handlers = {"shop": shop, "page": page}
+        await queue._process(
+            handlers, {"id": 1, "kind": "shop", "payload": {"n": 1}}
+        )
+        await queue._process(
+            handlers, {"id": 2, "kind": "page", "payload": {"n": 1}}
+        )
+        await queue._process(handlers, {"id": 3, "kind": "x", "payload": {}})
+
+    asyncio.run(main())
+    assert queue.acked == [(1, [("page", {"n": 1})])]
+    assert [task_id for task_id, _ in queue.failed] == [2, 3]
+    assert "bad page" in queue.failed[0][1]
@@ -0,0 +1,184 @@
+import datetime
+import contextlib
+
+import pandas as pd
+import sqlalchemy as sa
+
+import db_model
+import writer
+
+
+def model_filter():
+    engine = sa.create_engine("sqlite://")
+    db_model.shopee.ShopeeProductModelCurrent.__table__.create(engine)
+    return writer.ChangeFilter(
+        engine, db_model.shopee.ShopeeProductModelCurrent,
+        ["itemid", "modelid"], ["name", "price"]
+    )
+
+
+def test_change_filter_remembers_only_committed_rows():
+    # 寫入失敗 (沒有 commit) 的資料下一次仍要寫入
+    change_filter = model_filter()
+    df = pd.DataFrame(
+        {
+            "itemid": [1, 1],
+            "modelid": [10, 11],
+            "name": ["a", "b"],
+            "price": [1.0, None],
+        }
+    )
+    assert len(change_filter(df)) == 2
+    assert len(change_filter(df)) == 2
+
+    change_filter.commit(df)
+    assert len(change_filter(df)) == 0
+    # NaN 與 None 視為相同
+    assert len(change_filter(df.astype(object))) == 0
+
+    changed = df.assign(price=[2.0, None])
+    assert list(change_filter(changed)["modelid"]) == [10]
+    assert dict(change_filter.counts) == {
+        "new": 4, "unchanged": 5, "changed": 1
+    }
+
+
+def decode_copy_line(line):
+    # Postgres 讀取 COPY text 格式的方式
+    fields = []
+    for field in line.split("\t"):
+        if field == "\\N":
+            fields.append(None)
+            continue
+        out, i = [], 0
+        while i < len(field):
+            if field[i] == "\\":
+                out.append({"t": "\t", "n": "\n", "r": "\r"}.get(
+                    field[i + 1], field[i + 1]
+                ))
+                i += 2
+            else:
+                out.append(field[i])
+                i += 1
+        fields.append("".join(out))
+    return fields
+
+
+def test_copy_text_escapes_special_characters():
+    table = db_model.shopee.ShopeeProduct.__table__
+    columns = [table.c.itemid, table.c.name, table.c.price, table.c.crawled_at]
+    now = datetime.datetime(2024, 1, 2, 3, 4, 5, 600000)
+    rows = [
+        (1, "tab\there\nnew\rline \\N back\\slash", 1.5, now),
+        (2, None, None, None),
+        (3, "\\", 100000.0, now),
+    ]
+    lines = writer.copy_text(columns, rows).getvalue().split("\n")
+    # 內容中的換行都被跳脫，最後一行之後只有一個換行
+    assert len(lines) == 4 and lines[-1] == ""
+    assert [decode_copy_line(line) for line in lines[:-1]] == [
+        [
+            "1", "tab\there\nnew\rline \\N back\\slash", "1.5",
+            "2024-01-02 03:04:05.600000"
+        ],
+        ["2", None, None, None],
+        ["3", "\\", "100000.0", "2024-01-02 03:04:05.600000"],
+    ]
+
+
+class FakeCursor:
+    def __init__(self, conn) -> None:
+        self.conn = conn
+
+    def copy_expert(self, sql, buf):
+        self.conn.statements.append(sql)
+        self.conn.copied.append(buf.getvalue())
+
+
+class FakeConnection:
+    # 記錄 BulkWriter 在 psycopg2 連線上執行的 SQL 與 COPY 的內容
+    def __init__(self) -> None:
+        self.dialect = type("Dialect", (), {"driver": "psycopg2"})()
+        self.connection = self
+        self.statements = []
+        self.copied = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def execute(self, stmt, *args):
+        self.statements.append(" ".join(str(stmt).split()))
+
+
+class FakeEngine:
+    def __init__(self) -> None:
+        self.transactions = []
+
+    @contextlib.contextmanager
+    def begin(self):
+        conn = FakeConnection()
+        yield conn
+        self.transactions.append(conn)
+
+
+def test_copy_upsert_statements():
+    engine = FakeEngine()
+    committed = []
+    df = pd.DataFrame(
+        {
+            "itemid": [1, 2, 1],
+            "shopid": [7, 7, 7],
+            "name": ["a", "b", "a2"],
+            "price": [1.0, float("nan"), 3.0],
+            "crawled_at": [datetime.datetime(2024, 1, 1)] * 3,
+        }
+    )
+    written = writer.BulkWriter(engine, batch_size=2).write(
+        db_model.shopee.ShopeeProduct,
+        df,
+        current_model=db_model.shopee.ShopeeProductCurrent,
+        keys=["shopid", "itemid"],
+        on_commit=committed.append,
+    )
+    assert written == 3
+    # 每個批次一個 transaction，commit 後才呼叫 on_commit
+    assert len(engine.transactions) == 2
+    assert [list(batch["itemid"]) for batch in committed] == [[1, 2], [1]]
+
+    conn = engine.transactions[0]
+    assert conn.statements == [
+        "COPY shopee_product (itemid, shopid, name, price, crawled_at) "
+        "FROM STDIN",
+        "CREATE TEMP TABLE shopee_product_current_staging ON COMMIT DROP AS "
+        "SELECT itemid, shopid, name, price, crawled_at "
+        "FROM shopee_product_current WITH NO DATA",
+        "COPY shopee_product_current_staging "
+        "(itemid, shopid, name, price, crawled_at) FROM STDIN",
+        "INSERT INTO shopee_product_current "
+        "(itemid, shopid, name, price, crawled_at) "
+        "SELECT itemid, shopid, name, price, crawled_at "
+        "FROM shopee_product_current_staging "
+        "ON CONFLICT (shopid, itemid) DO UPDATE SET name = EXCLUDED.name, "
+        "price = EXCLUDED.price, crawled_at = EXCLUDED.crawled_at, "
+        "write_txid = txid_current()",
+    ]
+    # NaN 寫成 NULL
+    assert conn.copied[0] == (
+        "1\t7\ta\t1.0\t2024-01-01 00:00:00\n"
+        "2\t7\tb\t\\N\t2024-01-01 00:00:00\n"
+    )
+
+
+def test_upsert_keeps_last_row_per_key():
+    conn = FakeConnection()
+    table = db_model.shopee.ShopeeProduct.__table__
+    columns = [table.c.itemid, table.c.shopid, table.c.name]
+    writer.BulkWriter(None)._upsert(
+        conn,
+        db_model.shopee.ShopeeProductCurrent.__table__,
+        columns,
+        [(1, 7, "old"), (2, 7, "b"), (1, 7, "new")],
+        ["shopid", "itemid"],
+    )
+    # 同一批中重複的鍵會讓 ON CONFLICT 失敗，只留最後一筆
+    assert conn.copied == ["1\t7\tnew\n2\t7\tb\n"]
@@ -0,0 +1,205 @@
+import os
+import socket
+import asyncio
+import datetime
+import typing
+
+import sqlalchemy as sa
+
+import db_model
+import search_cache
+
+# 一種工作的處理函式: payload -> 要再放進佇列的新工作 [(kind, payload), ...]
+Handler = typing.Callable[[dict], typing.Awaitable[typing.List[tuple]]]
+
+
+# 存在 Postgres crawl_task 資料表中的工作佇列
+#
+# 領取時以 SELECT ... FOR UPDATE SKIP LOCKED 避免多個 worker 拿到同一個工作，
+# 並設定 lease_until；處理中的工作會定期延長 lease，worker 死掉時 lease 過期，
+# 工作會被其他 worker 重新領取。失敗的工作延後重試，超過 max_attempts 次
+# 標記為 failed。時間一律使用資料庫的時鐘，不同機器的 worker 不需要對時。
+class WorkQueue:
+    def __init__(
+        self,
+        engine,
+        lease_seconds: float = 300,
+        max_attempts: int = 5,
+        worker: str = None,
+    ) -> None:
+        self.engine = engine
+        self.lease = datetime.timedelta(seconds=lease_seconds)
+        self.max_attempts = max_attempts
+        self.worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+        self.table = db_model.crawl.CrawlTask.__table__
+
+    def enqueue(self, run_id: int, tasks: typing.List[tuple], conn=None):
+        if not tasks:
+            return
+        rows = [
+            {
+                "run_id": run_id,
+                "kind": kind,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "created_at": datetime.datetime.now(),
+            } for kind, payload in tasks
+        ]
+        if conn is not None:
+            conn.execute(self.table.insert(), rows)
+            return
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+
+    def claim(self, n: int) -> typing.List[dict]:
+        t = self.table
+        claimable = sa.select(t.c.id).where(
+            t.c.status == "pending",
+            t.c.attempts < self.max_attempts,
+            sa.or_(t.c.lease_until.is_(None), t.c.lease_until < sa.func.now()),
+        ).order_by(t.c.id).limit(n).with_for_update(skip_locked=True)
+
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                t.update().where(t.c.id.in_(claimable)).values(
+                    lease_until=sa.func.now() + self.lease,
+                    attempts=t.c.attempts + 1,
+                    worker=self.worker,
+                ).returning(t.c.id, t.c.run_id, t.c.kind, t.c.payload)
+            ).all()
+        return [row._asdict() for row in rows]
+
+    def extend(self, task_ids: typing.Iterable[int]):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                t.update().where(
+                    t.c.id.in_(task_ids), t.c.worker == self.worker,
+                    t.c.status == "pending"
+                ).values(lease_until=sa.func.now() + self.lease)
+            )
+
+    def ack(self, task: dict, new_tasks: typing.List[tuple] = ()):
+        t = self.table
+        with self.engine.begin() as conn:
+            result = conn.execute(
+                t.update().where(
+                    t.c.id == task["id"], t.c.worker == self.worker,
+                    t.c.status == "pending"
+                ).values(status="done", finished_at=sa.func.now())
+            )
+            # lease 已過期並被其他 worker 領走時，由那個 worker 產生後續工作
+            if result.rowcount == 1:
+                self.enqueue(task["run_id"], new_tasks, conn=conn)
+
+    def fail(self, task: dict, error: str):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(
+                t.update().where(
+                    t.c.id == task["id"], t.c.worker == self.worker,
+                    t.c.status == "pending"
+                ).values(
+                    status=sa.case(
+                        (t.c.attempts >= self.max_attempts, "failed"),
+                        else_="pending"
+                    ),
+                    # 以次數遞增的間隔延後重試
+                    lease_until=sa.func.now() +
+                    sa.func.make_interval(0, 0, 0, 0, 0, 0, t.c.attempts * 30),
+                    error=error,
+                )
+            )
+
+    def finish_runs(self):
+        run = db_model.crawl.CrawlRun.__table__
+        t = self.table
+        with self.engine.begin() as conn:
+            # worker 死掉次數過多的工作也不再重試
+            conn.execute(
+                t.update().where(
+                    t.c.status == "pending",
+                    t.c.attempts >= self.max_attempts,
+                    t.c.lease_until < sa.func.now(),
+                ).values(status="failed", error="lease expired")
+            )
+            finished = conn.execute(
+                run.update().where(
+                    run.c.finished_at.is_(None),
+                    sa.exists().where(t.c.run_id == run.c.id),
+                    ~sa.exists().where(
+                        t.c.run_id == run.c.id, t.c.status == "pending"
+                    ),
+                ).values(finished_at=sa.func.now())
+            )
+            if finished.rowcount > 0:
+                search_cache.bump_data_version(conn)
+
+    async def _heartbeat(self, running: dict):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.lease.total_seconds() / 3)
+            await loop.run_in_executor(None, self.extend, list(running))
+
+    async def _process(self, handlers: typing.Dict[str, Handler], task):
+        loop = asyncio.get_running_loop()
+        try:
+            handler = handlers[task["kind"]]
+            new_tasks = await handler(task["payload"])
+        except Exception as e:
+            print("task failed", task["id"], task["kind"], repr(e))
+            await loop.run_in_executor(None, self.fail, task, repr(e))
+            return
+        await loop.run_in_executor(None, self.ack, task, new_tasks)
+
+    async def work(
+        self,
+        handlers: typing.Dict[str, Handler],
+        concurrency: int = 16,
+        poll_seconds: float = 2.0,
+        idle_seconds: float = 30.0,
+    ):
+        # 持續領取工作直到佇列空了 idle_seconds 秒
+        loop = asyncio.get_running_loop()
+        running = {}
+        idle_since = None
+        heartbeat = asyncio.ensure_future(self._heartbeat(running))
+        try:
+            while True:
+                if len(running) < concurrency:
+                    for task in await loop.run_in_executor(
+                        None, self.claim, concurrency - len(running)
+                    ):
+                        running[task["id"]] = asyncio.ensure_future(
+                            self._process(handlers, task)
+                        )
+
+                if not running:
+                    await loop.run_in_executor(None, self.finish_runs)
+                    if idle_since is None:
+                        idle_since = loop.time()
+                    elif loop.time() - idle_since > idle_seconds:
+                        return
+                    await asyncio.sleep(poll_seconds)
+                    continue
+
+                idle_since = None
+                await asyncio.wait(
+                    running.values(),
+                    timeout=poll_seconds,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                for task_id, future in list(running.items()):
+                    if future.done():
+                        del running[task_id]
+        finally:
+            heartbeat.cancel()
+            for future in running.values():
+                future.cancel()
+            await asyncio.gather(
+                heartbeat, *running.values(), return_exceptions=True
+            )
@@ -0,0 +1,219 @@
+import io
+import typing
+import collections
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+def _escape(text: str) -> str:
+    # COPY text 格式的跳脫規則
+    return (
+        text.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def _formatter(column: sa.Column) -> typing.Callable:
+    if isinstance(column.type, sa.Integer):
+        return lambda v: str(int(v))
+    if isinstance(column.type, sa.Float):
+        return lambda v: repr(float(v))
+    if isinstance(column.type, (sa.DateTime, sa.Date)):
+        return lambda v: v.isoformat(sep=" ")
+    return lambda v: _escape(str(v))
+
+
+def copy_text(columns: typing.List[sa.Column], rows) -> io.StringIO:
+    # COPY ... FROM STDIN 的 text 格式: 欄位以 tab 分隔，NULL 為 \N
+    formatters = [_formatter(c) for c in columns]
+    buf = io.StringIO()
+    for row in rows:
+        buf.write(
+            "\t".join(
+                "\\N" if v is None else fmt(v)
+                for fmt, v in zip(formatters, row)
+            )
+        )
+        buf.write("\n")
+    buf.seek(0)
+    return buf
+
+
+# 以 COPY 批次寫入爬蟲結果，每個批次一個 transaction
+#
+# history_model 為只增不改的歷史表；若指定 current_model 與 keys，
+# 同一批資料也會在同一個 transaction 內 upsert 到最新狀態表。
+# 每個批次 commit 後以該批次的資料 (df 的一部分) 呼叫 on_commit。
+# 非 psycopg2 連線時改用 executemany。
+class BulkWriter:
+    def __init__(self, engine, batch_size: int = 10000) -> None:
+        self.engine = engine
+        self.batch_size = batch_size
+
+    def write(
+        self,
+        history_model,
+        df: pd.DataFrame,
+        current_model=None,
+        keys: typing.Optional[typing.List[str]] = None,
+        on_commit: typing.Callable[[pd.DataFrame], typing.Any] = None,
+    ) -> int:
+        source = df
+        table = history_model.__table__
+        columns = [c for c in table.c if c.name in df.columns]
+        df = df[[c.name for c in columns]]
+        # NaN / NaT 一律視為 NULL
+        df = df.astype(object).where(df.notna(), None)
+
+        written = 0
+        for start in range(0, len(df), self.batch_size):
+            batch = df.iloc[start:start + self.batch_size]
+            rows = list(batch.itertuples(index=False, name=None))
+
+            with self.engine.begin() as conn:
+                self._insert(conn, table, columns, rows)
+                if current_model is not None:
+                    self._upsert(
+                        conn, current_model.__table__, columns, rows, keys
+                    )
+            written += len(rows)
+            if on_commit is not None:
+                on_commit(source.iloc[start:start + self.batch_size])
+        return written
+
+    def _use_copy(self, conn) -> bool:
+        return conn.dialect.driver == "psycopg2"
+
+    def _copy(self, conn, table_name, columns, rows):
+        buf = copy_text(columns, rows)
+        cursor = conn.connection.cursor()
+        cursor.copy_expert(
+            "COPY {} ({}) FROM STDIN".format(
+                table_name, ", ".join(c.name for c in columns)
+            ), buf
+        )
+
+    def _insert(self, conn, table, columns, rows):
+        if self._use_copy(conn):
+            self._copy(conn, table.name, columns, rows)
+        else:
+            conn.execute(
+                table.insert(),
+                [dict(zip((c.name for c in columns), row)) for row in rows]
+            )
+
+    def _upsert(self, conn, table, columns, rows, keys):
+        columns = [c for c in columns if c.name in table.c]
+        names = [c.name for c in columns]
+        key_positions = [names.index(k) for k in keys]
+
+        # 同一批資料中重複的商品只保留最後一筆，否則 ON CONFLICT 會失敗
+        latest = {}
+        for row in rows:
+            latest[tuple(row[i] for i in key_positions)] = row
+        rows = [tuple(row[names.index(c.name)] for c in columns)
+                for row in latest.values()]
+
+        updates = [n for n in names if n not in keys]
+        # 有 write_txid 的表: 新增時由 server_default、更新時在這裡設為寫入的
+        # transaction id
+        touch = "write_txid" in table.c and "write_txid" not in names
+
+        if self._use_copy(conn):
+            staging = "{}_staging".format(table.name)
+            conn.execute(
+                sa.text(
+                    "CREATE TEMP TABLE {} ON COMMIT DROP AS "
+                    "SELECT {} FROM {} WITH NO DATA".format(
+                        staging, ", ".join(names), table.name
+                    )
+                )
+            )
+            self._copy(conn, staging, columns, rows)
+            conn.execute(
+                sa.text(
+                    "INSERT INTO {table} ({cols}) SELECT {cols} FROM {staging} "
+                    "ON CONFLICT ({keys}) DO UPDATE SET {updates}".format(
+                        table=table.name,
+                        cols=", ".join(names),
+                        staging=staging,
+                        keys=", ".join(keys),
+                        updates=", ".join(
+                            ["{0} = EXCLUDED.{0}".format(n) for n in updates] +
+                            (["write_txid = txid_current()"] if touch else [])
+                        ),
+                    )
+                )
+            )
+        else:
+            stmt = postgresql.insert(table)
+            set_ = {n: stmt.excluded[n] for n in updates}
+            if touch:
+                set_["write_txid"] = sa.func.txid_current()
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_=set_)
+            conn.execute(stmt, [dict(zip(names, row)) for row in rows])
+
+
+# 以最新狀態表為基準，只留下新商品或內容有變動的資料
+#
+# 第一次使用時載入每個商品的內容 hash，之後以 commit (交給 BulkWriter 的
+# on_commit) 記錄已寫入的資料，寫入失敗的資料下一次仍視為有變動。
+# 同一個 run 中的多次呼叫會共用同一份狀態。
+class ChangeFilter:
+    def __init__(
+        self, engine, current_model, keys: typing.List[str],
+        fields: typing.List[str]
+    ) -> None:
+        self.engine = engine
+        self.table = current_model.__table__
+        self.keys = keys
+        self.fields = fields
+        self.counts = collections.Counter()
+        self._hashes = None
+
+    def _load(self):
+        self._hashes = {}
+        stmt = sa.select(*[self.table.c[n] for n in self.keys + self.fields])
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(stmt)
+            for row in result:
+                self._hashes[tuple(row[:len(self.keys)])
+                             ] = hash(tuple(row[len(self.keys):]))
+
+    def _hash_rows(self, df: pd.DataFrame) -> typing.Iterator[tuple]:
+        # (key, 內容的 hash)；NaN 與 None 須視為相同的值
+        values = df[self.keys + self.fields].astype(object)
+        values = values.where(values.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            yield row[:len(self.keys)], hash(row[len(self.keys):])
+
+    def __call__(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self._hashes is None:
+            self._load()
+
+        # 同一批中重複的商品與前一筆比較
+        seen = {}
+        keep = []
+        for key, content_hash in self._hash_rows(df):
+            old_hash = seen.get(key, self._hashes.get(key))
+
+            if old_hash is None:
+                self.counts["new"] += 1
+            elif old_hash != content_hash:
+                self.counts["changed"] += 1
+            else:
+                self.counts["unchanged"] += 1
+                keep.append(False)
+                continue
+
+            seen[key] = content_hash
+            keep.append(True)
+
+        return df[keep]
+
+    def commit(self, df: pd.DataFrame):
+        # 資料寫入並 commit 之後才記錄，之後內容相同的資料才會被略過
+        for key, content_hash in self._hash_rows(df):
+            self._hashes[key] = content_hash